@@ -0,0 +1,178 @@
+import sys
+import time
+import tkinter as tk
+import traceback
+
+from metrics import REGISTRY
+
+
+def linear(t):
+    return t
+
+
+def ease_out_cubic(t):
+    return 1 - (1 - t) ** 3
+
+
+class Tween:
+    """A running animation; ``on_frame`` receives eased progress from 0 to 1"""
+
+    def __init__(self, duration_ms, on_frame, on_done, easing, started_at):
+        self.duration = duration_ms / 1000
+        self.on_frame = on_frame
+        self.on_done = on_done
+        self.easing = easing
+        self.started_at = started_at
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class PeriodicJob:
+    """A callback repeated every ``interval_ms`` by the scheduler"""
+
+    def __init__(self, interval_ms, callback, next_due, pause_when_hidden):
+        self.interval = interval_ms / 1000
+        self.callback = callback
+        self.next_due = next_due
+        self.pause_when_hidden = pause_when_hidden
+        self.cancelled = False
+        # Set while the callback keeps raising, so each failure run is reported once
+        self.failing = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FrameScheduler:
+    """Drives every animation and periodic UI job from one ``root.after`` chain
+
+    Tweens advance once per frame while any are running. Otherwise the
+    scheduler sleeps until the next periodic job is due, so jobs that fall
+    due together share a tick. While the window is minimized, jobs marked
+    ``pause_when_hidden`` are skipped and the scheduler only wakes up
+    occasionally to notice the window coming back.
+
+    How late each tick fires compared to when it was scheduled is recorded
+    as ``ui_tick_lag_ms``; a growing lag means something is blocking the
+    Tk thread.
+
+    An exception from a tween or job is passed to ``on_error`` as a
+    message (default: printed with its traceback) and the remaining jobs
+    still run, so one failing job cannot stop the others.
+    """
+
+    def __init__(self, root, frame_interval_ms=16, idle_check_ms=500, metrics=REGISTRY, on_error=None):
+        self.root = root
+        self.metrics = metrics
+        self.on_error = on_error
+        self.frame_interval_ms = frame_interval_ms
+        self.idle_check_ms = idle_check_ms
+        self._tweens = []
+        self._jobs = []
+        self._after_id = None
+        self._next_tick = None
+
+    def animate(self, duration_ms, on_frame, on_done=None, easing=ease_out_cubic):
+        """Start a tween and return it so it can be cancelled"""
+        tween = Tween(duration_ms, on_frame, on_done, easing, time.monotonic())
+        self._tweens.append(tween)
+        self._wake(0)
+        return tween
+
+    def every(self, interval_ms, callback, pause_when_hidden=True):
+        """Run ``callback`` now and then every ``interval_ms``"""
+        job = PeriodicJob(interval_ms, callback, time.monotonic(), pause_when_hidden)
+        self._jobs.append(job)
+        self._wake(0)
+        return job
+
+    def stop(self):
+        """Cancel the pending tick"""
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+
+    def _visible(self):
+        try:
+            return self.root.state() not in ("iconic", "withdrawn")
+        except tk.TclError:
+            return False
+
+    def _wake(self, delay_ms):
+        """Make sure a tick happens within ``delay_ms``"""
+        due = time.monotonic() + delay_ms / 1000
+        if self._after_id is not None:
+            if self._next_tick <= due:
+                return
+            self.root.after_cancel(self._after_id)
+        self._next_tick = due
+        self._after_id = self.root.after(int(delay_ms), self._tick)
+
+    def _report(self, what, error):
+        self.metrics.counter("ui_job_errors_total").inc()
+        if self.on_error is None:
+            print(f"{what} failed:", file=sys.stderr)
+            traceback.print_exception(type(error), error, error.__traceback__)
+        else:
+            self.on_error(f"{what} failed: {error!r}")
+
+    def _tick(self):
+        self._after_id = None
+        now = time.monotonic()
+        self.metrics.summary("ui_tick_lag_ms", "Delay of scheduled UI ticks").observe(
+            max(0.0, now - self._next_tick) * 1000)
+        visible = True
+        try:
+            visible = self._run(now)
+        finally:
+            # Always keep the chain going, whatever the jobs did
+            self._schedule(now, visible)
+
+    def _run(self, now):
+        """Advance tweens and run due jobs; returns whether the window is visible"""
+        for tween in list(self._tweens):
+            progress = 1.0 if tween.duration <= 0 else min(1.0, (now - tween.started_at) / tween.duration)
+            finished = tween.cancelled or progress >= 1.0
+            try:
+                if not tween.cancelled:
+                    tween.on_frame(tween.easing(progress))
+                if finished and not tween.cancelled and tween.on_done:
+                    tween.on_done()
+            except tk.TclError:
+                # The animated window went away underneath us
+                finished = True
+            except Exception as e:
+                self._report("Animation", e)
+                finished = True
+            if finished:
+                self._tweens.remove(tween)
+
+        visible = self._visible()
+        self._jobs = [job for job in self._jobs if not job.cancelled]
+        for job in self._jobs:
+            if now < job.next_due or (job.pause_when_hidden and not visible):
+                continue
+            try:
+                job.callback()
+                job.failing = False
+            except Exception as e:
+                if not job.failing:
+                    job.failing = True
+                    self._report(f"UI job {getattr(job.callback, '__name__', job.callback)}", e)
+            job.next_due += job.interval
+            if job.next_due <= now:
+                # Skip missed intervals rather than bursting to catch up
+                job.next_due = now + job.interval
+        return visible
+
+    def _schedule(self, now, visible):
+        if self._tweens:
+            self._wake(self.frame_interval_ms)
+        elif self._jobs:
+            due = [job.next_due for job in self._jobs if visible or not job.pause_when_hidden]
+            delay_ms = (min(due) - now) * 1000 if due else self.idle_check_ms
+            if not visible:
+                delay_ms = max(delay_ms, self.idle_check_ms)
+            self._wake(max(delay_ms, 0))
@@ -0,0 +1,237 @@
+import argparse
+import json
+import os
+import platform
+import queue
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from estop import EStopChannel
+from hospital_map import HospitalMap
+from robot_engine import RobotEngine
+from robot_link import RobotConnection
+from sim_server import SimServer
+
+BENCHMARK_VERSION = 3
+MAP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hospital_map.json")
+
+
+def summarize(samples_ms, failures=0):
+    """Reduce latency samples to the numbers we compare across releases"""
+    result = {"count": len(samples_ms), "failures": failures}
+    if not samples_ms:
+        return result
+    ordered = sorted(samples_ms)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))]
+
+    result.update({
+        "min": ordered[0],
+        "mean": sum(ordered) / len(ordered),
+        "p50": percentile(50),
+        "p95": percentile(95),
+        "p99": percentile(99),
+        "max": ordered[-1],
+    })
+    return {key: round(value, 3) if isinstance(value, float) else value for key, value in result.items()}
+
+
+def bench_connect(host, port, iterations):
+    samples, failures = [], 0
+    for _ in range(iterations):
+        link = RobotConnection(host, port)
+        started = time.perf_counter()
+        if link.connect(force=True):
+            samples.append((time.perf_counter() - started) * 1000)
+        else:
+            failures += 1
+        link.close()
+    return summarize(samples, failures)
+
+
+def bench_instructions(engine, iterations):
+    samples, failures = [], 0
+    for _ in range(iterations):
+        started = time.perf_counter()
+        try:
+            engine.send("wait,0").result(5)
+            samples.append((time.perf_counter() - started) * 1000)
+        except Exception:
+            failures += 1
+    return summarize(samples, failures)
+
+
+def bench_routes(engine, routes, upload, iterations):
+    samples, failures = [], 0
+    for _ in range(iterations):
+        for route in routes:
+            started = time.perf_counter()
+            try:
+                ok = engine.run_route(route, upload=upload).result(route.total_duration / 1000 + 10)
+            except Exception:
+                ok = False
+            if ok:
+                samples.append((time.perf_counter() - started) * 1000)
+            else:
+                failures += 1
+    return summarize(samples, failures)
+
+
+def bench_estop(host, port, engine, iterations):
+    results = queue.Queue()
+    channel = EStopChannel(host, port, shared_link=engine, on_result=results.put)
+    channel.start()
+    samples, failures = [], 0
+    try:
+        for _ in range(iterations):
+            channel.trigger()
+            result = results.get(timeout=channel.retry_window + 5)
+            if result.acknowledged:
+                samples.append(result.latency_ms)
+            else:
+                failures += 1
+    finally:
+        channel.stop()
+    return summarize(samples, failures)
+
+
+def bench_preview(hospital_map, iterations, sizes=(1, 4, 8, 16, 32, 64, 256)):
+    """Median time to simulate batches of trips each way, and whether both agree"""
+    # Imported here so the network benchmarks do not need the preview module
+    import preview
+
+    model = preview.KinematicModel.from_map(hospital_map)
+    table = list(hospital_map.destination_table().values())
+    x, y = hospital_map.nodes[hospital_map.start]
+    results = {"numpy": preview.np is not None, "threshold": preview.VECTORIZE_MIN_ROUTES}
+    for size in sizes:
+        routes = [table[i % len(table)] for i in range(size)]
+        starts = [(x, y, hospital_map.start_heading + 15 * i) for i in range(size)]
+        entry = {}
+        for name, vectorize in (("per_step_ms", False), ("batch_ms", True)):
+            if vectorize and preview.np is None:
+                continue
+            samples = []
+            for _ in range(iterations):
+                started = time.perf_counter()
+                for trajectory in preview.simulate(routes, starts, model, vectorize):
+                    trajectory.eta_ms
+                samples.append((time.perf_counter() - started) * 1000)
+            entry[name] = summarize(samples)["p50"]
+        if preview.np is not None:
+            entry["batch_matches"] = preview.batch_matches(preview.batch_difference(routes, starts, model))
+        results[str(size)] = entry
+    return results
+
+
+def bench_reconnect(engine, sim, iterations, timeout=30):
+    connected = threading.Event()
+    disconnected = threading.Event()
+
+    def on_state_change(is_connected):
+        (connected if is_connected else disconnected).set()
+
+    engine.on_state_change = on_state_change
+    samples, failures = [], 0
+    for _ in range(iterations):
+        connected.clear()
+        disconnected.clear()
+        started = time.perf_counter()
+        sim.drop_clients()
+        if disconnected.wait(timeout) and connected.wait(timeout):
+            samples.append((time.perf_counter() - started) * 1000)
+        else:
+            failures += 1
+    engine.on_state_change = None
+    return summarize(samples, failures)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(args):
+    sim = None
+    if args.target:
+        host, _, port = args.target.partition(":")
+        port = int(port or 5001)
+    else:
+        sim = SimServer(port=0, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                        loss=args.loss, speed=args.speed, seed=args.seed).start_in_thread()
+        host, port = sim.host, sim.port
+
+    hospital_map = HospitalMap.load(args.map)
+    routes = list(hospital_map.destination_table().values())
+    engine = RobotEngine(host, port, check_interval=args.check_interval)
+    engine.start()
+    results = {}
+    try:
+        results["connect_ms"] = bench_connect(host, port, args.iterations)
+        results["instruction_ms"] = bench_instructions(engine, args.iterations)
+        results["route_sequenced_ms"] = bench_routes(engine, routes, True, args.iterations)
+        # The legacy modes only run when sequenced steps are off
+        engine.sequenced = False
+        results["route_upload_ms"] = bench_routes(engine, routes, True, args.iterations)
+        if args.route_stream_iterations:
+            results["route_stream_ms"] = bench_routes(engine, routes, False, args.route_stream_iterations)
+        engine.sequenced = True
+        results["estop_ms"] = bench_estop(host, port, engine, args.iterations)
+        if sim is not None and args.reconnect_iterations:
+            results["reconnect_ms"] = bench_reconnect(engine, sim, args.reconnect_iterations)
+        if args.preview_iterations:
+            results["preview"] = bench_preview(hospital_map, args.preview_iterations)
+    finally:
+        engine.shutdown()
+        if sim is not None:
+            sim.stop_thread()
+
+    return {
+        "benchmark_version": BENCHMARK_VERSION,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless latency and throughput benchmarks")
+    parser.add_argument("--target", help="host[:port] of a real robot; default is a local simulator")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--route-stream-iterations", type=int, default=1,
+                        help="streamed routes include movement sleeps, so keep this low")
+    parser.add_argument("--reconnect-iterations", type=int, default=5)
+    parser.add_argument("--preview-iterations", type=int, default=200,
+                        help="route preview simulations per batch size, with and without NumPy")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--loss", type=float, default=0.0)
+    parser.add_argument("--speed", type=float, default=100.0, help="simulated clock speed-up")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--check-interval", type=float, default=2.0, help="engine link check period")
+    parser.add_argument("--map", default=MAP_FILE)
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    report = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,3 @@
-import socket
 import tkinter as tk
 from tkinter import Toplevel, Label, font, messagebox, ttk
 import threading
@@ -6,45 +5,87 @@ import time
 from datetime import datetime
 import os
 
-# Robot connection settings
-TCP_IP = '192.168.1.55'  # Pi's IP
-TCP_PORT = 5001
+from animation import FrameScheduler
+from config import load_config
+from metrics import REGISTRY, MetricsExporter
+from missions import MissionQueue, MissionState, Priority
+from oplog import Journal, RingBuffer
+from preview import RoutePreviewer
+from robot_client import DESTINATIONS, MAP_FILE, client_from_config, load_hospital_map
+from robot_process import IsolatedClient
+from telemetry import decimate
+from ui_queue import UIUpdateQueue
 
-# Paths for each destination (pre-programmed sequences)
-DESTINATIONS = {
-    "ICU 1": [
-        "forward,2000",
-        "left,5000",
-        "forward,10000",
-        "done,0"
-    ],
-    "ICU 2": [
-        "forward,15000",
-        "right,5000",
-        "forward,10000",
-        "done,0"
-    ],
-    "Room 1": [
-        "forward,8000",
-        "left,5000",
-        "forward,12000",
-        "done,0"
-    ],
-    "Room 2": [
-        "forward,8000",
-        "right,5000",
-        "forward,12000",
-        "done,0"
-    ]
+# Robot address, protocol options and file locations come from
+# ~/.hmetv/config.json and HMETV_* environment variables (see config.py).
+# Without a configured address the last known robot is used, or the
+# local subnet is scanned for one.
+
+# The log view only keeps the newest lines; everything goes to the journal
+LOG_VIEW_LINES = 500
+
+# Timed sections slower than this (ms) are written to the operation log
+SLOW_CALL_MS = {
+    "robot_connect_ms": 500,
+    "robot_send_ms": 100,
+}
+
+# The telemetry chart shows this many seconds of motor current, scaled to CURRENT_SCALE_A
+TELEMETRY_WINDOW_S = 20
+CURRENT_SCALE_A = 3.0
+
+# Launch to first painted frame (ms); slower starts are written to the operation log
+FIRST_FRAME_TARGET_MS = 300
+
+# Route preview colors: hallways, queued tour, previewed trip
+PREVIEW_COLORS = {"hall": "#DDDDDD", "tour": "#F39C12", "trip": "#3498DB", "cart": "#2C3E50"}
+
+# Bright/dark pulse colors of the status indicator for each link grade
+PULSE_COLORS = {
+    "good": ("#2ECC71", "#27AE60"),
+    "unknown": ("#2ECC71", "#27AE60"),
+    "fair": ("#F1C40F", "#D4AC0D"),
+    "poor": ("#E67E22", "#CA6F1E"),
+    "down": ("#E74C3C", "#C0392B"),
 }
 
 class ModernHospitalRobotGUI:
-    def __init__(self, root):
+    def __init__(self, root, config=None, started_at=None):
+        # Startup phases are timed from launch to the first painted frame
+        self.started_at = started_at or time.perf_counter()
+        self.startup_phases = [("tk", time.perf_counter())]
         self.root = root
         self.root.title("Heals on Wheels - HMETV Control System")
         self.root.geometry("900x700")
         self.root.configure(bg="#FFFFFF")
         self.root.resizable(True, True)
+        self.config = config or load_config()
+        
+        # Robot control; the widgets below are a view over this client. Finding
+        # the robot can take a subnet scan, so the client is created on a
+        # background thread and both stay None until it is ready.
+        self.client = None
+        self.missions = None
+        # Why the robot link could not be started, if it could not
+        self.client_error = None
+        self.hospital_map = load_hospital_map(MAP_FILE)
+        # ETA and path of every destination, refreshed whenever the queue or position changes
+        self.previewer = RoutePreviewer(self.hospital_map)
+        self.preview_destination = None
+        self.link_grade = "down"
+        self.startup_phases.append(("config", time.perf_counter()))
+        
+        # One scheduler drives every animation and periodic UI update
+        self.animator = FrameScheduler(root, on_error=self.log)
+        
+        # Log and status writes from any thread are queued and applied in batches
+        self.ui = UIUpdateQueue(self._write_log_lines)
+        self.log_ring = RingBuffer(LOG_VIEW_LINES)
+        self.journal = Journal(self.config["journal_dir"])
+        self.journal.start()
+        self.animator.every(50, self.ui.drain, pause_when_hidden=False)
+        self.metrics_exporter = MetricsExporter(self.config["metrics_file"]).start()
+        REGISTRY.profile_hook = self._report_slow_call
         
         # Set custom theme and styling
         self.set_styles()
@@ -64,15 +105,113 @@ class ModernHospitalRobotGUI:
         
         # Initialize connection status
         self.robot_connected = False
-        self.check_connection()
-        
-        # Start periodic connection check
-        self.connection_thread = threading.Thread(target=self.periodic_connection_check)
-        self.connection_thread.daemon = True
-        self.connection_thread.start()
         
         # Create pulse animation for status
-        self.pulse_animation()
+        self.animator.every(800, self.pulse_animation)
+        
+        # Closing the window cancels routes and stops every background thread
+        self.closed = False
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
+        
+        # Popups are built once, after the first frame, and then only shown and hidden
+        self.estop_popup = None
+        self.estop_hide_id = None
+        self.toast = None
+        self.toast_hide_id = None
+        self.toast_tween = None
+        self.refresh_previews()
+        self.startup_phases.append(("widgets", time.perf_counter()))
+        self.root.after_idle(self._first_frame)
+        
+        self.log("Looking for the robot...")
+        threading.Thread(target=self._create_client, name="robot-resolve", daemon=True).start()
+        
+    def _first_frame(self):
+        """Record startup timings once the window has been painted"""
+        self.root.update_idletasks()
+        now = time.perf_counter()
+        self.startup_phases.append(("first_frame", now))
+        previous = self.started_at
+        parts = []
+        for phase, at in self.startup_phases:
+            REGISTRY.gauge("ui_startup_ms", "Time spent in each startup phase", phase=phase).set(
+                (at - previous) * 1000)
+            parts.append(f"{phase} {(at - previous) * 1000:.0f}")
+            previous = at
+        total_ms = (now - self.started_at) * 1000
+        REGISTRY.gauge("ui_first_frame_ms", "Launch to first painted frame").set(total_ms)
+        message = f"First frame after {total_ms:.0f} ms ({', '.join(parts)} ms)"
+        if total_ms > FIRST_FRAME_TARGET_MS:
+            message += f", over the {FIRST_FRAME_TARGET_MS} ms target"
+        self.log(message)
+        self._build_popups()
+    
+    def _create_client(self):
+        """Find the robot and build its client; runs on a background thread"""
+        try:
+            self._start_client()
+        except Exception as e:
+            # Discovery, config, the recorder or the core process; without
+            # this the window would look for the robot forever
+            self.log(f"Cannot start the robot link: {e!r}")
+            self.ui.call(self._client_failed, e)
+
+    def _start_client(self):
+        callbacks = dict(
+            log=self.log,
+            on_state_change=lambda connected: self.ui.call(self.set_connection_state, connected),
+            on_estop=lambda result: self.ui.call(self._report_estop, result),
+            on_link_quality=lambda quality: self.ui.post_state("link", self.show_link_quality, quality)
+        )
+        mission_callbacks = dict(
+            on_change=lambda: self.ui.post_state("missions", self.show_missions),
+            on_mission=lambda mission: self.ui.call(self._mission_changed, mission)
+        )
+        if self.config["isolated_core"]:
+            # Robot I/O, routes, the mission queue and e-stops run in their own process
+            client = IsolatedClient(self.config, **callbacks, **mission_callbacks)
+        else:
+            client = client_from_config(self.config, hospital_map=self.hospital_map, **callbacks)
+        if self.closed:
+            client.close()
+            return
+        # The headless client owns all robot I/O on background threads and
+        # reports changes back to the Tk thread through the UI queue
+        client.start()
+        if self.config["isolated_core"]:
+            missions = client.missions
+        else:
+            # Deliveries are queued and merged into multi-stop tours
+            missions = MissionQueue(client, **mission_callbacks)
+        self.ui.call(self._client_ready, client, missions)
+        recorder = getattr(client, "recorder", None)
+        if recorder is not None:
+            # Fit the ETA model to this robot's recorded trips
+            try:
+                model = self.previewer.model.calibrated(recorder)
+            except (OSError, ValueError) as e:
+                self.log(f"ETA calibration failed: {e!r}")
+            else:
+                self.ui.call(self._set_preview_model, model)
+
+    def _client_failed(self, error):
+        self.client_error = error
+        self.set_status("Status: No robot link (see log)", "#E74C3C")
+    
+    def _client_ready(self, client, missions):
+        if self.closed:
+            client.close()
+            return
+        self.client = client
+        self.missions = missions
+        self.log(f"Robot address: {client.host}:{client.port}")
+        self.show_missions()
+    
+    def _set_preview_model(self, model):
+        self.previewer.model = model
+        if model.samples:
+            self.log(f"ETAs calibrated from {model.samples} recorded trips")
+        self.refresh_previews()
         
     def set_styles(self):
         """Set up custom styles for the application"""
@@ -159,8 +298,9 @@ class ModernHospitalRobotGUI:
         self.dest_frame.pack(fill=tk.BOTH, expand=True)
         
         # Create styled destination buttons
-        destinations = ["ICU 1", "ICU 2", "Room 1", "Room 2"]
+        destinations = list(self.hospital_map.destinations) if self.hospital_map else list(DESTINATIONS)
         self.destination_buttons = []
+        self.eta_labels = {}
         
         # Create card-like frame for each destination
         for i, dest in enumerate(destinations):
@@ -190,7 +330,17 @@ class ModernHospitalRobotGUI:
                 font=("Segoe UI", 13, "bold"),
                 bg="#FFFFFF"
             )
-            dest_label.pack(pady=5)
+            dest_label.pack(pady=(5, 0))
+            
+            # Estimated arrival if sent now, after the queued deliveries
+            self.eta_labels[dest] = tk.Label(
+                card_frame,
+                text="",
+                font=("Segoe UI", 9),
+                fg="#777777",
+                bg="#FFFFFF"
+            )
+            self.eta_labels[dest].pack()
             
             # Add button
             btn = tk.Button(
@@ -209,12 +359,40 @@ class ModernHospitalRobotGUI:
             )
             btn.pack(pady=(5, 15))
             self.destination_buttons.append(btn)
+            
+            # Hovering a card draws its trip on the route preview
+            for widget in (card_frame, btn):
+                widget.bind("<Enter>", lambda event, d=dest: self.set_preview_destination(d))
+                widget.bind("<Leave>", lambda event: self.set_preview_destination(None))
         
         # Configure grid weights
         self.dest_frame.columnconfigure(0, weight=1)
         self.dest_frame.columnconfigure(1, weight=1)
-        self.dest_frame.rowconfigure(0, weight=1)
-        self.dest_frame.rowconfigure(1, weight=1)
+        for row in range((len(destinations) + 1) // 2):
+            self.dest_frame.rowconfigure(row, weight=1)
+        
+        # Route preview: hallways, the queued tour and the hovered trip
+        self.preview_canvas = tk.Canvas(left_panel, height=150, bg="#FAFAFA", highlightthickness=1,
+                                        highlightbackground="#DDDDDD")
+        self.preview_canvas.pack(fill=tk.X, pady=(10, 0))
+        self.preview_canvas.bind("<Configure>", lambda event: self.draw_preview())
+        self.previews = {}
+        self.preview_tour = []
+        self.preview_location = None
+        
+        # STAT requests jump ahead of routine deliveries
+        self.stat_var = tk.BooleanVar(value=False)
+        stat_check = tk.Checkbutton(
+            left_panel,
+            text="STAT - deliver before routine requests",
+            variable=self.stat_var,
+            font=("Segoe UI", 11, "bold"),
+            fg="#C0392B",
+            bg="#F8F9FA",
+            activebackground="#F8F9FA",
+            cursor="hand2"
+        )
+        stat_check.pack(anchor=tk.W, pady=(10, 0))
         
         # Create emergency stop container
         emergency_container = ttk.Frame(left_panel, style="Light.TFrame")
@@ -241,6 +419,73 @@ class ModernHospitalRobotGUI:
         right_panel = ttk.Frame(content_frame, style="Light.TFrame")
         right_panel.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True, padx=10)
         
+        # Mission queue
+        queue_header = ttk.Label(
+            right_panel,
+            text="Mission Queue",
+            style="Header.TLabel",
+            background="#F8F9FA"
+        )
+        queue_header.pack(anchor=tk.W, pady=(0, 10))
+        
+        self.queue_list = tk.Listbox(
+            right_panel,
+            font=self.mono_font,
+            height=5,
+            bg="#FAFAFA",
+            fg="#333333",
+            bd=1,
+            relief=tk.SOLID,
+            activestyle="none"
+        )
+        self.queue_list.pack(fill=tk.X)
+        
+        queue_buttons = ttk.Frame(right_panel, style="Light.TFrame")
+        queue_buttons.pack(fill=tk.X, pady=(5, 15))
+        
+        self.queue_summary = tk.Label(
+            queue_buttons,
+            text="Queue empty",
+            font=("Segoe UI", 9),
+            bg="#F8F9FA",
+            fg="#777777"
+        )
+        self.queue_summary.pack(side=tk.LEFT)
+        
+        for text, command in (("Resume", self.resume_missions), ("Cancel Selected", self.cancel_mission)):
+            tk.Button(
+                queue_buttons,
+                text=text,
+                font=("Segoe UI", 10),
+                bg="#ECF0F1",
+                fg="#333333",
+                relief=tk.FLAT,
+                bd=0,
+                padx=8,
+                cursor="hand2",
+                command=command
+            ).pack(side=tk.RIGHT, padx=(5, 0))
+        self.queue_ids = []
+        
+        # Live telemetry: motor currents plus the latest battery and position
+        self.telemetry_label = tk.Label(
+            right_panel,
+            text="Telemetry: waiting for robot",
+            font=("Segoe UI", 9),
+            bg="#F8F9FA",
+            fg="#777777"
+        )
+        self.telemetry_label.pack(anchor=tk.W)
+        self.telemetry_canvas = tk.Canvas(right_panel, height=70, bg="#FAFAFA", highlightthickness=1,
+                                          highlightbackground="#DDDDDD")
+        self.telemetry_canvas.pack(fill=tk.X, pady=(2, 15))
+        self.telemetry_lines = [
+            self.telemetry_canvas.create_line(0, 0, 0, 0, fill=color, width=1)
+            for color in ("#3498DB", "#E67E22")
+        ]
+        self.telemetry_drawn = 0
+        self.animator.every(250, self.draw_telemetry)
+        
         # Add section header
         log_header = ttk.Label(
             right_panel,
@@ -295,6 +540,16 @@ class ModernHospitalRobotGUI:
             fg="#555555"
         )
         self.status_label.pack(side=tk.LEFT, padx=10)
+        
+        # Link quality from the heartbeat
+        self.link_label = tk.Label(
+            self.status_container,
+            text="Link: --",
+            font=("Segoe UI", 9),
+            bg="#F8F9FA",
+            fg="#777777"
+        )
+        self.link_label.pack(anchor=tk.W, padx=25)
 
     def create_status_bar(self):
         """Create a status bar at the bottom"""
@@ -324,136 +579,282 @@ class ModernHospitalRobotGUI:
             font=("Segoe UI", 9),
         )
         self.time_label.pack(side=tk.RIGHT, padx=10, pady=5)
-        self.update_time()
+        self.animator.every(1000, self.update_time)
     
     def update_time(self):
         """Update the time display in the status bar"""
         current_time = datetime.now().strftime("%I:%M:%S %p - %b %d, %Y")
         self.time_label.config(text=current_time)
-        self.root.after(1000, self.update_time)
     
     def pulse_animation(self):
         """Create a pulsing animation for the status indicator"""
-        if self.robot_connected:
-            current_color = self.status_canvas.itemcget(self.status_indicator, "fill")
-            if current_color == "#2ECC71":  # If bright green
-                new_color = "#27AE60"  # Slightly darker green
-            else:
-                new_color = "#2ECC71"  # Bright green
-        else:
-            current_color = self.status_canvas.itemcget(self.status_indicator, "fill")
-            if current_color == "#E74C3C":  # If bright red
-                new_color = "#C0392B"  # Slightly darker red
-            else:
-                new_color = "#E74C3C"  # Bright red
+        # Green when the link is healthy, shading to orange as it degrades
+        grade = self.link_grade if self.robot_connected else "down"
+        bright, dark = PULSE_COLORS[grade]
+        current_color = self.status_canvas.itemcget(self.status_indicator, "fill")
+        new_color = dark if current_color == bright else bright
         
         self.status_canvas.itemconfig(self.status_indicator, fill=new_color)
-        self.root.after(800, self.pulse_animation)  # Continue animation
     
-    def check_connection(self):
-        """Check if the robot is reachable"""
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(1)
-                s.connect((TCP_IP, TCP_PORT))
-                if not self.robot_connected:
-                    self.robot_connected = True
-                    self.status_label.config(text="Status: Connected", fg="#2ECC71")
-                    self.log("Robot connection established")
-                return True
-        except Exception:
-            if self.robot_connected:
-                self.robot_connected = False
-                self.status_label.config(text="Status: Disconnected", fg="#E74C3C")
-                self.log("Robot connection lost")
-            return False
+    def show_link_quality(self, quality):
+        """Show heartbeat RTT percentiles and loss under the status line"""
+        self.link_grade = quality["grade"]
+        rtt = quality["rtt_ms"]
+        if not quality["connected"]:
+            text = "Link: down"
+        elif not rtt["count"]:
+            text = "Link: no heartbeat"
+        else:
+            text = (f"Link: {quality['grade']} - RTT p50 {rtt['p50']:.0f} ms, "
+                    f"p95 {rtt['p95']:.0f} ms, p99 {rtt['p99']:.0f} ms, "
+                    f"loss {quality['loss']:.0%}")
+        self.link_label.config(text=text)
     
-    def periodic_connection_check(self):
-        """Periodically check the connection status"""
-        while True:
-            self.check_connection()
-            time.sleep(10)  # Check every 10 seconds
+    def draw_telemetry(self):
+        """Plot the newest motor currents, reduced to one min/max pair per pixel column"""
+        if self.client is None:
+            return
+        buffer = self.client.telemetry
+        if buffer.total == self.telemetry_drawn:
+            return
+        self.telemetry_drawn = buffer.total
+        count = int(self.config["telemetry_hz"] * TELEMETRY_WINDOW_S)
+        times, left, right = buffer.columns(("time", "left_current", "right_current"), count)
+        width = max(self.telemetry_canvas.winfo_width(), 10)
+        height = max(self.telemetry_canvas.winfo_height(), 10)
+        start = times[-1] - TELEMETRY_WINDOW_S
+        
+        for line, values in zip(self.telemetry_lines, (left, right)):
+            points = []
+            for t, value in zip(*decimate(times, values, width // 2)):
+                x = (t - start) / TELEMETRY_WINDOW_S * width
+                y = height - 2 - min(max(value, 0.0), CURRENT_SCALE_A) / CURRENT_SCALE_A * (height - 4)
+                points += (x, y)
+            if len(points) >= 4:
+                self.telemetry_canvas.coords(line, *points)
+        
+        last = buffer.last()
+        self.telemetry_label.config(
+            text=f"Telemetry: battery {last['battery']:.2f} V - motors {last['left_current']:.1f} / "
+                 f"{last['right_current']:.1f} A - position ({last['x']:.1f}, {last['y']:.1f}) m")
     
-    def send_instruction(self, instruction):
-        """Send an instruction to the robot"""
-        if not self.robot_connected and not self.check_connection():
-            #messagebox.showerror("Connection Error", "Cannot connect to the robot")
-            self.log("Connection Error: Cannot connect to the robot")
-            return False
-        
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect((TCP_IP, TCP_PORT))
-                s.sendall(instruction.encode('utf-8'))
-                self.log(f"Sent: {instruction}")
-                return True
-        except Exception as e:
-            error_msg = f"Failed to send: {e}"
-            self.log(error_msg)
-            messagebox.showerror("Send Error", error_msg)
-            return False
+    def set_connection_state(self, connected):
+        """Reflect a link change reported by the engine"""
+        if connected == self.robot_connected:
+            return
+        self.robot_connected = connected
+        if connected:
+            self.set_status("Status: Connected", "#2ECC71")
+            self.log("Robot connection established")
+        else:
+            self.set_status("Status: Disconnected", "#E74C3C")
+            self.log("Robot connection lost")
     
     def send_to_destination(self, destination):
-        """Send the robot to the selected destination"""
-        if destination not in DESTINATIONS:
-            self.log(f"Error: Unknown destination '{destination}'")
+        """Queue a delivery to the selected destination"""
+        if self.missions is None:
+            if self.client_error is not None:
+                self.log(f"No robot link: {self.client_error!r}")
+            else:
+                self.log("Still looking for the robot, try again in a moment")
             return
-        
-        self.status_label.config(text=f"Status: Moving to {destination}", fg="#F39C12")
-        self.log(f"Starting route to {destination}")
-        
-        # Show in-progress notification
-        self.show_toast(f"Robot moving to {destination}", "#3498DB")
-        
-        # Disable all destination buttons during operation
-        for button in self.destination_buttons:
-            button.config(state=tk.DISABLED)
-        
-        # Start a separate thread to send the instructions
-        threading.Thread(target=self._execute_path, args=(destination,)).start()
+        priority = Priority.STAT if self.stat_var.get() else Priority.ROUTINE
+        self.stat_var.set(False)
+        try:
+            self.missions.submit(destination, priority)
+        except ValueError as e:
+            self.log(f"Error: {e}")
     
-    def _execute_path(self, destination):
-        """Execute the path instructions in a separate thread"""
-        path = DESTINATIONS[destination]
-        success = True
-        
-        for instruction in path:
-            if not self.send_instruction(instruction):
-                success = False
-                break
-            
-            # Extract duration for simulating movement time
-            cmd, duration = instruction.split(',')
-            if cmd != "done" and duration.isdigit():
-                # Wait for a fraction of the actual duration to simulate movement
-                time.sleep(int(duration) / 5000)  # Convert ms to seconds with a divisor
-        
-        # Update status based on success
-        if success:
-            self.root.after(0, lambda: self.status_label.config(
-                text=f"Status: Arrived at {destination}", fg="#2ECC71"))
-            self.root.after(0, lambda: self.log(f"Successfully arrived at {destination}"))
-            self.root.after(0, lambda: self.show_toast(f"Delivery completed: {destination}", "#2ECC71"))
+    def _mission_changed(self, mission):
+        """Log and announce mission progress"""
+        label = f"{mission.destination} (STAT)" if mission.priority == Priority.STAT else mission.destination
+        if mission.state == MissionState.QUEUED:
+            if self.missions.paused:
+                self.log(f"Delivery to {label} interrupted, back in the queue")
+            else:
+                self.log(f"Queued delivery to {label}")
+        elif mission.state == MissionState.RUNNING:
+            self.set_status(f"Status: Moving to {mission.destination}", "#F39C12")
+            self.log(f"Starting route to {label}")
+            self.show_toast(f"Robot moving to {mission.destination}", "#3498DB")
+        elif mission.state == MissionState.DONE:
+            self.set_status(f"Status: Arrived at {mission.destination}", "#2ECC71")
+            self.log(f"Successfully arrived at {label}")
+            self.show_toast(f"Delivery completed: {mission.destination}", "#2ECC71")
+        elif mission.state == MissionState.FAILED:
+            self.set_status(f"Status: Failed!", "#FF0000")
+            self.log(f"Delivery to {label} failed")
+        elif mission.state == MissionState.CANCELLED:
+            self.log(f"Delivery to {label} cancelled")
+    
+    def show_missions(self):
+        """Refresh the mission queue list"""
+        missions = self.missions.missions()
+        self.queue_ids = [mission.id for mission in missions]
+        self.queue_list.delete(0, tk.END)
+        for mission in missions:
+            marker = ">" if mission.state == MissionState.RUNNING else " "
+            stat = " STAT" if mission.priority == Priority.STAT else ""
+            self.queue_list.insert(tk.END, f"{marker} #{mission.id} {mission.destination}{stat}")
+        
+        eta = self.missions.estimated_duration()
+        if not missions:
+            text = "Queue empty"
         else:
-            self.root.after(0, lambda: self.status_label.config(
-                text=f"Status: Failed!", fg="#FF0000"))
-        
-        # Re-enable destination buttons
-        for button in self.destination_buttons:
-            self.root.after(0, lambda b=button: b.config(state=tk.NORMAL))
+            text = f"{len(missions)} deliveries"
+            if eta is not None:
+                text += f", about {eta / 60000:.1f} min"
+        if self.missions.paused:
+            text += " - PAUSED"
+        self.queue_summary.config(text=text)
+        self.refresh_previews()
+    
+    def refresh_previews(self):
+        """Recompute every destination's ETA and path from the cart's position and queue"""
+        with REGISTRY.time("ui_preview_ms", "Route preview refresh"):
+            location = heading = None
+            stops = []
+            if self.client is not None:
+                location = self.client.location
+                heading = getattr(self.client, "position", (None, None))[1]
+            if self.missions is not None:
+                stops = [mission.destination for mission in self.missions.missions()]
+            self.preview_location = location
+            self.preview_tour, self.previews = self.previewer.preview(location, heading, stops,
+                                                                      list(self.eta_labels))
+            for dest, label in self.eta_labels.items():
+                preview = self.previews.get(dest)
+                label.config(text=format_eta(preview.eta_ms) if preview else "")
+            self.draw_preview()
+    
+    def set_preview_destination(self, destination):
+        self.preview_destination = destination
+        self.draw_preview()
+    
+    def draw_preview(self):
+        """Draw the hallways, the queued tour and the hovered trip, scaled to the canvas"""
+        canvas = self.preview_canvas
+        canvas.delete("all")
+        width = max(canvas.winfo_width(), 10)
+        height = max(canvas.winfo_height(), 10)
+        trip = self.previews.get(self.preview_destination)
+        
+        points = [point for leg in self.preview_tour for point in leg.points]
+        if trip is not None:
+            points += trip.trajectory.points
+        if self.hospital_map:
+            points += self.hospital_map.nodes.values()
+        if not points:
+            return
+        xs, ys = [x for x, _ in points], [y for _, y in points]
+        margin = 12
+        scale = min((width - 2 * margin) / max(max(xs) - min(xs), 1.0),
+                    (height - 2 * margin) / max(max(ys) - min(ys), 1.0))
+        left = (width - (max(xs) - min(xs)) * scale) / 2
+        top = (height - (max(ys) - min(ys)) * scale) / 2
+        
+        def project(path):
+            coords = []
+            for x, y in path:
+                coords += (left + (x - min(xs)) * scale, height - top - (y - min(ys)) * scale)
+            return coords
+        
+        if self.hospital_map:
+            nodes = self.hospital_map.nodes
+            for node, neighbors in self.hospital_map.adjacency.items():
+                for neighbor, _ in neighbors:
+                    canvas.create_line(*project([nodes[node], nodes[neighbor]]),
+                                       fill=PREVIEW_COLORS["hall"], width=4)
+        for leg in self.preview_tour:
+            if len(leg.points) > 1:
+                canvas.create_line(*project(leg.points), fill=PREVIEW_COLORS["tour"], width=2, dash=(4, 2))
+        if trip is not None:
+            if len(trip.trajectory.points) > 1:
+                canvas.create_line(*project(trip.trajectory.points), fill=PREVIEW_COLORS["trip"], width=3,
+                                   arrow=tk.LAST)
+            canvas.create_text(6, 6, anchor="nw", font=("Segoe UI", 9),
+                               text=f"{trip.destination}: {format_eta(trip.eta_ms)}")
+        # The cart, at its last known stop
+        if self.hospital_map:
+            start = self.hospital_map.nodes.get(self.preview_location or self.hospital_map.start)
+        else:
+            start = (0.0, 0.0)
+        if start is not None:
+            x, y = project([start])
+            canvas.create_oval(x - 5, y - 5, x + 5, y + 5, fill=PREVIEW_COLORS["cart"], outline="")
+    
+    def cancel_mission(self):
+        """Drop the selected queued delivery"""
+        if self.missions is None:
+            return
+        for index in self.queue_list.curselection():
+            if not self.missions.cancel(self.queue_ids[index]):
+                self.log("Only queued deliveries can be cancelled")
+    
+    def resume_missions(self):
+        """Continue the queue after an emergency stop"""
+        if self.missions is None:
+            return
+        if self.missions.paused:
+            self.log("Mission queue resumed")
+        self.missions.resume()
+    
+    def close(self):
+        """Cancel any running route, stop background work and destroy the window"""
+        if self.closed:
+            return
+        self.closed = True
+        self.animator.stop()
+        if self.client is not None:
+            self.missions.pause()
+            cancelled = self.client.cancel_routes()
+            if cancelled:
+                self.journal.append(f"Window closed, {cancelled} route(s) cancelled", time.time())
+            self.client.close()
+        self.metrics_exporter.stop()
+        self.journal.close()
+        try:
+            self.root.destroy()
+        except tk.TclError:
+            pass  # Already destroyed
     
     def emergency_stop(self):
         """Send emergency stop command"""
-        self.send_instruction("emergency-stop,0")
-        self.status_label.config(text="Status: EMERGENCY STOP ACTIVATED", fg="#E74C3C")
+        # Handed to the e-stop worker so the UI never waits on the network
+        if self.client is not None:
+            self.missions.pause()
+            self.client.stop()
+        else:
+            self.log("No robot found yet; nothing to stop")
+        self.set_status("Status: EMERGENCY STOP ACTIVATED", "#E74C3C")
         self.log("EMERGENCY STOP ACTIVATED")
         
-        # Show prominent emergency stop notification
-        popup = Toplevel(self.root)
+        # Show the prebuilt notification; hiding restarts with every press
+        self._build_popups()
+        if self.estop_hide_id is not None:
+            self.root.after_cancel(self.estop_hide_id)
+        self.estop_popup.deiconify()
+        self.estop_popup.lift()
+        self.estop_hide_id = self.root.after(5000, self._hide_estop_popup)
+    
+    def _hide_estop_popup(self):
+        self.estop_hide_id = None
+        self.estop_popup.withdraw()
+    
+    def _build_popups(self):
+        """Build the e-stop popup and toast once, hidden, so showing them is instant"""
+        if self.estop_popup is not None:
+            return
+        started = time.perf_counter()
+        
+        # Prominent emergency stop notification
+        popup = self.estop_popup = Toplevel(self.root)
+        popup.withdraw()
         popup.title("EMERGENCY STOP")
         popup.geometry("500x250+400+300")
         popup.configure(bg="#E74C3C")
         popup.attributes("-topmost", True)
+        popup.protocol("WM_DELETE_WINDOW", self._hide_estop_popup)
         
         # Add animated warning symbol
         warning_canvas = tk.Canvas(popup, width=80, height=80, bg="#E74C3C", highlightthickness=0)
@@ -484,14 +885,10 @@ class ModernHospitalRobotGUI:
             padx=20
         ).pack()
         
-        # Auto-close after 5 seconds
-        popup.after(5000, popup.destroy)
-    
-    def show_toast(self, message, color="#333333"):
-        """Show a toast notification"""
-        toast = Toplevel(self.root)
+        # Toast notification
+        toast = self.toast = Toplevel(self.root)
+        toast.withdraw()
         toast.title("")
-        toast.geometry(f"300x60+{self.root.winfo_x() + self.root.winfo_width() - 320}+{self.root.winfo_y() + 60}")
         toast.configure(bg="white")
         toast.overrideredirect(True)  # Remove window decorations
         toast.attributes("-topmost", True)
@@ -501,13 +898,13 @@ class ModernHospitalRobotGUI:
         frame.pack(fill=tk.BOTH, expand=True)
         
         # Add colored indicator on the left
-        indicator = tk.Frame(frame, width=5, bg=color)
-        indicator.pack(side=tk.LEFT, fill=tk.Y)
+        self.toast_indicator = tk.Frame(frame, width=5, bg="#333333")
+        self.toast_indicator.pack(side=tk.LEFT, fill=tk.Y)
         
         # Add message
-        Label(
+        self.toast_label = Label(
             frame, 
-            text=message, 
+            text="", 
             font=("Segoe UI", 11),
             fg="#333333",
             bg="white",
@@ -515,40 +912,95 @@ class ModernHospitalRobotGUI:
             pady=5,
             anchor="w",
             justify=tk.LEFT
-        ).pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        
-        # Animate entry (slide in from right)
-        for i in range(30):
-            x = self.root.winfo_x() + self.root.winfo_width() - 320 + (30 - i) * 10
-            toast.geometry(f"300x60+{x}+{self.root.winfo_y() + 60}")
-            toast.update()
-            time.sleep(0.01)
-        
-        # Auto-close after 3 seconds with fade out
-        toast.after(3000, lambda: self.close_toast(toast))
+        )
+        self.toast_label.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        REGISTRY.gauge("ui_startup_ms", "Time spent in each startup phase", phase="popups").set(
+            (time.perf_counter() - started) * 1000)
     
-    def close_toast(self, toast):
-        """Close toast with animation"""
-        try:
-            # Animate exit (slide out to right)
-            for i in range(30):
-                x = toast.winfo_x() + i * 10
-                toast.geometry(f"300x60+{x}+{toast.winfo_y()}")
-                toast.update()
-                time.sleep(0.01)
-            toast.destroy()
-        except:
-            # In case the window was already destroyed
-            pass
+    def _report_slow_call(self, name, labels, elapsed_ms):
+        """Profiling hook: log timed sections that exceed their budget"""
+        limit = SLOW_CALL_MS.get(name)
+        if limit is not None and elapsed_ms > limit:
+            self.log(f"Slow {name[:-3].replace('_', ' ')}: {elapsed_ms:.0f} ms")
+    
+    def _report_estop(self, result):
+        """Log the delivery and latency of an emergency stop"""
+        if result.acknowledged:
+            self.log(f"E-stop acknowledged via {result.transport} in {result.latency_ms:.1f} ms")
+        else:
+            self.log(f"E-stop NOT acknowledged after {result.attempts} attempts "
+                     f"({result.latency_ms:.0f} ms)")
+            self.set_status("Status: E-STOP NOT CONFIRMED", "#FF0000")
+    
+    def show_toast(self, message, color="#333333"):
+        """Show a toast notification; a new message replaces the current one"""
+        self._build_popups()
+        toast = self.toast
+        self.toast_label.config(text=message)
+        self.toast_indicator.config(bg=color)
+        if self.toast_hide_id is not None:
+            self.root.after_cancel(self.toast_hide_id)
+        if self.toast_tween is not None:
+            self.toast_tween.cancel()
+        
+        # Animate entry (slide in from right) without blocking the event loop
+        x = self.root.winfo_x() + self.root.winfo_width() - 320
+        y = self.root.winfo_y() + 60
+        toast.geometry(f"300x60+{x + 300}+{y}")
+        toast.deiconify()
+        self.toast_tween = self.animator.animate(
+            300, lambda t: toast.geometry(f"300x60+{x + round((1 - t) * 300)}+{y}"))
+        
+        # Auto-close after 3 seconds
+        self.toast_hide_id = self.root.after(3000, self.close_toast)
+    
+    def close_toast(self):
+        """Slide the toast out and hide it"""
+        self.toast_hide_id = None
+        toast = self.toast
+        x, y = toast.winfo_x(), toast.winfo_y()
+        # Animate exit (slide out to right)
+        self.toast_tween = self.animator.animate(
+            300,
+            lambda t: toast.geometry(f"300x60+{x + round(t * 300)}+{y}"),
+            on_done=toast.withdraw
+        )
+    
+    def set_status(self, text, color):
+        """Update the status text; safe to call from any thread"""
+        self.ui.post_state("status", self.status_label.config, text=text, fg=color)
     
     def log(self, message):
-        """Add a message to the log with timestamp"""
-        timestamp = time.strftime("%H:%M:%S")
-        self.log_text.insert(tk.END, f"[{timestamp}] {message}\n")
+        """Add a message to the log with timestamp; safe to call from any thread"""
+        now = time.time()
+        self.journal.append(message, now)
+        self.ui.post_log(f"[{time.strftime('%H:%M:%S', time.localtime(now))}] {message}")
+    
+    def _write_log_lines(self, lines):
+        """Append a batch of log lines with a single insert and scroll"""
+        self.log_ring.extend(lines)
+        if len(lines) >= LOG_VIEW_LINES:
+            # The whole view is being replaced
+            self.log_text.delete("1.0", tk.END)
+            lines = self.log_ring.items()
+        self.log_text.insert(tk.END, "".join(line + "\n" for line in lines))
+        
+        # Trim the widget to the newest LOG_VIEW_LINES lines
+        line_count = int(self.log_text.index("end-1c").split(".")[0]) - 1
+        if line_count > LOG_VIEW_LINES:
+            self.log_text.delete("1.0", f"{line_count - LOG_VIEW_LINES + 1}.0")
         self.log_text.see(tk.END)  # Scroll to the bottom
 
 
+def format_eta(eta_ms):
+    """Short ETA for a destination card"""
+    if eta_ms < 60000:
+        return f"ETA {eta_ms / 1000:.0f} s"
+    return f"ETA {eta_ms / 60000:.1f} min"
+
+
 def main():
+    started_at = time.perf_counter()
     root = tk.Tk()
     # Set app icon if available
     # try:
@@ -556,8 +1008,11 @@ def main():
     #         root.iconbitmap("robot_icon.ico")
     # except:
     #     pass
-    app = ModernHospitalRobotGUI(root)
-    root.mainloop()
+    app = ModernHospitalRobotGUI(root, started_at=started_at)
+    try:
+        root.mainloop()
+    finally:
+        app.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,109 @@
+import json
+import os
+
+CONFIG_DIR = os.path.join(os.path.expanduser("~"), ".hmetv")
+CONFIG_FILE = os.path.join(CONFIG_DIR, "config.json")
+
+# Every setting can be overridden in the config file or with an
+# HMETV_<NAME> environment variable, e.g. HMETV_HOST=192.168.1.55
+DEFAULTS = {
+    # Robot address; when unset the last known address is tried, then the subnet is scanned
+    "host": None,
+    "port": 5001,
+    # Network to scan, e.g. "192.168.1.0/24"; default is this machine's /24
+    "subnet": None,
+    # Upload each route in one message when sequenced steps are not supported
+    "route_upload": True,
+    # Send routes as acknowledged, numbered steps
+    "sequenced": True,
+    # Telemetry records per second requested from the robot; 0 turns telemetry off
+    "telemetry_hz": 50,
+    # Run the robot link, routes and e-stop handling in a separate process from the GUI
+    "isolated_core": False,
+    # Shared secret for gateway.py clients; when unset each gateway run makes and prints one
+    "gateway_token": None,
+    "journal_dir": os.path.join(CONFIG_DIR, "journal"),
+    # Recorded missions for `python3 recorder.py`; set to null to turn recording off
+    "recorder_dir": os.path.join(CONFIG_DIR, "missions"),
+    "metrics_file": os.path.join(CONFIG_DIR, "metrics.prom"),
+    "last_robot_file": os.path.join(CONFIG_DIR, "last_robot.json"),
+    # Carts for fleet mode by name, e.g. {"Cart 1": "192.168.1.55", "Cart 2": "192.168.1.56:5001"};
+    # as a variable: HMETV_FLEET="Cart 1=192.168.1.55,Cart 2=192.168.1.56:5001"
+    "fleet": {},
+}
+
+
+class ConfigError(ValueError):
+    """A configuration file or variable has an invalid value"""
+
+
+def _convert(name, value, default):
+    """Convert an environment string to the type of the default"""
+    if isinstance(default, bool):
+        lowered = value.strip().lower()
+        if lowered in ("1", "true", "yes", "on"):
+            return True
+        if lowered in ("0", "false", "no", "off"):
+            return False
+        raise ConfigError(f"Invalid value for {name}: {value!r}")
+    if isinstance(default, dict):
+        entries = {}
+        for item in filter(None, (part.strip() for part in value.split(","))):
+            key, sep, entry = item.partition("=")
+            if not sep or not key.strip() or not entry.strip():
+                raise ConfigError(f"Invalid value for {name}: {item!r}")
+            entries[key.strip()] = entry.strip()
+        return entries
+    if isinstance(default, int):
+        try:
+            return int(value)
+        except ValueError:
+            raise ConfigError(f"Invalid value for {name}: {value!r}") from None
+    return value or None
+
+
+def _check(path, name, value, default):
+    """Check a config file value against the type of the default"""
+    if isinstance(default, bool):
+        valid, expected = isinstance(value, bool), "true or false"
+    elif isinstance(default, dict):
+        valid = isinstance(value, dict) and all(isinstance(entry, str) for entry in value.values())
+        expected = "an object of strings"
+    elif isinstance(default, int):
+        valid, expected = isinstance(value, int) and not isinstance(value, bool), "a whole number"
+    else:
+        valid, expected = value is None or isinstance(value, str), "a string or null"
+    if not valid:
+        raise ConfigError(f"{path}: invalid value for {name}: {value!r}, expected {expected}")
+    return value
+
+
+def load_config(path=None, environ=None):
+    """Defaults, overlaid with the JSON config file, overlaid with HMETV_* variables
+
+    The file is ``$HMETV_CONFIG`` or ``~/.hmetv/config.json`` unless
+    ``path`` is given; a missing file is not an error.
+    """
+    environ = os.environ if environ is None else environ
+    path = path or environ.get("HMETV_CONFIG") or CONFIG_FILE
+    config = dict(DEFAULTS)
+    try:
+        with open(path, encoding="utf-8") as f:
+            values = json.load(f)
+    except FileNotFoundError:
+        values = {}
+    except json.JSONDecodeError as e:
+        raise ConfigError(f"{path}: {e}") from None
+    if not isinstance(values, dict):
+        raise ConfigError(f"{path}: expected an object of settings")
+    unknown = set(values) - set(DEFAULTS)
+    if unknown:
+        raise ConfigError(f"{path}: unknown settings {', '.join(sorted(unknown))}")
+    for name, value in values.items():
+        config[name] = _check(path, name, value, DEFAULTS[name])
+
+    for name, default in DEFAULTS.items():
+        variable = "HMETV_" + name.upper()
+        if variable in environ:
+            config[name] = _convert(variable, environ[variable], default)
+    return config
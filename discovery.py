@@ -0,0 +1,174 @@
+import argparse
+import asyncio
+import ipaddress
+import json
+import os
+import socket
+import sys
+import time
+
+from robot_link import frame_message
+
+# The client introduces itself and a HMETV server answers
+# "hmetv,<name>,<protocol version>"
+HANDSHAKE = "hello,hmetv"
+HANDSHAKE_REPLY = "hmetv,"
+
+
+class Responder:
+    """A host that accepted a connection on the robot port"""
+
+    def __init__(self, host, port, verified, name, latency_ms):
+        self.host = host
+        self.port = port
+        self.verified = verified
+        self.name = name
+        self.latency_ms = latency_ms
+
+    def __repr__(self):
+        return (f"Responder(host={self.host!r}, port={self.port}, verified={self.verified}, "
+                f"name={self.name!r}, latency_ms={self.latency_ms:.1f})")
+
+
+def local_subnet():
+    """This machine's /24, found from the interface used for outbound traffic"""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        try:
+            # UDP connect only selects a route; nothing is sent
+            sock.connect(("10.255.255.255", 1))
+            address = sock.getsockname()[0]
+        except OSError:
+            address = "127.0.0.1"
+    return ipaddress.ip_network(f"{address}/24", strict=False)
+
+
+async def probe(host, port, connect_timeout=0.5, handshake_timeout=0.3, handshake=True):
+    """Connect and handshake with one host; returns a Responder or None
+
+    A host that accepts the connection but does not answer the handshake
+    is returned unverified, since older onboard servers stay silent.
+    With ``handshake`` off nothing is sent; only the connection is tried.
+    """
+    started = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), connect_timeout)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    if not handshake:
+        writer.close()
+        return Responder(host, port, False, None, (time.perf_counter() - started) * 1000)
+    try:
+        writer.write(frame_message(HANDSHAKE))
+        await writer.drain()
+        line = await asyncio.wait_for(reader.readline(), handshake_timeout)
+        reply = line.decode("utf-8", errors="replace").strip()
+    except (OSError, asyncio.TimeoutError):
+        reply = ""
+    finally:
+        writer.close()
+    latency_ms = (time.perf_counter() - started) * 1000
+    if reply.startswith(HANDSHAKE_REPLY):
+        name = reply[len(HANDSHAKE_REPLY):].partition(",")[0]
+        return Responder(host, port, True, name, latency_ms)
+    return Responder(host, port, False, None, latency_ms)
+
+
+async def scan(subnet=None, port=5001, connect_timeout=0.5, handshake_timeout=0.3, concurrency=256):
+    """Probe every host of a subnet at once; verified responders come first"""
+    network = ipaddress.ip_network(subnet or local_subnet(), strict=False)
+    limit = asyncio.Semaphore(concurrency)
+
+    async def bounded(host):
+        async with limit:
+            return await probe(host, port, connect_timeout, handshake_timeout)
+
+    results = await asyncio.gather(*(bounded(str(host)) for host in network.hosts()))
+    return sorted((r for r in results if r is not None), key=lambda r: (not r.verified, r.latency_ms))
+
+
+def load_last_robot(path):
+    """The cached (host, port) of the last robot we connected to, or None"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return data["host"], int(data["port"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def remember_robot(path, host, port):
+    """Cache the robot address so the next start can skip the scan"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = path + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump({"host": host, "port": port, "seen_at": time.time()}, f)
+    os.replace(temporary, path)
+
+
+def confirm_on_terminal(responder):
+    """Ask on the terminal whether to use a server that did not verify"""
+    if not sys.stdin.isatty():
+        return False
+    answer = input(f"{responder.host}:{responder.port} has the robot port open but did not answer "
+                   f"the HMETV handshake. Use it? [y/N] ")
+    return answer.strip().lower() in ("y", "yes")
+
+
+async def locate(config, log=None, confirm=None):
+    """Find the robot for a configuration; returns (host, port) or None
+
+    A configured host is used as is. Otherwise the cached last address is
+    used if it accepts a connection, and only if it does not is the
+    subnet scanned. The first server that answers the handshake wins.
+    Servers that only have the port open are logged, and one is used only
+    if ``confirm(responder)`` agrees.
+    """
+    log = log or (lambda message: None)
+    port = config["port"]
+    if config["host"]:
+        return config["host"], port
+    last = load_last_robot(config["last_robot_file"])
+    if last is not None:
+        # Older onboard servers never answer the handshake, and this
+        # address was a robot we talked to, so a connection is enough
+        if await probe(*last, handshake=False) is not None:
+            return last
+    responders = await scan(config["subnet"], port)
+    for responder in responders:
+        if responder.verified:
+            return responder.host, responder.port
+        log(f"{responder.host}:{responder.port} has port {port} open but did not answer the HMETV handshake")
+        if confirm is not None and confirm(responder):
+            return responder.host, responder.port
+    if responders:
+        log("Not using an unverified server; set host in the config (or HMETV_HOST) to pick one")
+    # Nothing usable answered; the robot may still come up at its old address
+    return last
+
+
+def resolve_robot(config, log=None, confirm=None):
+    """Blocking form of ``locate``"""
+    return asyncio.run(locate(config, log, confirm))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find HMETV robots on the local network")
+    parser.add_argument("--subnet", help="network to scan, e.g. 192.168.1.0/24 (default: this machine's /24)")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--timeout", type=float, default=0.5, help="connect timeout per host in seconds")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    responders = asyncio.run(scan(args.subnet, args.port, connect_timeout=args.timeout))
+    elapsed = time.perf_counter() - started
+    for responder in responders:
+        kind = f"HMETV ({responder.name})" if responder.verified else "unverified"
+        print(f"{responder.host}:{responder.port}  {kind}  {responder.latency_ms:.0f} ms")
+    print(f"Scanned in {elapsed:.2f} s; {len(responders)} responder(s)", file=sys.stderr)
+    return 0 if responders else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
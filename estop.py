@@ -0,0 +1,145 @@
+import collections
+import queue
+import socket
+import threading
+import time
+
+from metrics import REGISTRY
+from robot_link import RobotConnection, frame_message
+
+ESTOP_INSTRUCTION = "emergency-stop,0"
+ESTOP_ACK = "ack,emergency-stop"
+
+
+class EStopResult:
+    """Outcome of one emergency stop request"""
+
+    def __init__(self, acknowledged, transport, latency_ms, attempts):
+        self.acknowledged = acknowledged
+        self.transport = transport
+        self.latency_ms = latency_ms
+        self.attempts = attempts
+
+    def __repr__(self):
+        return (f"EStopResult(acknowledged={self.acknowledged}, transport={self.transport!r}, "
+                f"latency_ms={self.latency_ms:.1f}, attempts={self.attempts})")
+
+
+class EStopChannel:
+    """Reserved, pre-connected path for emergency stops
+
+    Stops are handed to a dedicated worker thread, so pressing the button
+    never blocks the caller. The worker cycles through its transports (the
+    reserved TCP socket, a UDP datagram and the shared command link) until
+    the robot answers ``ack,emergency-stop`` or ``retry_window`` runs out.
+    Latency is measured from the call to ``trigger`` until the ack and
+    recorded in ``metrics`` per transport.
+    """
+
+    def __init__(self, host, port, shared_link=None, ack_timeout=0.25,
+                 retry_window=5.0, keepalive_interval=2.0, on_result=None, metrics=REGISTRY):
+        self.host = host
+        self.port = port
+        self.shared_link = shared_link
+        self.ack_timeout = ack_timeout
+        self.retry_window = retry_window
+        self.keepalive_interval = keepalive_interval
+        self.on_result = on_result
+        self.metrics = metrics
+
+        self.link = RobotConnection(host, port, connect_timeout=ack_timeout,
+                                    send_timeout=ack_timeout, max_backoff=keepalive_interval)
+        self.latencies = collections.deque(maxlen=100)
+        self.last_result = None
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="estop", daemon=True)
+
+    def start(self):
+        """Start the stop worker, which also pre-connects the reserved socket"""
+        self._thread.start()
+
+    def stop(self):
+        """Shut the worker down and close the reserved socket"""
+        if self._thread.is_alive():
+            self._requests.put(None)
+            self._thread.join(timeout=1)
+        self.link.close()
+
+    def trigger(self):
+        """Request an emergency stop; returns immediately"""
+        self._requests.put(time.perf_counter())
+
+    def _run(self):
+        self.link.connect(force=True)
+        while True:
+            try:
+                pressed_at = self._requests.get(timeout=self.keepalive_interval)
+            except queue.Empty:
+                self.link.keep_warm()
+                continue
+            if pressed_at is None:
+                break
+
+            # Repeated presses while a stop is in flight collapse into one
+            shutdown = False
+            while not self._requests.empty():
+                if self._requests.get_nowait() is None:
+                    shutdown = True
+
+            result = self._deliver(pressed_at)
+            self.last_result = result
+            if result.acknowledged:
+                self.latencies.append(result.latency_ms)
+                self.metrics.summary("estop_latency_ms", "Button press to robot acknowledgement",
+                                     robot=self.host, transport=result.transport).observe(result.latency_ms)
+            self.metrics.counter("estop_total", robot=self.host,
+                                 result="acked" if result.acknowledged else "unacked").inc()
+            if self.on_result:
+                self.on_result(result)
+            if shutdown:
+                break
+
+    def _transports(self):
+        transports = [("tcp", self._send_reserved), ("udp", self._send_datagram)]
+        if self.shared_link is not None:
+            transports.append(("shared", self._send_shared))
+        return transports
+
+    def _deliver(self, pressed_at):
+        """Retry every transport in turn until one is acknowledged"""
+        deadline = pressed_at + self.retry_window
+        attempts = 0
+        while time.perf_counter() < deadline:
+            for name, send in self._transports():
+                attempts += 1
+                try:
+                    if send():
+                        latency_ms = (time.perf_counter() - pressed_at) * 1000
+                        return EStopResult(True, name, latency_ms, attempts)
+                except Exception:
+                    # A failing transport must never end the worker; later
+                    # presses would then be dropped without a word
+                    pass
+            # Avoid spinning when every transport fails immediately
+            time.sleep(0.01)
+        latency_ms = (time.perf_counter() - pressed_at) * 1000
+        return EStopResult(False, None, latency_ms, attempts)
+
+    @staticmethod
+    def _is_ack(reply):
+        return True if reply == ESTOP_ACK else None
+
+    def _send_reserved(self):
+        return self.link.request(ESTOP_INSTRUCTION, self._is_ack, timeout=self.ack_timeout)
+
+    def _send_shared(self):
+        # Never wait behind a route upload holding the shared link
+        return self.shared_link.request(ESTOP_INSTRUCTION, self._is_ack,
+                                        timeout=self.ack_timeout, lock_timeout=self.ack_timeout)
+
+    def _send_datagram(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(self.ack_timeout)
+            sock.sendto(frame_message(ESTOP_INSTRUCTION), (self.host, self.port))
+            reply, _ = sock.recvfrom(64)
+        return reply.decode('utf-8', errors='replace').strip() == ESTOP_ACK
@@ -0,0 +1,225 @@
+import argparse
+import asyncio
+import concurrent.futures
+import os
+import sys
+import threading
+import time
+
+from config import load_config
+from robot_client import DEFAULT_PORT, MAP_FILE, RobotClient, load_hospital_map
+
+
+class NoIdleCart(RuntimeError):
+    """Every cart is busy or disconnected"""
+
+
+def parse_address(address, default_port=DEFAULT_PORT):
+    """Split "host" or "host:port" into (host, port)"""
+    host, _, port = address.rpartition(":")
+    if not host:
+        return address, default_port
+    try:
+        return host, int(port)
+    except ValueError:
+        raise ValueError(f"Invalid robot address: {address!r}") from None
+
+
+class Fleet:
+    """Many carts driven from one shared event loop thread
+
+    Every cart is a RobotClient whose engine is a guest on the fleet's
+    loop, so each added cart costs a socket, a few tasks and its position
+    rather than several threads. Carts share one hospital map and use the
+    command link for emergency stops. ``on_cart_change`` is called with
+    the cart name from the I/O thread whenever a cart connects,
+    disconnects, starts or finishes a route, or reports a stop.
+    """
+
+    def __init__(self, map_file=MAP_FILE, on_cart_change=None, log=None, recorder_dir=None,
+                 **client_options):
+        self.on_cart_change = on_cart_change
+        self.log = log or (lambda message: None)
+        self.recorder_dir = recorder_dir
+        self.client_options = client_options
+        self.hospital_map = load_hospital_map(map_file)
+        self.carts = {}
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="fleet-io", daemon=True)
+        self._started = False
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    # Lifecycle
+
+    def start(self):
+        """Start the shared I/O thread and every cart added so far"""
+        self._thread.start()
+        self._started = True
+        for cart in self.carts.values():
+            cart.start()
+        return self
+
+    def close(self):
+        """Cancel every route, disconnect every cart and stop the I/O thread"""
+        for name in list(self.carts):
+            self.remove(name)
+        if self._started:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(2.0)
+            self._started = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, name, host, port=DEFAULT_PORT):
+        """Add a cart; it starts connecting at once if the fleet is running"""
+        if name in self.carts:
+            raise ValueError(f"Cart {name!r} is already in the fleet")
+        recorder_dir = os.path.join(self.recorder_dir, name) if self.recorder_dir else None
+        cart = RobotClient(
+            host, port,
+            log=lambda message: self.log(f"{name}: {message}"),
+            on_state_change=lambda connected: self._changed(name),
+            on_estop=lambda result: self._changed(name),
+            reserved_estop=False, hospital_map=self.hospital_map, recorder_dir=recorder_dir,
+            loop=self.loop, **self.client_options)
+        self.carts[name] = cart
+        if self._started:
+            cart.start()
+        return cart
+
+    def remove(self, name):
+        """Cancel the cart's route and disconnect it"""
+        cart = self.carts.pop(name)
+        if self._started:
+            cart.close()
+
+    # Queries
+
+    def status(self):
+        """Status snapshot of every cart, by name"""
+        return {name: cart.status() for name, cart in self.carts.items()}
+
+    def nearest_idle(self, destination):
+        """Name of the connected, idle cart with the shortest drive to ``destination``
+
+        Raises NoIdleCart when there is none.
+        """
+        best = None
+        for name, cart in self.carts.items():
+            if not cart.connected or cart.busy:
+                continue
+            cart.plan_route(destination)  # ValueError for unknown destinations
+            cost = 0 if cart.location == destination else cart.travel_time(cart.location, destination)
+            if best is None or cost < best[0]:
+                best = (cost, name)
+        if best is None:
+            raise NoIdleCart("No connected cart is idle")
+        return best[1]
+
+    # Commands
+
+    def dispatch(self, destination):
+        """Send the nearest idle cart to ``destination``; returns (cart name, Future)"""
+        name = self.nearest_idle(destination)
+        future = self.carts[name].go_to(destination)
+        self.log(f"{name}: dispatched to {destination}")
+        self._changed(name)
+        future.add_done_callback(lambda future: self._changed(name))
+        return name, future
+
+    def emergency_stop(self):
+        """Stop every cart at once; returns {name: Future of EStopResult} without waiting
+
+        Every route is cancelled before any stop is sent, then the stops
+        go out to all carts in parallel on the shared loop.
+        """
+        for cart in self.carts.values():
+            cart.engine.cancel_routes()
+        return {name: cart.stop() for name, cart in self.carts.items()}
+
+    def _changed(self, name):
+        if self.on_cart_change:
+            self.on_cart_change(name)
+
+
+def fleet_from_config(config, **options):
+    """Fleet with every cart listed in the ``fleet`` setting"""
+    options.setdefault("route_upload", config["route_upload"])
+    options.setdefault("sequenced", config["sequenced"])
+    options.setdefault("recorder_dir", config["recorder_dir"])
+    fleet = Fleet(**options)
+    for name, address in config["fleet"].items():
+        fleet.add(name, *parse_address(address, config["port"]))
+    return fleet
+
+
+def _parse_cart(text):
+    name, sep, address = text.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"expected NAME=HOST[:PORT], got {text!r}")
+    return name, address
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Control a fleet of HMETV carts")
+    parser.add_argument("--cart", action="append", type=_parse_cart, default=[], metavar="NAME=HOST[:PORT]",
+                        help="cart to control (default: the fleet setting in the config)")
+    parser.add_argument("--timeout", type=float, default=5.0, help="seconds to wait for carts to connect")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="show every cart")
+    go = sub.add_parser("go", help="send the nearest idle cart to a destination and wait")
+    go.add_argument("destination")
+    sub.add_parser("stop", help="emergency stop every cart")
+    args = parser.parse_args(argv)
+
+    config = load_config()
+    if args.cart:
+        config["fleet"] = dict(args.cart)
+    if not config["fleet"]:
+        parser.error("no carts; use --cart or the fleet setting")
+    with fleet_from_config(config, log=lambda message: print(message, file=sys.stderr)) as fleet:
+        deadline = time.monotonic() + args.timeout
+        while (not all(cart.connected for cart in fleet.carts.values())
+               and time.monotonic() < deadline):
+            time.sleep(0.05)
+        try:
+            if args.command == "status":
+                for name, status in fleet.status().items():
+                    state = "busy" if status["busy"] else "idle" if status["connected"] else "down"
+                    print(f"{name:<12} {status['host']}:{status['port']:<6} {state:<5} {status['location'] or '-'}")
+            elif args.command == "go":
+                name, future = fleet.dispatch(args.destination)
+                print(f"{name} -> {args.destination}")
+                if not future.result():
+                    return 1
+            else:
+                futures = fleet.emergency_stop()
+                concurrent.futures.wait(futures.values())
+                acknowledged = 0
+                for name, future in futures.items():
+                    result = future.result()
+                    if result.acknowledged:
+                        acknowledged += 1
+                        print(f"{name:<12} acked in {result.latency_ms:.1f} ms")
+                    else:
+                        print(f"{name:<12} NOT acknowledged")
+                if acknowledged < len(futures):
+                    return 1
+        except (ValueError, NoIdleCart) as e:
+            print(e, file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+import tkinter as tk
+from tkinter import ttk
+import time
+
+from animation import FrameScheduler
+from config import load_config
+from fleet import NoIdleCart, fleet_from_config
+from oplog import RingBuffer
+from robot_client import DESTINATIONS
+from ui_queue import UIUpdateQueue
+
+# Carts come from the "fleet" setting in ~/.hmetv/config.json or
+# HMETV_FLEET (see config.py), e.g. {"Cart 1": "192.168.1.55"}
+
+TILE_COLUMNS = 4
+LOG_VIEW_LINES = 200
+
+# Tile colors by cart state
+STATE_COLORS = {
+    "idle": "#2ECC71",
+    "busy": "#F39C12",
+    "down": "#E74C3C",
+}
+
+
+class FleetGUI:
+    """Status tiles for every cart, nearest-cart dispatch and a fleet-wide stop"""
+
+    def __init__(self, root, config=None):
+        self.root = root
+        self.root.title("Heals on Wheels - Fleet")
+        self.root.geometry("1000x700")
+        self.root.configure(bg="#FFFFFF")
+        self.config = config or load_config()
+
+        self.ui = UIUpdateQueue(self._write_log_lines)
+        self.log_ring = RingBuffer(LOG_VIEW_LINES)
+        self.animator = FrameScheduler(root, on_error=self.log)
+        self.animator.every(50, self.ui.drain, pause_when_hidden=False)
+
+        # Every cart shares one I/O thread; tile updates for a cart collapse into one
+        self.fleet = fleet_from_config(
+            self.config,
+            log=self.log,
+            on_cart_change=lambda name: self.ui.post_state(("cart", name), self.show_cart, name)
+        )
+        self.tiles = {}
+
+        self.create_controls()
+        self.create_tiles()
+        self.log_text = tk.Text(root, height=8, font=("Consolas", 10), bg="#F8F9FA")
+        self.log_text.pack(fill=tk.X, padx=10, pady=(0, 10))
+
+        self.fleet.start()
+        if self.fleet.carts:
+            self.log(f"Fleet of {len(self.fleet.carts)} carts")
+        else:
+            self.log("No carts configured; add them to the fleet setting in ~/.hmetv/config.json")
+        # Busy and connection state also change without a callback, e.g. on arrival
+        self.animator.every(1000, self.show_all)
+
+        self.closed = False
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
+
+    def create_controls(self):
+        bar = tk.Frame(self.root, bg="#2C3E50")
+        bar.pack(fill=tk.X)
+        tk.Label(bar, text="Fleet", font=("Segoe UI", 20, "bold"), fg="#FFFFFF",
+                 bg="#2C3E50").pack(side=tk.LEFT, padx=15, pady=10)
+
+        tk.Button(bar, text="STOP ALL", font=("Segoe UI", 14, "bold"), bg="#FF4136", fg="#FFFFFF",
+                  activebackground="#D32F2F", command=self.stop_all).pack(side=tk.RIGHT, padx=15)
+        tk.Button(bar, text="Dispatch Nearest", font=("Segoe UI", 12),
+                  command=self.dispatch).pack(side=tk.RIGHT, padx=5)
+        hospital_map = self.fleet.hospital_map
+        destinations = list(hospital_map.destinations) if hospital_map else list(DESTINATIONS)
+        self.destination_var = tk.StringVar(value=destinations[0] if destinations else "")
+        ttk.Combobox(bar, textvariable=self.destination_var, values=destinations,
+                     state="readonly", width=18).pack(side=tk.RIGHT, padx=5)
+
+    def create_tiles(self):
+        grid = tk.Frame(self.root, bg="#FFFFFF")
+        grid.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        for column in range(TILE_COLUMNS):
+            grid.columnconfigure(column, weight=1)
+        for index, name in enumerate(self.fleet.carts):
+            tile = tk.Frame(grid, bg=STATE_COLORS["down"], padx=3, pady=3)
+            tile.grid(row=index // TILE_COLUMNS, column=index % TILE_COLUMNS, sticky="nsew", padx=5, pady=5)
+            body = tk.Frame(tile, bg="#FFFFFF")
+            body.pack(fill=tk.BOTH, expand=True)
+            tk.Label(body, text=name, font=("Segoe UI", 13, "bold"), bg="#FFFFFF").pack(anchor="w", padx=6)
+            detail = tk.Label(body, text="", font=("Segoe UI", 10), bg="#FFFFFF", justify=tk.LEFT)
+            detail.pack(anchor="w", padx=6)
+            tk.Button(body, text="Stop", bg="#E74C3C", fg="#FFFFFF",
+                      command=lambda name=name: self.stop_cart(name)).pack(anchor="e", padx=6, pady=(0, 4))
+            self.tiles[name] = (tile, detail)
+            self.show_cart(name)
+
+    def show_cart(self, name):
+        """Refresh one cart's tile"""
+        cart = self.fleet.carts.get(name)
+        if cart is None or name not in self.tiles:
+            return
+        tile, detail = self.tiles[name]
+        status = cart.status()
+        state = "busy" if status["busy"] else "idle" if status["connected"] else "down"
+        lines = [f"{status['host']}:{status['port']}", f"{state.upper()} at {status['location'] or '?'}"]
+        quality = cart.engine.link_quality()
+        if quality["rtt_ms"].get("p95") is not None:
+            lines.append(f"RTT p95 {quality['rtt_ms']['p95']:.0f} ms, loss {quality['loss'] * 100:.0f}%")
+        if cart.last_estop is not None:
+            lines.append("Stopped" if cart.last_estop.acknowledged else "STOP NOT ACKNOWLEDGED")
+        tile.config(bg=STATE_COLORS[state])
+        detail.config(text="\n".join(lines))
+
+    def show_all(self):
+        for name in self.tiles:
+            self.show_cart(name)
+
+    def dispatch(self):
+        destination = self.destination_var.get()
+        try:
+            self.fleet.dispatch(destination)
+        except (ValueError, NoIdleCart) as e:
+            self.log(f"Cannot dispatch to {destination}: {e}")
+
+    def stop_cart(self, name):
+        self.log(f"{name}: EMERGENCY STOP")
+        self.fleet.carts[name].stop().add_done_callback(
+            lambda future: self.ui.call(self._report_stop, name, future))
+
+    def stop_all(self):
+        """Stop every cart in parallel without blocking the window"""
+        self.log("FLEET EMERGENCY STOP")
+        for name, future in self.fleet.emergency_stop().items():
+            future.add_done_callback(lambda future, name=name: self.ui.call(self._report_stop, name, future))
+
+    def _report_stop(self, name, future):
+        if future.cancelled() or future.exception() is not None or not future.result().acknowledged:
+            self.log(f"{name}: stop NOT acknowledged")
+        else:
+            self.log(f"{name}: stopped, {future.result().latency_ms:.0f} ms")
+        self.show_cart(name)
+
+    def log(self, message):
+        """Add a timestamped line to the log view; safe to call from any thread"""
+        self.ui.post_log(f"[{time.strftime('%H:%M:%S')}] {message}")
+
+    def _write_log_lines(self, lines):
+        self.log_ring.extend(lines)
+        self.log_text.delete("1.0", tk.END)
+        self.log_text.insert(tk.END, "".join(line + "\n" for line in self.log_ring.items()))
+        self.log_text.see(tk.END)
+
+    def close(self):
+        """Cancel every route, disconnect every cart and destroy the window"""
+        if self.closed:
+            return
+        self.closed = True
+        self.animator.stop()
+        self.fleet.close()
+        try:
+            self.root.destroy()
+        except tk.TclError:
+            pass  # Already destroyed
+
+
+def main():
+    root = tk.Tk()
+    app = FleetGUI(root)
+    try:
+        root.mainloop()
+    finally:
+        app.close()
+
+
+if __name__ == "__main__":
+    main()
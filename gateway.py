@@ -0,0 +1,482 @@
+import argparse
+import asyncio
+import base64
+import collections
+import hashlib
+import hmac
+import json
+import secrets
+import struct
+import sys
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from config import load_config
+from metrics import REGISTRY
+from missions import MissionQueue, Priority
+from robot_client import client_from_config
+
+# Browsers and operator stations talk to the gateway; only the gateway
+# talks to the robot, over the same RobotClient the GUIs use.
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_TEXT = 0x1
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+MAX_MESSAGE = 64 * 1024
+MAX_REQUEST_BODY = 64 * 1024
+
+COMMANDS = ("go", "stop", "resume", "cancel")
+
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found",
+                405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large",
+                415: "Unsupported Media Type"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def websocket_accept(key):
+    """The Sec-WebSocket-Accept value for a client's Sec-WebSocket-Key"""
+    digest = hashlib.sha1((key + WEBSOCKET_GUID).encode("ascii")).digest()
+    return base64.b64encode(digest).decode("ascii")
+
+
+def encode_frame(opcode, payload):
+    """One unmasked, unfragmented server frame"""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+async def read_frame(reader):
+    """Read one client frame; returns (opcode, payload)"""
+    first, second = await reader.readexactly(2)
+    opcode = first & 0x0F
+    length = second & 0x7F
+    if length == 126:
+        length, = struct.unpack("!H", await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack("!Q", await reader.readexactly(8))
+    if not first & 0x80 or length > MAX_MESSAGE:
+        raise ValueError("Fragmented or oversized WebSocket message")
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+    return opcode, payload
+
+
+class _Subscriber:
+    """One WebSocket client: the newest status plus any events not yet sent"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.status = None
+        self.events = collections.deque(maxlen=100)
+        self.wake = asyncio.Event()
+
+
+class Gateway:
+    """HTTP + WebSocket front end that shares one robot link among many operators
+
+    Holds the single RobotClient and MissionQueue; clients never reach the
+    robot directly. Requests to go somewhere that is already queued or
+    under way are coalesced into the existing mission, the queue
+    serializes dispatches, and repeated stops collapse in the e-stop
+    channel. Status is pushed to every subscriber at most every
+    ``update_interval`` seconds. A slow subscriber only ever gets the
+    newest status, so the robot's load does not depend on how many
+    stations are watching.
+
+    HTTP: ``GET /`` (operator page), ``GET /status``, ``GET /metrics``,
+    ``POST /go`` with ``{"destination": ..., "stat": false}``,
+    ``POST /stop``, ``POST /resume`` and ``POST /cancel`` with ``{"id": ...}``.
+    ``/ws`` upgrades to a WebSocket that receives ``status`` and ``event``
+    messages and accepts the same commands as ``{"action": "go", ...}``.
+
+    Everything but the operator page needs ``token``: as an
+    ``Authorization: Bearer`` header over HTTP, or as ``?token=`` on the
+    WebSocket URL, since browsers cannot set headers there. POST bodies
+    must be ``application/json``, and requests sent by a browser page
+    from another origin are refused, so other web pages cannot command
+    the robot.
+    """
+
+    def __init__(self, client, missions, token, update_interval=0.1, metrics=REGISTRY):
+        if not token:
+            raise ValueError("The gateway needs a token")
+        self.client = client
+        self.missions = missions
+        self.token = token
+        self.update_interval = update_interval
+        self.metrics = metrics
+        self.loop = None
+        self._subscribers = set()
+        self._dirty = None
+        self._server = None
+
+    # Wiring
+
+    def changed(self):
+        """Mark the status dirty; safe to call from any thread"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._dirty.set)
+
+    def event(self, message):
+        """Send a log line to every subscriber; safe to call from any thread"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._post_event, message)
+
+    async def serve(self, host="127.0.0.1", port=8080):
+        """Serve until cancelled"""
+        self.loop = asyncio.get_running_loop()
+        self._dirty = asyncio.Event()
+        self._server = await asyncio.start_server(self._handle, host, port)
+        publisher = asyncio.create_task(self._publish())
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            publisher.cancel()
+
+    # Commands, shared by HTTP and WebSocket
+
+    def status(self):
+        missions = self.missions.missions()
+        return {
+            "robot": self.client.status(),
+            "link": self.client.engine.link_quality(),
+            "paused": self.missions.paused,
+            "eta_ms": self.missions.estimated_duration(),
+            "destinations": self.client.destinations,
+            "missions": [{"id": m.id, "destination": m.destination, "priority": m.priority.name,
+                          "state": m.state.value} for m in missions],
+        }
+
+    def go(self, destination, stat=False):
+        """Queue a delivery unless one to the same place is already pending"""
+        priority = Priority.STAT if stat else Priority.ROUTINE
+        for mission in self.missions.missions():
+            if mission.destination == destination and mission.priority <= priority:
+                self.metrics.counter("gateway_coalesced_total", "Commands merged into pending ones",
+                                     command="go").inc()
+                return {"id": mission.id, "coalesced": True}
+        try:
+            mission = self.missions.submit(destination, priority)
+        except ValueError as e:
+            raise HTTPError(400, str(e)) from None
+        return {"id": mission.id, "coalesced": False}
+
+    def stop(self):
+        self.missions.pause()
+        self.client.stop()
+        self.event("EMERGENCY STOP")
+        return {"stopping": True}
+
+    def resume(self):
+        self.missions.resume()
+        return {"paused": self.missions.paused}
+
+    def cancel(self, mission_id):
+        if not self.missions.cancel(mission_id):
+            raise HTTPError(409, f"Mission {mission_id} is not queued")
+        return {"cancelled": mission_id}
+
+    def command(self, action, body):
+        """Run one command; raises HTTPError for bad input"""
+        self.metrics.counter("gateway_commands_total", "Commands received",
+                             command=action if action in COMMANDS else "unknown").inc()
+        if action == "go":
+            destination = body.get("destination")
+            if not isinstance(destination, str):
+                raise HTTPError(400, "destination is required")
+            return self.go(destination, bool(body.get("stat")))
+        if action == "stop":
+            return self.stop()
+        if action == "resume":
+            return self.resume()
+        if action == "cancel":
+            try:
+                return self.cancel(int(body.get("id")))
+            except (TypeError, ValueError):
+                raise HTTPError(400, "id is required") from None
+        raise HTTPError(404, f"Unknown command {action!r}")
+
+    # Fan-out
+
+    def _post_event(self, message):
+        payload = {"type": "event", "time": time.time(), "message": message}
+        for subscriber in self._subscribers:
+            subscriber.events.append(payload)
+            subscriber.wake.set()
+
+    async def _publish(self):
+        """Build one status snapshot per interval and hand it to every subscriber"""
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            if self._subscribers:
+                snapshot = json.dumps({"type": "status", **self.status()})
+                for subscriber in self._subscribers:
+                    subscriber.status = snapshot
+                    subscriber.wake.set()
+            await asyncio.sleep(self.update_interval)
+
+    async def _feed(self, subscriber):
+        """Send a subscriber's pending events and newest status"""
+        while True:
+            await subscriber.wake.wait()
+            subscriber.wake.clear()
+            frames = [encode_frame(OP_TEXT, json.dumps(event).encode("utf-8"))
+                      for event in subscriber.events]
+            subscriber.events.clear()
+            if subscriber.status is not None:
+                frames.append(encode_frame(OP_TEXT, subscriber.status.encode("utf-8")))
+                subscriber.status = None
+            subscriber.writer.write(b"".join(frames))
+            try:
+                await subscriber.writer.drain()
+            except ConnectionError:
+                return  # The reader notices the closed socket and cleans up
+
+    # HTTP
+
+    async def _handle(self, reader, writer):
+        try:
+            method, path, query, headers, body = await self._read_request(reader)
+            self._check_origin(headers)
+            if path == "/ws" and headers.get("upgrade", "").lower() == "websocket":
+                self._check_token(query.get("token", [None])[0])
+                await self._websocket(reader, writer, headers)
+                return
+            if (method, path) != ("GET", "/"):
+                scheme, _, token = headers.get("authorization", "").partition(" ")
+                self._check_token(token if scheme.lower() == "bearer" else None)
+            status, content_type, payload = self._route(method, path, headers, body)
+        except HTTPError as e:
+            status, content_type = e.status, "application/json"
+            payload = json.dumps({"error": str(e)}).encode("utf-8")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+            writer.close()
+            return
+        self.metrics.counter("gateway_requests_total", "HTTP requests", status=status).inc()
+        writer.write(f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+                     f"Content-Type: {content_type}\r\nContent-Length: {len(payload)}\r\n"
+                     "Cache-Control: no-store\r\nConnection: close\r\n\r\n".encode("ascii") + payload)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def _read_request(self, reader):
+        head = await reader.readuntil(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        method, path, _ = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(":")
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        if length > MAX_REQUEST_BODY:
+            raise HTTPError(413, "Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        url = urlsplit(path)
+        return method, url.path, parse_qs(url.query), headers, body
+
+    def _check_origin(self, headers):
+        """Refuse requests a browser sends on behalf of a page from another origin"""
+        origin = headers.get("origin")
+        if origin is not None and urlsplit(origin).netloc.lower() != headers.get("host", "").lower():
+            raise HTTPError(403, "Cross-origin requests are not allowed")
+
+    def _check_token(self, token):
+        if token is None or not hmac.compare_digest(token.encode("utf-8"), self.token.encode("utf-8")):
+            self.metrics.counter("gateway_rejected_total", "Requests without a valid token").inc()
+            raise HTTPError(401, "A valid gateway token is required")
+
+    def _route(self, method, path, headers, body):
+        if method == "GET":
+            if path == "/":
+                return 200, "text/html; charset=utf-8", OPERATOR_PAGE.encode("utf-8")
+            if path == "/status":
+                return 200, "application/json", json.dumps(self.status()).encode("utf-8")
+            if path == "/metrics":
+                return 200, "text/plain; version=0.0.4", self.metrics.to_prometheus().encode("utf-8")
+            raise HTTPError(404, f"No such page {path}")
+        if method == "POST":
+            if headers.get("content-type", "").partition(";")[0].strip().lower() != "application/json":
+                raise HTTPError(415, "Body must be application/json")
+            try:
+                data = json.loads(body) if body else {}
+            except ValueError:
+                raise HTTPError(400, "Body must be JSON") from None
+            if not isinstance(data, dict):
+                raise HTTPError(400, "Body must be a JSON object")
+            result = self.command(path.strip("/"), data)
+            return 200, "application/json", json.dumps(result).encode("utf-8")
+        raise HTTPError(405, f"Method {method} not allowed")
+
+    # WebSocket
+
+    async def _websocket(self, reader, writer, headers):
+        key = headers.get("sec-websocket-key")
+        if not key:
+            raise HTTPError(400, "Missing Sec-WebSocket-Key")
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {websocket_accept(key)}\r\n\r\n").encode("ascii"))
+        subscriber = _Subscriber(writer)
+        subscriber.status = json.dumps({"type": "status", **self.status()})
+        subscriber.wake.set()
+        self._subscribers.add(subscriber)
+        self.metrics.gauge("gateway_subscribers").set(len(self._subscribers))
+        feeder = asyncio.create_task(self._feed(subscriber))
+        try:
+            while True:
+                opcode, payload = await read_frame(reader)
+                if opcode == OP_CLOSE:
+                    writer.write(encode_frame(OP_CLOSE, payload[:2]))
+                    break
+                if opcode == OP_PING:
+                    writer.write(encode_frame(OP_PONG, payload))
+                elif opcode == OP_TEXT:
+                    self._websocket_command(subscriber, payload)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            feeder.cancel()
+            self._subscribers.discard(subscriber)
+            self.metrics.gauge("gateway_subscribers").set(len(self._subscribers))
+            writer.close()
+
+    def _websocket_command(self, subscriber, payload):
+        try:
+            data = json.loads(payload)
+            result = self.command(str(data.get("action")), data)
+            reply = {"type": "result", "action": data.get("action"), **result}
+        except HTTPError as e:
+            reply = {"type": "error", "message": str(e)}
+        except (ValueError, AttributeError):
+            reply = {"type": "error", "message": "Commands must be JSON objects"}
+        subscriber.events.append(reply)
+        subscriber.wake.set()
+
+
+OPERATOR_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Heals on Wheels</title>
+<style>
+body { font-family: "Segoe UI", sans-serif; margin: 0; background: #F8F9FA; }
+header { background: #2C3E50; color: #FFFFFF; padding: 12px 20px; font-size: 22px; }
+main { padding: 16px 20px; }
+button { font-size: 16px; margin: 4px; padding: 8px 14px; }
+#stop { background: #FF4136; color: #FFFFFF; font-weight: bold; }
+#log { font-family: Consolas, monospace; font-size: 13px; white-space: pre; height: 160px; overflow-y: auto; }
+</style></head>
+<body><header>Heals on Wheels - HMETV</header><main>
+<p id="robot">Connecting...</p>
+<div id="destinations"></div>
+<label><input type="checkbox" id="stat"> STAT</label>
+<button id="stop">EMERGENCY STOP</button> <button id="resume">Resume</button>
+<h3>Queue</h3><ol id="queue"></ol>
+<div id="log"></div>
+</main>
+<script>
+// The token comes in the URL fragment, which is never sent to the server or logged
+const token = new URLSearchParams(location.hash.slice(1)).get("token") || sessionStorage.getItem("token") ||
+  prompt("Gateway token");
+sessionStorage.setItem("token", token);
+history.replaceState(null, "", location.pathname);
+let socket;
+const send = (message) => socket && socket.readyState === 1 && socket.send(JSON.stringify(message));
+const log = (text) => { const el = document.getElementById("log"); el.textContent += text + "\\n"; el.scrollTop = el.scrollHeight; };
+function show(status) {
+  const robot = status.robot;
+  document.getElementById("robot").textContent =
+    (robot.connected ? "Connected" : "Disconnected") + " - " + (robot.busy ? "moving" : "at " + (robot.location || "?")) +
+    " - link " + status.link.grade + (status.paused ? " - PAUSED" : "");
+  const buttons = document.getElementById("destinations");
+  if (!buttons.childElementCount) {
+    for (const destination of status.destinations) {
+      const button = document.createElement("button");
+      button.textContent = destination;
+      button.onclick = () => { send({action: "go", destination, stat: document.getElementById("stat").checked}); document.getElementById("stat").checked = false; };
+      buttons.appendChild(button);
+    }
+  }
+  document.getElementById("queue").innerHTML = status.missions.map(
+    (m) => "<li>" + (m.state === "running" ? "&#9654; " : "") + m.destination + (m.priority === "STAT" ? " (STAT)" : "") + "</li>").join("");
+}
+function connect() {
+  socket = new WebSocket((location.protocol === "https:" ? "wss://" : "ws://") + location.host + "/ws?token=" +
+    encodeURIComponent(token));
+  socket.onmessage = (message) => {
+    const data = JSON.parse(message.data);
+    if (data.type === "status") show(data);
+    else if (data.type === "event") log(new Date(data.time * 1000).toLocaleTimeString() + " " + data.message);
+    else if (data.type === "error") log("Error: " + data.message);
+  };
+  socket.onclose = () => { document.getElementById("robot").textContent = "Gateway unreachable, retrying..."; setTimeout(connect, 1000); };
+}
+document.getElementById("stop").onclick = () => send({action: "stop"});
+document.getElementById("resume").onclick = () => send({action: "resume"});
+connect();
+</script></body></html>
+"""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Web and WebSocket gateway for operator stations")
+    parser.add_argument("--bind", default="127.0.0.1", help="address to listen on; 0.0.0.0 for the ward network")
+    parser.add_argument("--listen-port", type=int, default=8080)
+    args = parser.parse_args(argv)
+    config = load_config()
+    # Without a configured token, each run makes its own and prints it
+    token = config["gateway_token"] or secrets.token_urlsafe(16)
+
+    gateway = None
+
+    def log(message):
+        print(message, file=sys.stderr)
+        if gateway is not None:
+            gateway.event(message)
+
+    def mission_changed(mission):
+        label = f"{mission.destination} (STAT)" if mission.priority == Priority.STAT else mission.destination
+        log(f"Delivery to {label}: {mission.state.value}")
+
+    def estop_result(result):
+        if result.acknowledged:
+            log(f"Emergency stop acknowledged in {result.latency_ms:.0f} ms")
+        else:
+            log("Emergency stop NOT acknowledged")
+
+    client = client_from_config(config, log=log, on_estop=estop_result,
+                                on_state_change=lambda connected: gateway.changed(),
+                                on_link_quality=lambda quality: gateway.changed())
+    missions = MissionQueue(client, on_change=lambda: gateway.changed(), on_mission=mission_changed)
+    gateway = Gateway(client, missions, token)
+    client.start()
+    print(f"Serving http://{args.bind}:{args.listen_port}/#token={token} for {client.host}:{client.port}",
+          file=sys.stderr)
+    try:
+        asyncio.run(gateway.serve(args.bind, args.listen_port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
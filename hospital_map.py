@@ -0,0 +1,165 @@
+import heapq
+import json
+import math
+
+from routes import get_compiled
+
+
+class MapError(ValueError):
+    """The hospital map file is inconsistent"""
+
+
+def normalize_angle(degrees):
+    """Wrap an angle into (-180, 180]"""
+    degrees = (degrees + 180) % 360 - 180
+    return 180.0 if degrees == -180 else degrees
+
+
+class HospitalMap:
+    """Weighted graph of hallways and junctions with precomputed shortest paths
+
+    Node positions are in meters and headings in degrees counter-clockwise
+    from east, so 90 points along +y. Edge weights are the straight-line
+    distance between their nodes unless the map gives one explicitly.
+    Shortest paths between every pair of nodes are computed once at load
+    time; the drive instructions for a (start, destination, heading)
+    triple are built on first use and cached.
+    """
+
+    def __init__(self, nodes, edges, destinations=None, start=None, start_heading=90,
+                 forward_ms_per_meter=1000, turn_ms_per_90=5000):
+        self.nodes = {name: (float(x), float(y)) for name, (x, y) in nodes.items()}
+        self.destinations = list(destinations if destinations is not None else self.nodes)
+        self.start = start if start is not None else next(iter(self.nodes))
+        self.start_heading = start_heading
+        self.forward_ms_per_meter = forward_ms_per_meter
+        self.turn_ms_per_90 = turn_ms_per_90
+
+        self.adjacency = {name: [] for name in self.nodes}
+        for edge in edges:
+            a, b = edge[0], edge[1]
+            if a not in self.nodes or b not in self.nodes:
+                raise MapError(f"Edge {a} - {b} refers to an unknown node")
+            weight = float(edge[2]) if len(edge) > 2 else self._length(a, b)
+            self.adjacency[a].append((b, weight))
+            self.adjacency[b].append((a, weight))
+        for name in [self.start] + self.destinations:
+            if name not in self.nodes:
+                raise MapError(f"Unknown node {name!r}")
+
+        self._distance = {}
+        self._next_hop = {}
+        self._routes = {}
+        self._travel = {}
+        self._precompute()
+
+    @classmethod
+    def load(cls, path):
+        """Load a map from a JSON file"""
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(
+            data["nodes"],
+            data["edges"],
+            destinations=data.get("destinations"),
+            start=data.get("start"),
+            start_heading=data.get("start_heading", 90),
+            forward_ms_per_meter=data.get("forward_ms_per_meter", 1000),
+            turn_ms_per_90=data.get("turn_ms_per_90", 5000),
+        )
+
+    def _length(self, a, b):
+        (ax, ay), (bx, by) = self.nodes[a], self.nodes[b]
+        return math.hypot(bx - ax, by - ay)
+
+    def _precompute(self):
+        """All-pairs shortest paths, one Dijkstra per target node
+
+        The graph is undirected, so the search tree grown from a target
+        gives every other node's next hop towards that target.
+        """
+        for target in self.nodes:
+            distance = {target: 0.0}
+            next_hop = {target: None}
+            heap = [(0.0, target)]
+            while heap:
+                dist, node = heapq.heappop(heap)
+                if dist > distance[node]:
+                    continue
+                for neighbor, weight in self.adjacency[node]:
+                    candidate = dist + weight
+                    if candidate < distance.get(neighbor, math.inf):
+                        distance[neighbor] = candidate
+                        next_hop[neighbor] = node
+                        heapq.heappush(heap, (candidate, neighbor))
+            for node, dist in distance.items():
+                self._distance[node, target] = dist
+                self._next_hop[node, target] = next_hop[node]
+
+    def distance(self, source, target):
+        """Shortest path length in meters, or inf if unreachable"""
+        return self._distance.get((source, target), math.inf)
+
+    def path(self, source, target):
+        """Node names along the shortest path from source to target"""
+        if (source, target) not in self._next_hop:
+            raise MapError(f"No path from {source!r} to {target!r}")
+        nodes = [source]
+        while nodes[-1] != target:
+            nodes.append(self._next_hop[nodes[-1], target])
+        return nodes
+
+    def heading(self, a, b):
+        """Direction of travel from node a to node b in degrees"""
+        (ax, ay), (bx, by) = self.nodes[a], self.nodes[b]
+        return math.degrees(math.atan2(by - ay, bx - ax))
+
+    def instructions(self, source, target, heading=None):
+        """Build "cmd,duration" steps for a trip; returns (steps, arrival heading)"""
+        heading = self.start_heading if heading is None else heading
+        nodes = self.path(source, target)
+        steps = []
+        for a, b in zip(nodes, nodes[1:]):
+            new_heading = self.heading(a, b)
+            turn = normalize_angle(new_heading - heading)
+            if abs(turn) >= 1:
+                duration = round(abs(turn) / 90 * self.turn_ms_per_90)
+                steps.append(f"{'left' if turn > 0 else 'right'},{duration}")
+            steps.append(f"forward,{round(self._length(a, b) * self.forward_ms_per_meter)}")
+            heading = new_heading
+        steps.append("done,0")
+        return steps, heading
+
+    def route(self, source, target, heading=None):
+        """Compiled route for a trip and the heading the robot arrives with"""
+        heading = self.start_heading if heading is None else heading
+        # Headings are only meaningful to the degree
+        key = (source, target, round(heading) % 360)
+        cached = self._routes.get(key)
+        if cached is None:
+            steps, arrival = self.instructions(source, target, heading)
+            cached = self._routes[key] = (get_compiled(steps, f"{source} -> {target}"), arrival)
+        return cached
+
+    def travel_time(self, source, target):
+        """Drive time in ms between two nodes, starting out facing the first hallway
+
+        Turns along the way are included but the initial turn is not, since
+        it depends on how the robot arrived at ``source``. Values are cached,
+        so repeated tour planning reads from a distance matrix.
+        """
+        key = (source, target)
+        cached = self._travel.get(key)
+        if cached is None:
+            if source == target:
+                cached = 0
+            else:
+                nodes = self.path(source, target)
+                cached = self.route(source, target, self.heading(nodes[0], nodes[1]))[0].total_duration
+            self._travel[key] = cached
+        return cached
+
+    def destination_table(self, source=None, heading=None):
+        """Routes from ``source`` (default: the start node) to every destination"""
+        source = self.start if source is None else source
+        return {name: self.route(source, name, heading)[0] for name in self.destinations}
@@ -0,0 +1,309 @@
+import collections
+import functools
+import http.server
+import inspect
+import json
+import os
+import threading
+import time
+
+
+def nearest_rank(ordered, p):
+    """Nearest-rank percentile of an already sorted, non-empty sequence"""
+    return ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))]
+
+
+class RollingHistogram:
+    """Latency distribution over the most recent ``window`` samples"""
+
+    def __init__(self, window=200):
+        self._samples = collections.deque(maxlen=window)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, value):
+        self._samples.append(value)
+
+    def clear(self):
+        self._samples.clear()
+
+    def percentile(self, p):
+        """Percentile of the window, or None without samples"""
+        if not self._samples:
+            return None
+        return nearest_rank(sorted(self._samples), p)
+
+    def summary(self):
+        ordered = sorted(self._samples)
+        if not ordered:
+            return {"count": 0}
+        return {
+            "count": len(ordered),
+            "p50": nearest_rank(ordered, 50),
+            "p95": nearest_rank(ordered, 95),
+            "p99": nearest_rank(ordered, 99),
+            "max": ordered[-1],
+        }
+
+
+class Counter:
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    """Value that can go up and down"""
+
+    kind = "gauge"
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return self.value
+
+
+class Summary:
+    """Running count and sum plus percentiles over a rolling window"""
+
+    kind = "summary"
+
+    def __init__(self, window=200):
+        self.count = 0
+        self.sum = 0.0
+        self.histogram = RollingHistogram(window)
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            self.histogram.add(value)
+
+    def snapshot(self):
+        with self._lock:
+            summary = self.histogram.summary()
+            summary.update(count=self.count, sum=self.sum)
+        return summary
+
+
+class _Timer:
+    """Context manager that records its elapsed time in milliseconds"""
+
+    __slots__ = ("registry", "summary", "name", "labels", "started")
+
+    def __init__(self, registry, summary, name, labels):
+        self.registry = registry
+        self.summary = summary
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed_ms = (time.perf_counter() - self.started) * 1000
+        self.summary.observe(elapsed_ms)
+        hook = self.registry.profile_hook
+        if hook is not None:
+            hook(self.name, self.labels, elapsed_ms)
+
+
+def _format_labels(labels, **extra):
+    items = list(labels) + sorted(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+class MetricsRegistry:
+    """Named counters, gauges and latency summaries
+
+    Metrics are created on first use and looked up by name plus optional
+    labels, so instrumented code just calls e.g.
+    ``registry.counter("robot_sends_total", robot=host).inc()``. Times are
+    in milliseconds. ``profile_hook``, when set, is called as
+    ``hook(name, labels, elapsed_ms)`` after every timed section and is
+    the place to attach a profiler or a slow-call logger.
+    """
+
+    def __init__(self):
+        self.profile_hook = None
+        self._metrics = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = self._metrics[key] = cls()
+                    if help or name not in self._help:
+                        self._help[name] = help
+        if not isinstance(metric, cls):
+            raise TypeError(f"Metric {name} is a {metric.kind}, not a {cls.kind}")
+        return metric
+
+    def counter(self, name, help="", **labels):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help="", **labels):
+        return self._get(Gauge, name, help, labels)
+
+    def summary(self, name, help="", **labels):
+        return self._get(Summary, name, help, labels)
+
+    def time(self, name, help="", **labels):
+        """Context manager that records the duration of its block in ``name``"""
+        return _Timer(self, self.summary(name, help, **labels), name, labels)
+
+    def timed(self, name, help="", **labels):
+        """Decorator form of ``time``; works on functions and coroutines"""
+        def decorate(fn):
+            if inspect.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def wrapper(*args, **kwargs):
+                    with self.time(name, help, **labels):
+                        return await fn(*args, **kwargs)
+            else:
+                @functools.wraps(fn)
+                def wrapper(*args, **kwargs):
+                    with self.time(name, help, **labels):
+                        return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def snapshot(self):
+        """Every metric as ``{name: [{"labels": {...}, "value": ...}]}``"""
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        result = {}
+        for (name, labels), metric in metrics:
+            result.setdefault(name, []).append({"labels": dict(labels), "value": metric.snapshot()})
+        return result
+
+    def to_json(self):
+        return json.dumps({"timestamp": time.time(), "metrics": self.snapshot()}, indent=2)
+
+    def to_prometheus(self):
+        """Prometheus text exposition format"""
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        lines = []
+        declared = set()
+        for (name, labels), metric in metrics:
+            if name not in declared:
+                declared.add(name)
+                if self._help.get(name):
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {metric.kind}")
+            value = metric.snapshot()
+            if metric.kind != "summary":
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+                continue
+            for key, quantile in (("p50", "0.5"), ("p95", "0.95"), ("p99", "0.99")):
+                if key in value:
+                    lines.append(f"{name}{_format_labels(labels, quantile=quantile)} {value[key]}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {value['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Atomically write a snapshot; ``.json`` files get JSON, others Prometheus text"""
+        text = self.to_json() if path.endswith(".json") else self.to_prometheus()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(temporary, path)
+
+
+# Process-wide registry used by the engine, e-stop channel and GUIs
+REGISTRY = MetricsRegistry()
+
+
+class MetricsExporter:
+    """Background thread that rewrites a metrics file every ``interval`` seconds
+
+    Point a Prometheus node-exporter textfile collector at a ``.prom``
+    file, or read the ``.json`` form from scripts.
+    """
+
+    def __init__(self, path, registry=REGISTRY, interval=10.0):
+        self.path = path
+        self.registry = registry
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-export", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the thread after writing a final snapshot"""
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=2)
+
+    def _run(self):
+        while True:
+            stopped = self._stopped.wait(self.interval)
+            try:
+                self.registry.write(self.path)
+            except OSError:
+                pass
+            if stopped:
+                return
+
+
+def serve_metrics(port, host="127.0.0.1", registry=REGISTRY):
+    """Serve ``/metrics`` (Prometheus text) and ``/metrics.json`` over HTTP
+
+    Runs on a daemon thread; call ``shutdown()`` on the returned server
+    to stop it.
+    """
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = registry.to_prometheus(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = registry.to_json(), "application/json"
+            else:
+                self.send_error(404)
+                return
+            payload = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -0,0 +1,299 @@
+import enum
+import itertools
+import threading
+import time
+
+from hospital_map import MapError
+
+
+class Priority(enum.IntEnum):
+    STAT = 0
+    ROUTINE = 1
+
+
+class MissionState(str, enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+# Up to this many stops are ordered exactly; longer tours use a heuristic
+EXACT_TOUR_STOPS = 8
+
+_mission_ids = itertools.count(1)
+
+
+class Mission:
+    """One delivery request to a destination"""
+
+    def __init__(self, destination, priority=Priority.ROUTINE):
+        self.id = next(_mission_ids)
+        self.destination = destination
+        self.priority = Priority(priority)
+        self.state = MissionState.QUEUED
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def __repr__(self):
+        return (f"Mission(id={self.id}, destination={self.destination!r}, "
+                f"priority={self.priority.name}, state={self.state.value})")
+
+
+def tour_cost(travel_time, start, stops):
+    """Total drive time of visiting ``stops`` in order from ``start``"""
+    return sum(travel_time(a, b) for a, b in zip([start] + list(stops), stops))
+
+
+def plan_tour(travel_time, start, stops):
+    """Order ``stops`` to minimize total drive time from ``start``
+
+    The tour ends at its last stop. Up to ``EXACT_TOUR_STOPS`` stops are
+    solved exactly with Held-Karp dynamic programming. Longer tours start
+    from nearest-neighbour order and are improved with 2-opt.
+    """
+    stops = list(dict.fromkeys(stops))
+    if len(stops) <= 1:
+        return stops
+    if len(stops) <= EXACT_TOUR_STOPS:
+        return _held_karp(travel_time, start, stops)
+    return _two_opt(travel_time, start, _nearest_neighbour(travel_time, start, stops))
+
+
+def _held_karp(travel_time, start, stops):
+    n = len(stops)
+    # best[mask][last] = (cost, previous) of visiting ``mask`` ending at ``last``
+    best = [dict() for _ in range(1 << n)]
+    for i, stop in enumerate(stops):
+        best[1 << i][i] = (travel_time(start, stop), None)
+    for mask in range(1, 1 << n):
+        for last, (cost, _) in best[mask].items():
+            for i in range(n):
+                if mask & (1 << i):
+                    continue
+                candidate = cost + travel_time(stops[last], stops[i])
+                entry = best[mask | (1 << i)].get(i)
+                if entry is None or candidate < entry[0]:
+                    best[mask | (1 << i)][i] = (candidate, last)
+
+    mask = (1 << n) - 1
+    last = min(best[mask], key=lambda i: best[mask][i][0])
+    order = []
+    while last is not None:
+        order.append(stops[last])
+        last, mask = best[mask][last][1], mask & ~(1 << last)
+    return order[::-1]
+
+
+def _nearest_neighbour(travel_time, start, stops):
+    remaining = list(stops)
+    order = []
+    current = start
+    while remaining:
+        current = min(remaining, key=lambda stop: travel_time(current, stop))
+        remaining.remove(current)
+        order.append(current)
+    return order
+
+
+def _two_opt(travel_time, start, order):
+    best_cost = tour_cost(travel_time, start, order)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(len(order) - 1):
+            for j in range(i + 1, len(order)):
+                candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+                cost = tour_cost(travel_time, start, candidate)
+                if cost < best_cost - 1e-9:
+                    order, best_cost, improved = candidate, cost, True
+    return order
+
+
+class MissionQueue:
+    """Prioritized delivery queue that drives a RobotClient through multi-stop tours
+
+    Pending destinations are merged into one tour: STAT stops first, then
+    routine ones, each group ordered to minimize drive time. Only the next
+    leg is dispatched. The tour is re-planned at every stop, so a STAT
+    request submitted mid-tour goes next, and new routine requests join
+    the tour where they fit best. Missions to the same destination are
+    delivered together.
+
+    When a leg is cancelled (an emergency stop) its missions go back to
+    the queue and the queue pauses until ``resume``. ``on_change`` is
+    called with no arguments and ``on_mission`` with the mission after
+    every state change. Both may be called from background threads.
+    """
+
+    def __init__(self, client, on_change=None, on_mission=None, max_stops=8):
+        self.client = client
+        self.on_change = on_change
+        self.on_mission = on_mission
+        self.max_stops = max_stops
+        self.paused = False
+        self.current_leg = None
+        self.current_stop = None
+        self._missions = []
+        self._lock = threading.RLock()
+
+    # Queries
+
+    def missions(self):
+        """Active missions: the running leg first, then queued ones in tour order"""
+        with self._lock:
+            running = [m for m in self._missions if m.state == MissionState.RUNNING]
+            order = {stop: index for index, stop in enumerate(self.plan())}
+            queued = sorted((m for m in self._missions if m.state == MissionState.QUEUED),
+                            key=lambda m: (order.get(m.destination, len(order)), m.id))
+            return running + queued
+
+    def plan(self):
+        """The stops the robot will visit next, in order"""
+        with self._lock:
+            queued = [m for m in self._missions if m.state == MissionState.QUEUED]
+            start = self.current_stop or self.client.location
+            tour = []
+            for priority in Priority:
+                stops = [m.destination for m in queued if m.priority == priority]
+                stops = [stop for stop in dict.fromkeys(stops) if stop not in tour]
+                if not stops:
+                    continue
+                tour_start = tour[-1] if tour else start
+                if tour_start is None:
+                    # Position unknown: keep submission order
+                    tour.extend(stops)
+                else:
+                    # Stops the robot cannot reach are failed by the next dispatch
+                    stops = [stop for stop in stops if self._reachable(tour_start, stop)]
+                    tour.extend(plan_tour(self.client.travel_time, tour_start, stops))
+            return tour[:self.max_stops]
+
+    def estimated_duration(self):
+        """Drive time in ms for the planned tour"""
+        start = self.current_stop or self.client.location
+        tour = self.plan()
+        if start is None or not tour:
+            return None
+        return tour_cost(self.client.travel_time, start, tour)
+
+    # Commands
+
+    def submit(self, destination, priority=Priority.ROUTINE):
+        """Queue a delivery; raises ValueError for unknown or unreachable destinations"""
+        # Any location the client can plan a route to is a valid stop
+        self.client.plan_route(destination)
+        mission = Mission(destination, priority)
+        with self._lock:
+            self._missions.append(mission)
+        self._notify(mission)
+        self._dispatch()
+        return mission
+
+    def cancel(self, mission_id):
+        """Remove a queued mission; returns whether it was queued"""
+        with self._lock:
+            for mission in self._missions:
+                if mission.id == mission_id and mission.state == MissionState.QUEUED:
+                    self._finish(mission, MissionState.CANCELLED)
+                    break
+            else:
+                return False
+        self._notify(mission)
+        return True
+
+    def pause(self):
+        """Stop dispatching new legs; the running leg continues"""
+        self.paused = True
+        self._notify()
+
+    def resume(self):
+        """Resume dispatching after a pause or emergency stop"""
+        self.paused = False
+        self._notify()
+        self._dispatch()
+
+    # Scheduling
+
+    def _reachable(self, source, target):
+        try:
+            self.client.travel_time(source, target)
+        except MapError:
+            return False
+        return True
+
+    def _fail_unreachable(self):
+        """Fail queued missions to stops the robot cannot drive to from where it is"""
+        with self._lock:
+            start = self.current_stop or self.client.location
+            failed = [m for m in self._missions if m.state == MissionState.QUEUED
+                      and start is not None and not self._reachable(start, m.destination)]
+            for mission in failed:
+                self._finish(mission, MissionState.FAILED)
+        for mission in failed:
+            self._notify(mission)
+
+    def _finish(self, mission, state):
+        mission.state = state
+        mission.finished_at = time.time()
+        self._missions.remove(mission)
+
+    def _notify(self, mission=None):
+        if mission is not None and self.on_mission:
+            self.on_mission(mission)
+        if self.on_change:
+            self.on_change()
+
+    def _dispatch(self):
+        """Start the next leg if the robot is free"""
+        self._fail_unreachable()
+        with self._lock:
+            if self.paused or self.current_leg is not None:
+                return
+            tour = self.plan()
+            if not tour:
+                return
+            stop = tour[0]
+            future = None
+            leg = [m for m in self._missions if m.state == MissionState.QUEUED and m.destination == stop]
+            for mission in leg:
+                mission.state = MissionState.RUNNING
+
+            if stop == self.client.location:
+                # Nothing to drive; deliver on the spot
+                for mission in leg:
+                    self._finish(mission, MissionState.DONE)
+            else:
+                try:
+                    future = self.current_leg = self.client.go_to(stop)
+                    self.current_stop = stop
+                except ValueError:
+                    for mission in leg:
+                        self._finish(mission, MissionState.FAILED)
+        for mission in leg:
+            self._notify(mission)
+
+        if future is None:
+            self._dispatch()
+        else:
+            future.add_done_callback(lambda future: self._leg_finished(future, leg))
+
+    def _leg_finished(self, future, leg):
+        with self._lock:
+            self.current_leg = self.current_stop = None
+            if future.cancelled():
+                self.paused = True
+                state = MissionState.QUEUED
+            elif future.exception() is None and future.result():
+                state = MissionState.DONE
+            else:
+                state = MissionState.FAILED
+            for mission in leg:
+                if state == MissionState.QUEUED:
+                    mission.state = state
+                else:
+                    self._finish(mission, state)
+        for mission in leg:
+            self._notify(mission)
+        self._dispatch()
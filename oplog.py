@@ -0,0 +1,254 @@
+import argparse
+import gzip
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+
+class RingBuffer:
+    """Fixed-capacity buffer that keeps only the most recent items"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._items = [None] * capacity
+        self._start = 0
+        self._size = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, item):
+        end = (self._start + self._size) % self.capacity
+        self._items[end] = item
+        if self._size < self.capacity:
+            self._size += 1
+        else:
+            # Full: overwrite the oldest item
+            self._start = (self._start + 1) % self.capacity
+            self.dropped += 1
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def items(self):
+        """Return the buffered items, oldest first"""
+        return [self._items[(self._start + i) % self.capacity] for i in range(self._size)]
+
+
+class Journal:
+    """Append-only operation journal with size-based rotation and compression
+
+    Records are written as ``<epoch>\\t<message>`` lines to ``<name>.log`` by
+    a background thread. When the file exceeds ``max_bytes`` it is gzipped
+    into a segment named after the time range it covers, so time-bounded
+    searches can skip whole segments without opening them. At most
+    ``max_segments`` compressed segments are kept.
+    """
+
+    def __init__(self, directory, name="operations", max_bytes=1_000_000, max_segments=50):
+        self.directory = directory
+        self.name = name
+        self.max_bytes = max_bytes
+        self.max_segments = max_segments
+        self.path = os.path.join(directory, f"{name}.log")
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="journal", daemon=True)
+        self._file = None
+        self._segment_start = None
+
+    def start(self):
+        """Start the background writer"""
+        os.makedirs(self.directory, exist_ok=True)
+        self._segment_start = self._first_timestamp(self.path)
+        self._thread.start()
+
+    def append(self, message, timestamp=None):
+        """Queue a message for the journal; never blocks on disk"""
+        self._queue.put((time.time() if timestamp is None else timestamp, message))
+
+    def close(self, timeout=2.0):
+        """Flush pending records and stop the writer"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    # Writer thread
+
+    def _run(self):
+        self._file = open(self.path, "a", encoding="utf-8")
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            # Write everything that piled up in one go
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            for record in batch:
+                if record is None:
+                    running = False
+                    continue
+                self._write(*record)
+            self._file.flush()
+        self._file.close()
+
+    def _write(self, timestamp, message):
+        if self._segment_start is None:
+            self._segment_start = timestamp
+        # Keep one record per line whatever the message contains
+        message = message.replace("\n", " ").replace("\t", " ")
+        self._file.write(f"{timestamp:.3f}\t{message}\n")
+        if self._file.tell() >= self.max_bytes:
+            self._rotate(timestamp)
+
+    def _rotate(self, last_timestamp):
+        self._file.close()
+        segment = os.path.join(
+            self.directory,
+            f"{self.name}-{self._segment_start:.3f}-{last_timestamp:.3f}.log.gz")
+        with self._lock:
+            with open(self.path, "rb") as source, gzip.open(segment, "wb") as target:
+                target.writelines(source)
+            self._file = open(self.path, "w", encoding="utf-8")
+        self._segment_start = None
+        for _, _, old in self.segments()[:-self.max_segments]:
+            os.remove(old)
+
+    # Queries
+
+    @staticmethod
+    def _first_timestamp(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return float(f.readline().split("\t", 1)[0])
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _parse(line):
+        if not line.endswith("\n"):
+            # Partially written record
+            return None
+        timestamp, _, message = line.rstrip("\n").partition("\t")
+        try:
+            return float(timestamp), message
+        except ValueError:
+            return None
+
+    def segments(self):
+        """List compressed segments as (start, end, path), oldest first"""
+        prefix = f"{self.name}-"
+        found = []
+        for filename in os.listdir(self.directory):
+            if not (filename.startswith(prefix) and filename.endswith(".log.gz")):
+                continue
+            start, _, end = filename[len(prefix):-len(".log.gz")].partition("-")
+            try:
+                found.append((float(start), float(end), os.path.join(self.directory, filename)))
+            except ValueError:
+                continue
+        return sorted(found)
+
+    def _read_segment(self, path):
+        opener = gzip.open if path.endswith(".gz") else open
+        try:
+            with opener(path, "rt", encoding="utf-8") as f:
+                return [record for record in map(self._parse, f) if record]
+        except OSError:
+            return []
+
+    def _tail_current(self, n, block_size=8192):
+        """Read the last ``n`` records of the live file without reading all of it"""
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                position = f.tell()
+                data = b""
+                while position > 0 and data.count(b"\n") <= n:
+                    step = min(block_size, position)
+                    position -= step
+                    f.seek(position)
+                    data = f.read(step) + data
+        except OSError:
+            return []
+        lines = data.decode("utf-8", errors="replace").splitlines(keepends=True)
+        if position > 0:
+            # The first line may be cut in half
+            lines = lines[1:]
+        records = [record for record in map(self._parse, lines) if record]
+        return records[-n:]
+
+    def tail(self, n=100):
+        """Return the newest ``n`` records as (timestamp, message), oldest first"""
+        with self._lock:
+            records = self._tail_current(n)
+            for _, _, path in reversed(self.segments()):
+                if len(records) >= n:
+                    break
+                records = self._read_segment(path) + records
+        return records[-n:]
+
+    def search(self, text=None, since=None, until=None, limit=None):
+        """Find records containing ``text`` within [since, until], newest first"""
+        since = float("-inf") if since is None else since
+        until = float("inf") if until is None else until
+        needle = text.lower() if text else None
+
+        with self._lock:
+            sources = [(start, end, path) for start, end, path in self.segments()
+                       if end >= since and start <= until]
+            sources.append((None, None, self.path))
+
+        matches = []
+        for _, _, path in reversed(sources):
+            for timestamp, message in reversed(self._read_segment(path)):
+                if not since <= timestamp <= until:
+                    continue
+                if needle and needle not in message.lower():
+                    continue
+                matches.append((timestamp, message))
+                if limit and len(matches) >= limit:
+                    return matches
+        return matches
+
+
+def format_record(record):
+    timestamp, message = record
+    return f"[{datetime.fromtimestamp(timestamp):%Y-%m-%d %H:%M:%S}] {message}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the HMETV operation journal")
+    parser.add_argument("directory", help="journal directory")
+    sub = parser.add_subparsers(dest="action", required=True)
+    tail = sub.add_parser("tail", help="show the newest records")
+    tail.add_argument("-n", type=int, default=50)
+    search = sub.add_parser("search", help="find records containing some text")
+    search.add_argument("text", nargs="?")
+    search.add_argument("--since", type=datetime.fromisoformat)
+    search.add_argument("--until", type=datetime.fromisoformat)
+    search.add_argument("--limit", type=int)
+    args = parser.parse_args()
+
+    journal = Journal(args.directory)
+    if args.action == "tail":
+        records = journal.tail(args.n)
+    else:
+        records = journal.search(
+            args.text,
+            since=args.since.timestamp() if args.since else None,
+            until=args.until.timestamp() if args.until else None,
+            limit=args.limit)
+    for record in records:
+        print(format_record(record))
+
+
+if __name__ == "__main__":
+    main()
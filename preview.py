@@ -0,0 +1,393 @@
+import argparse
+import collections
+import math
+import sys
+import time
+
+from routes import Opcode, parse_instruction
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; the per-step fallback gives the same results
+    np = None
+
+# Recorded missions used to calibrate a model, newest first
+CALIBRATION_MISSIONS = 200
+
+# Smaller batches are simulated step by step; array setup costs more than it
+# saves. `benchmark.py` reports both timings per batch size: they break even
+# at about 32 trips, and the bundled map's 4 destinations are 5x faster per step
+VECTORIZE_MIN_ROUTES = 32
+
+
+class KinematicModel:
+    """How far and how long the cart moves for each step
+
+    ``forward_m_per_s`` and ``turn_deg_per_s`` turn step durations into
+    motion. A trip's ETA is its step time scaled by ``scale`` plus
+    ``step_overhead_ms`` for every step, both fitted to recorded runs by
+    ``calibrated``.
+    """
+
+    def __init__(self, forward_m_per_s=1.0, turn_deg_per_s=18.0, scale=1.0, step_overhead_ms=0.0, samples=0):
+        self.forward_m_per_s = forward_m_per_s
+        self.turn_deg_per_s = turn_deg_per_s
+        self.scale = scale
+        self.step_overhead_ms = step_overhead_ms
+        self.samples = samples
+
+    @classmethod
+    def from_map(cls, hospital_map):
+        """The speeds the map uses to build routes, uncalibrated"""
+        if hospital_map is None:
+            return cls()
+        return cls(1000.0 / hospital_map.forward_ms_per_meter, 90000.0 / hospital_map.turn_ms_per_90)
+
+    def eta_ms(self, step_ms, steps):
+        return self.scale * step_ms + self.step_overhead_ms * steps
+
+    def calibrated(self, recorder, limit=CALIBRATION_MISSIONS):
+        """Copy of the model fitted to successful recorded missions
+
+        Only sequenced runs are used, since their recording ends when the
+        robot reports the last step finished. Missions whose ID appears in
+        the index more than once, or whose log holds any outcome besides
+        "ok", are skipped: their times cannot be trusted. The fit is least
+        squares of actual time against step time and step count. Without
+        at least two usable missions the model is returned unchanged.
+        """
+        summaries = recorder.find()
+        entries = collections.Counter(summary.id for summary in summaries)
+        usable = [summary for summary in summaries if summary.outcome == "ok" and entries[summary.id] == 1]
+        nominal, counts, actual = [], [], []
+        for summary in usable[:limit]:
+            events = recorder.events(summary.id)
+            if [text for _, kind, text in events if kind == "outcome"] != ["ok"]:
+                continue
+            if not any(kind == "reply" and text.startswith("fin,") for _, kind, text in events):
+                continue
+            step_ms = steps = 0
+            for _, kind, text in events:
+                if kind != "send":
+                    continue
+                opcode, duration = parse_instruction(text)
+                if opcode != Opcode.DONE:
+                    step_ms += duration
+                    steps += 1
+            if step_ms:
+                nominal.append(step_ms)
+                counts.append(steps)
+                actual.append((summary.ended_at - summary.started_at) * 1000)
+        if len(actual) < 2:
+            return self
+        scale, overhead = _fit(nominal, counts, actual)
+        return KinematicModel(self.forward_m_per_s, self.turn_deg_per_s, scale, overhead, len(actual))
+
+    def __repr__(self):
+        return (f"KinematicModel(forward={self.forward_m_per_s:.2f} m/s, turn={self.turn_deg_per_s:.1f} deg/s, "
+                f"scale={self.scale:.3f}, step_overhead={self.step_overhead_ms:.0f} ms, samples={self.samples})")
+
+
+def _fit(nominal, counts, actual):
+    """Least squares ``actual = scale * nominal + overhead * counts`` with a non-negative overhead"""
+    if np is not None:
+        a = np.column_stack((nominal, counts)).astype(float)
+        (scale, overhead), *_ = np.linalg.lstsq(a, np.asarray(actual, dtype=float), rcond=None)
+    else:
+        snn = sum(n * n for n in nominal)
+        snc = sum(n * c for n, c in zip(nominal, counts))
+        scc = sum(c * c for c in counts)
+        sna = sum(n * a for n, a in zip(nominal, actual))
+        sca = sum(c * a for c, a in zip(counts, actual))
+        det = snn * scc - snc * snc
+        if det:
+            scale, overhead = (sna * scc - snc * sca) / det, (snn * sca - snc * sna) / det
+        else:
+            scale, overhead = sna / snn, 0.0
+    if overhead < 0:
+        # Steps cannot finish faster than their durations allow; fit the scale alone
+        scale = sum(n * a for n, a in zip(nominal, actual)) / sum(n * n for n in nominal)
+        overhead = 0.0
+    return float(scale), float(overhead)
+
+
+class Trajectory:
+    """A simulated trip: waypoints in meters, arrival heading and ETA
+
+    Batches keep their waypoints as array rows and only build the
+    ``points`` list for trips that are actually drawn.
+    """
+
+    __slots__ = ("heading", "eta_ms", "_points", "_rows")
+
+    def __init__(self, points, heading, eta_ms, rows=None):
+        self.heading = heading
+        self.eta_ms = eta_ms
+        self._points = points
+        self._rows = rows
+
+    @property
+    def points(self):
+        if self._points is None:
+            start, x, y, moved = self._rows
+            self._points = [start] + list(zip(x[moved].tolist(), y[moved].tolist()))
+            self._rows = None
+        return self._points
+
+    def __repr__(self):
+        x, y = self.points[-1]
+        return f"Trajectory(end=({x:.1f}, {y:.1f}), heading={self.heading:.0f}, eta_ms={self.eta_ms:.0f})"
+
+
+def simulate(routes, starts, model, vectorize=None):
+    """Integrate compiled routes into trajectories, all in one batch
+
+    ``starts`` holds an (x, y, heading) pose for each route. Turns are
+    made in place and forward and backward steps move along the current
+    heading. With NumPy every route is a row of one padded array and the
+    whole batch is a handful of cumulative sums. Without NumPy, or for
+    fewer than ``VECTORIZE_MIN_ROUTES`` routes, each route is stepped
+    through in Python instead. ``vectorize`` forces one way or the other.
+    """
+    if not routes:
+        return []
+    if vectorize is None:
+        vectorize = len(routes) >= VECTORIZE_MIN_ROUTES
+    if np is None or not vectorize:
+        return [_simulate_one(route, start, model) for route, start in zip(routes, starts)]
+    return _simulate_batch(routes, starts, model)
+
+
+def _simulate_batch(routes, starts, model):
+    # Every route's steps in one flat copy, scattered into rows padded with zeros
+    lengths = np.fromiter(map(len, routes), dtype=np.intp, count=len(routes))
+    rows = np.repeat(np.arange(len(routes)), lengths)
+    columns = np.arange(len(rows)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    opcodes = np.zeros((len(routes), lengths.max()), dtype=np.uint8)
+    durations = np.zeros(opcodes.shape, dtype=np.float64)
+    opcodes[rows, columns] = np.frombuffer(b"".join(route.opcodes.tobytes() for route in routes), dtype=np.uint8)
+    durations[rows, columns] = np.frombuffer(b"".join(route.durations.tobytes() for route in routes),
+                                             dtype=np.int32)
+    x0, y0, heading0 = np.asarray(starts, dtype=np.float64).T
+
+    seconds = durations / 1000.0
+    turn = (np.where(opcodes == Opcode.LEFT, seconds, 0.0)
+            - np.where(opcodes == Opcode.RIGHT, seconds, 0.0)) * model.turn_deg_per_s
+    heading = heading0[:, None] + np.cumsum(turn, axis=1)
+    distance = (np.where(opcodes == Opcode.FORWARD, seconds, 0.0)
+                - np.where(opcodes == Opcode.BACKWARD, seconds, 0.0)) * model.forward_m_per_s
+    radians = np.radians(heading)
+    x = x0[:, None] + np.cumsum(distance * np.cos(radians), axis=1)
+    y = y0[:, None] + np.cumsum(distance * np.sin(radians), axis=1)
+
+    timed = (opcodes != 0) & (opcodes != Opcode.DONE)
+    eta = model.eta_ms((durations * timed).sum(axis=1), timed.sum(axis=1))
+
+    moved = distance != 0
+    return [Trajectory(None, arrival, eta_ms, ((start[0], start[1]), x[row], y[row], moved[row]))
+            for row, (start, arrival, eta_ms) in enumerate(zip(starts, (heading[:, -1] % 360).tolist(),
+                                                                 eta.tolist()))]
+
+
+def _simulate_one(route, start, model):
+    x, y, heading = start
+    points = [(x, y)]
+    step_ms = steps = 0
+    for opcode, duration in zip(route.opcodes, route.durations):
+        if opcode == Opcode.DONE:
+            continue
+        step_ms += duration
+        steps += 1
+        seconds = duration / 1000.0
+        if opcode == Opcode.LEFT:
+            heading += seconds * model.turn_deg_per_s
+        elif opcode == Opcode.RIGHT:
+            heading -= seconds * model.turn_deg_per_s
+        elif opcode in (Opcode.FORWARD, Opcode.BACKWARD) and duration:
+            distance = seconds * model.forward_m_per_s
+            if opcode == Opcode.BACKWARD:
+                distance = -distance
+            x += distance * math.cos(math.radians(heading))
+            y += distance * math.sin(math.radians(heading))
+            points.append((x, y))
+    return Trajectory(points, heading % 360, model.eta_ms(step_ms, steps))
+
+
+def batch_difference(routes, starts, model):
+    """Largest disagreement between the NumPy batch and the per-step simulation
+
+    Returns a dict of the worst waypoint distance (m), arrival heading
+    (degrees) and ETA (ms) over all routes, with ``points`` True when
+    every trajectory has the same number of waypoints. Needs NumPy.
+    """
+    batch = simulate(routes, starts, model, vectorize=True)
+    single = simulate(routes, starts, model, vectorize=False)
+    worst = {"position_m": 0.0, "heading_deg": 0.0, "eta_ms": 0.0, "points": True}
+    for a, b in zip(batch, single):
+        if len(a.points) != len(b.points):
+            worst["points"] = False
+            continue
+        worst["position_m"] = max([worst["position_m"]] + [
+            math.hypot(ax - bx, ay - by) for (ax, ay), (bx, by) in zip(a.points, b.points)])
+        turn = abs(a.heading - b.heading) % 360
+        worst["heading_deg"] = max(worst["heading_deg"], min(turn, 360 - turn))
+        worst["eta_ms"] = max(worst["eta_ms"], abs(a.eta_ms - b.eta_ms))
+    return worst
+
+
+def batch_matches(difference, tolerance=1e-6):
+    """Whether a ``batch_difference`` result is within floating point noise"""
+    return difference["points"] and all(
+        difference[key] <= tolerance for key in ("position_m", "heading_deg", "eta_ms"))
+
+
+class Preview:
+    """Where the cart goes and when it arrives if a destination is sent now"""
+
+    __slots__ = ("destination", "trajectory", "eta_ms")
+
+    def __init__(self, destination, trajectory, eta_ms):
+        self.destination = destination
+        self.trajectory = trajectory
+        self.eta_ms = eta_ms
+
+    def __repr__(self):
+        return f"Preview({self.destination!r}, eta_ms={self.eta_ms:.0f})"
+
+
+class RoutePreviewer:
+    """ETAs and paths for every destination from the cart's position and queue
+
+    A new request is served after the queued stops, so each destination's
+    ETA is the rest of the tour plus the drive from its last stop. The
+    tour legs and every candidate trip are simulated in one batch.
+    Without a map, routes are the fixed ``DESTINATIONS`` trips from the
+    dock, drawn from the origin facing +y.
+    """
+
+    def __init__(self, hospital_map=None, model=None, routes=None):
+        self.hospital_map = hospital_map
+        self.model = model or KinematicModel.from_map(hospital_map)
+        if routes is None:
+            # Imported here so previews do not pull in the I/O engine
+            from robot_client import COMPILED_ROUTES
+            routes = COMPILED_ROUTES
+        self.routes = routes
+
+    @property
+    def destinations(self):
+        if self.hospital_map:
+            return list(self.hospital_map.destinations)
+        return list(self.routes)
+
+    def _pose(self, location, heading):
+        hospital_map = self.hospital_map
+        if hospital_map is None or location not in hospital_map.nodes:
+            return 0.0, 0.0, 90.0
+        x, y = hospital_map.nodes[location]
+        return x, y, hospital_map.start_heading if heading is None else heading
+
+    def _trip(self, location, heading, destination):
+        """(compiled route, arrival location, arrival heading) for one leg"""
+        if self.hospital_map is None:
+            return self.routes[destination], destination, heading
+        route, arrival = self.hospital_map.route(location, destination, heading)
+        return route, destination, arrival
+
+    def preview(self, location=None, heading=None, stops=(), destinations=None):
+        """Return (tour trajectories, {destination: Preview}) for the given cart state
+
+        ``location`` and ``heading`` are where the cart is now (default:
+        the dock) and ``stops`` the destinations it will visit first, in
+        order. Unknown stops and destinations are skipped.
+        """
+        if self.hospital_map is not None and location is None:
+            location = self.hospital_map.start
+        destinations = self.destinations if destinations is None else destinations
+        legs, starts = [], []
+        for stop in dict.fromkeys(stops):
+            if stop == location or not self._known(stop):
+                continue
+            starts.append(self._pose(location, heading))
+            route, location, heading = self._trip(location, heading, stop)
+            legs.append(route)
+        candidates = [name for name in destinations if self._known(name)]
+        trips = []
+        for name in candidates:
+            starts.append(self._pose(location, heading))
+            trips.append(self._trip(location, heading, name)[0])
+
+        trajectories = simulate(legs + trips, starts, self.model)
+        tour = trajectories[:len(legs)]
+        wait_ms = sum(leg.eta_ms for leg in tour)
+        previews = {}
+        for name, trajectory in zip(candidates, trajectories[len(legs):]):
+            eta_ms = wait_ms if name == location else wait_ms + trajectory.eta_ms
+            previews[name] = Preview(name, trajectory, eta_ms)
+        return tour, previews
+
+    def _known(self, destination):
+        if self.hospital_map is not None:
+            return destination in self.hospital_map.nodes
+        return destination in self.routes
+
+
+def main(argv=None):
+    # Imported here so that the module itself does not depend on the client
+    from recorder import MissionRecorder
+    from robot_client import MAP_FILE, load_hospital_map
+
+    parser = argparse.ArgumentParser(description="Preview HMETV trips: ETA and path to every destination")
+    parser.add_argument("--map", default=MAP_FILE, help="hospital map file")
+    parser.add_argument("--from", dest="location", help="where the cart is (default: the dock)")
+    parser.add_argument("--heading", type=float, help="cart heading in degrees counter-clockwise from east")
+    parser.add_argument("--stop", action="append", default=[], help="queued stop to visit first (repeatable)")
+    parser.add_argument("--calibrate", metavar="DIRECTORY", help="fit the model to a recorder directory")
+    parser.add_argument("--check", action="store_true",
+                        help="check that the NumPy batch gives the same trips as the per-step simulation")
+    args = parser.parse_args(argv)
+
+    hospital_map = load_hospital_map(args.map)
+    model = KinematicModel.from_map(hospital_map)
+    if args.calibrate:
+        recorder = MissionRecorder(args.calibrate, read_only=True)
+        try:
+            model = model.calibrated(recorder)
+        finally:
+            recorder.close()
+    print(model, file=sys.stderr)
+
+    if args.check:
+        return _check(hospital_map, model)
+
+    previewer = RoutePreviewer(hospital_map, model)
+    started = time.perf_counter()
+    tour, previews = previewer.preview(args.location, args.heading, args.stop)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    for preview in sorted(previews.values(), key=lambda p: p.eta_ms):
+        x, y = preview.trajectory.points[-1]
+        print(f"{preview.destination:<12} {preview.eta_ms / 1000:7.1f} s  ends at ({x:.1f}, {y:.1f}) m")
+    print(f"{len(tour) + len(previews)} trips simulated in {elapsed_ms:.2f} ms", file=sys.stderr)
+    return 0
+
+
+def _check(hospital_map, model):
+    """Compare both simulations on every trip between two map locations"""
+    if np is None:
+        print("NumPy is not installed; only the per-step simulation is used", file=sys.stderr)
+        return 1
+    routes, starts = [], []
+    for source in hospital_map.nodes:
+        x, y = hospital_map.nodes[source]
+        for target in hospital_map.nodes:
+            if target != source and hospital_map.distance(source, target) < math.inf:
+                for heading in (0.0, 90.0, 225.0):
+                    routes.append(hospital_map.route(source, target, heading)[0])
+                    starts.append((x, y, heading))
+    difference = batch_difference(routes, starts, model)
+    print(f"{len(routes)} trips: " + ", ".join(f"{key} {value}" for key, value in difference.items()))
+    return 0 if batch_matches(difference) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
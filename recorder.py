@@ -0,0 +1,414 @@
+import argparse
+import asyncio
+import bisect
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Event kinds in the data file
+START = 1
+INSTRUCTION = 2
+RETRANSMIT = 3
+REPLY = 4
+OUTCOME = 5
+KIND_NAMES = {START: "start", INSTRUCTION: "send", RETRANSMIT: "resend", REPLY: "reply", OUTCOME: "outcome"}
+
+OUTCOMES = ("ok", "failed", "cancelled", "interrupted")
+
+# Data file event: mission id, kind, timestamp, payload length, then the UTF-8 payload
+EVENT = struct.Struct("<IBdH")
+# Index entry, one per finished mission, in start order
+INDEX_ENTRY = struct.Struct("<IddQQB32s")
+DESTINATION_BYTES = 32
+
+
+class RecorderBusy(RuntimeError):
+    """Another process is already recording to the directory"""
+
+
+class MissionSummary:
+    """One index entry"""
+
+    __slots__ = ("id", "started_at", "ended_at", "offset", "end_offset", "outcome", "destination")
+
+    def __init__(self, id, started_at, ended_at, offset, end_offset, outcome, destination):
+        self.id = id
+        self.started_at = started_at
+        self.ended_at = ended_at
+        self.offset = offset
+        self.end_offset = end_offset
+        self.outcome = outcome
+        self.destination = destination
+
+    @classmethod
+    def unpack(cls, fields):
+        mission_id, started_at, ended_at, offset, end_offset, outcome, destination = fields
+        return cls(mission_id, started_at, ended_at, offset, end_offset, OUTCOMES[outcome],
+                   destination.rstrip(b"\0").decode("utf-8", errors="replace"))
+
+    def __repr__(self):
+        return (f"MissionSummary(id={self.id}, destination={self.destination!r}, "
+                f"outcome={self.outcome!r}, duration={self.ended_at - self.started_at:.1f}s)")
+
+
+class _IndexView:
+    """Sequence of raw index entries read straight from the memory map"""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def __len__(self):
+        return len(self.buffer) // INDEX_ENTRY.size
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return INDEX_ENTRY.unpack_from(self.buffer, i * INDEX_ENTRY.size)
+
+    def range(self, low, high):
+        """Entries ``low`` to ``high`` unpacked in one pass"""
+        return list(INDEX_ENTRY.iter_unpack(self.buffer[low * INDEX_ENTRY.size:high * INDEX_ENTRY.size]))
+
+
+def _lock_exclusive(f):
+    """Lock an open file for this process without waiting; OSError if it is taken"""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+
+
+def _start_time(entry):
+    return entry[1]
+
+
+def _encode_destination(destination):
+    data = destination.encode("utf-8")[:DESTINATION_BYTES]
+    return data.ljust(DESTINATION_BYTES, b"\0")
+
+
+class _NullRecord:
+    """Stands in for a MissionRecord when nothing is being recorded"""
+
+    def instruction(self, text):
+        pass
+
+    def retransmit(self, text):
+        pass
+
+    def reply(self, text):
+        pass
+
+    def finish(self, outcome):
+        pass
+
+
+NULL_RECORD = _NullRecord()
+
+
+class MissionRecord:
+    """Events of one mission being recorded; returned by MissionRecorder.begin"""
+
+    def __init__(self, recorder, mission_id, destination, offset, started_at):
+        self.recorder = recorder
+        self.id = mission_id
+        self.destination = destination
+        self.offset = offset
+        self.started_at = started_at
+        self.finished = False
+
+    def instruction(self, text):
+        self.recorder._write_event(self.id, INSTRUCTION, text)
+
+    def retransmit(self, text):
+        self.recorder._write_event(self.id, RETRANSMIT, text)
+
+    def reply(self, text):
+        self.recorder._write_event(self.id, REPLY, text)
+
+    def finish(self, outcome):
+        if not self.finished:
+            self.finished = True
+            self.recorder._finish(self, outcome)
+
+
+class MissionRecorder:
+    """Append-only binary log of every mission with a memory-mapped index
+
+    ``missions.dat`` holds fixed-header events (start, each instruction
+    sent, retransmissions, robot replies and the outcome) tagged with a
+    mission ID. ``missions.idx`` gets one fixed-size entry per finished
+    mission: ID, start and end time, data file offsets, outcome and
+    destination. One robot runs one mission at a time, so entries are in
+    start order and time ranges are found by binary search over the
+    memory-mapped index. Destination filters scan the fixed-size entries.
+    Neither needs to read the data file.
+
+    Only one process records to a directory at a time: the writer holds
+    an exclusive lock on ``missions.lock`` and a second one gets
+    RecorderBusy. Missions cut short by a crash are indexed as
+    ``interrupted`` when the next writer opens the directory. With
+    ``read_only`` the recorder only answers queries and never writes, so
+    it can be used while a GUI is recording.
+    """
+
+    def __init__(self, directory, read_only=False):
+        self.directory = directory
+        self.read_only = read_only
+        self.data_path = os.path.join(directory, "missions.dat")
+        self.index_path = os.path.join(directory, "missions.idx")
+        self._lock = threading.Lock()
+        self._map = None
+        self._mapped_size = 0
+        self._next_id = 1
+        self._data = self._index = self._lock_file = None
+        if read_only:
+            return
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = open(os.path.join(directory, "missions.lock"), "a+b")
+        try:
+            _lock_exclusive(self._lock_file)
+        except OSError:
+            self._lock_file.close()
+            raise RecorderBusy(f"{directory} is being recorded to by another process") from None
+        self._data = open(self.data_path, "ab")
+        self._index = open(self.index_path, "ab")
+        self._recover()
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            for f in (self._data, self._index, self._lock_file):
+                if f is not None:
+                    f.close()  # closing the lock file releases the lock
+
+    # Recording
+
+    def begin(self, destination):
+        """Start recording a mission; returns its MissionRecord"""
+        if self.read_only:
+            raise RuntimeError("Recorder was opened read-only")
+        with self._lock:
+            mission_id = self._next_id
+            self._next_id += 1
+            offset = self._data.tell()
+            started_at = self._append(mission_id, START, destination, time.time())
+        return MissionRecord(self, mission_id, destination, offset, started_at)
+
+    def _append(self, mission_id, kind, text, timestamp):
+        payload = text.encode("utf-8")[:0xFFFF]
+        self._data.write(EVENT.pack(mission_id, kind, timestamp, len(payload)) + payload)
+        return timestamp
+
+    def _write_event(self, mission_id, kind, text):
+        with self._lock:
+            self._append(mission_id, kind, text, time.time())
+
+    def _finish(self, record, outcome):
+        with self._lock:
+            ended_at = self._append(record.id, OUTCOME, outcome, time.time())
+            self._data.flush()
+            self._write_index(record.id, record.started_at, ended_at, record.offset,
+                              self._data.tell(), outcome, record.destination)
+
+    def _write_index(self, mission_id, started_at, ended_at, offset, end_offset, outcome, destination):
+        self._index.write(INDEX_ENTRY.pack(mission_id, started_at, ended_at, offset, end_offset,
+                                           OUTCOMES.index(outcome), _encode_destination(destination)))
+        self._index.flush()
+
+    def _recover(self):
+        """Find the next mission ID and index missions a crash left unfinished"""
+        index = self._index_view()
+        recent = index.range(max(0, len(index) - 100), len(index))
+        indexed = {entry[0] for entry in recent}
+        self._next_id = max(indexed, default=0) + 1
+        # Anything unfinished started after the oldest of the recent missions
+        scan_from = min((entry[3] for entry in recent), default=0)
+        open_missions = {}
+        for offset, mission_id, kind, timestamp, text in self._read_events(scan_from):
+            self._next_id = max(self._next_id, mission_id + 1)
+            if mission_id in indexed:
+                continue
+            if kind == START:
+                open_missions[mission_id] = [offset, timestamp, text, timestamp]
+            elif kind == OUTCOME:
+                open_missions.pop(mission_id, None)
+            elif mission_id in open_missions:
+                open_missions[mission_id][3] = timestamp
+        for mission_id, (offset, started_at, destination, ended_at) in sorted(open_missions.items()):
+            self._append(mission_id, OUTCOME, "interrupted", ended_at)
+            self._data.flush()
+            self._write_index(mission_id, started_at, ended_at, offset, self._data.tell(),
+                              "interrupted", destination)
+
+    def _read_events(self, offset=0, end=None):
+        """Yield (offset, mission id, kind, timestamp, text) from the data file"""
+        if not os.path.exists(self.data_path):
+            return
+        with open(self.data_path, "rb") as f:
+            f.seek(offset)
+            data = f.read() if end is None else f.read(end - offset)
+        position = 0
+        while position + EVENT.size <= len(data):
+            mission_id, kind, timestamp, length = EVENT.unpack_from(data, position)
+            start = position + EVENT.size
+            if start + length > len(data):
+                break  # torn write at the end of the file
+            yield offset + position, mission_id, kind, timestamp, data[start:start + length].decode(
+                "utf-8", errors="replace")
+            position = start + length
+
+    # Queries
+
+    def _index_view(self):
+        """The index file, memory-mapped again only when it has grown"""
+        size = os.path.getsize(self.index_path) if os.path.exists(self.index_path) else 0
+        size -= size % INDEX_ENTRY.size
+        if size == 0:
+            return _IndexView(b"")
+        if self._map is None or size != self._mapped_size:
+            if self._map is not None:
+                self._map.close()
+            with open(self.index_path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            self._mapped_size = size
+        return _IndexView(self._map)
+
+    def find(self, destination=None, since=None, until=None, outcome=None, limit=None):
+        """Index entries matching the filters, newest first"""
+        with self._lock:
+            index = self._index_view()
+            low = 0 if since is None else bisect.bisect_left(index, since, key=_start_time)
+            high = len(index) if until is None else bisect.bisect_right(index, until, key=_start_time)
+            entries = index.range(low, high)
+        wanted_destination = _encode_destination(destination) if destination is not None else None
+        wanted_outcome = OUTCOMES.index(outcome) if outcome is not None else None
+        results = []
+        for entry in reversed(entries):
+            if wanted_destination is not None and entry[6] != wanted_destination:
+                continue
+            if wanted_outcome is not None and entry[5] != wanted_outcome:
+                continue
+            results.append(MissionSummary.unpack(entry))
+            if limit and len(results) >= limit:
+                break
+        return results
+
+    def get(self, mission_id):
+        """The index entry for one mission, or None"""
+        with self._lock:
+            index = self._index_view()
+            # IDs grow with position, so search by ID as well
+            i = bisect.bisect_left(index, mission_id, key=lambda entry: entry[0])
+            candidates = [index[j] for j in range(max(0, i - 1), min(len(index), i + 2))]
+        for entry in candidates:
+            if entry[0] == mission_id:
+                return MissionSummary.unpack(entry)
+        return None
+
+    def events(self, mission_id):
+        """(timestamp, kind name, text) for every event of a finished mission"""
+        summary = self.get(mission_id)
+        if summary is None:
+            raise KeyError(f"No recorded mission {mission_id}")
+        return [(timestamp, KIND_NAMES.get(kind, str(kind)), text)
+                for _, event_id, kind, timestamp, text in self._read_events(summary.offset, summary.end_offset)
+                if event_id == mission_id]
+
+
+async def replay(recorder, mission_id, engine, speed=1.0, log=print):
+    """Re-send a recorded mission's instructions with their original spacing
+
+    ``speed`` above 1 compresses the gaps, e.g. 10 replays ten times
+    faster. Only the gaps between sends change: each instruction keeps
+    its recorded duration, so a robot still takes as long per step as it
+    did. The replay's timing is therefore not the robot's. Instructions
+    go out in the plain "cmd,duration" form, so any robot or simulator
+    accepts them.
+    """
+    events = [(t, text) for t, kind, text in recorder.events(mission_id) if kind == "send"]
+    previous = None
+    for timestamp, instruction in events:
+        if previous is not None:
+            await asyncio.sleep(max(0.0, timestamp - previous) / speed)
+        previous = timestamp
+        await asyncio.wrap_future(engine.send(instruction))
+        log(f"Replayed: {instruction}")
+    return len(events)
+
+
+def _format_time(timestamp):
+    return f"{datetime.fromtimestamp(timestamp):%Y-%m-%d %H:%M:%S}"
+
+
+def main(argv=None):
+    # Imported here so that recording does not pull in the I/O engine
+    from robot_engine import RobotEngine
+
+    parser = argparse.ArgumentParser(description="Inspect and replay recorded HMETV missions")
+    parser.add_argument("directory", help="recorder directory")
+    sub = parser.add_subparsers(dest="action", required=True)
+    find = sub.add_parser("list", help="list missions, newest first")
+    find.add_argument("--destination")
+    find.add_argument("--outcome", choices=OUTCOMES)
+    find.add_argument("--since", type=datetime.fromisoformat)
+    find.add_argument("--until", type=datetime.fromisoformat)
+    find.add_argument("--limit", type=int, default=50)
+    show = sub.add_parser("show", help="show every event of a mission")
+    show.add_argument("mission_id", type=int)
+    play = sub.add_parser("replay", help="re-send a mission to a robot or simulator")
+    play.add_argument("mission_id", type=int)
+    play.add_argument("--host", default="127.0.0.1")
+    play.add_argument("--port", type=int, default=5001)
+    play.add_argument("--speed", type=float, default=1.0, help="1 for real time, 10 for ten times faster")
+    args = parser.parse_args(argv)
+
+    recorder = MissionRecorder(args.directory, read_only=True)
+    try:
+        if args.action == "list":
+            started = time.perf_counter()
+            missions = recorder.find(args.destination,
+                                     since=args.since.timestamp() if args.since else None,
+                                     until=args.until.timestamp() if args.until else None,
+                                     outcome=args.outcome, limit=args.limit)
+            for m in missions:
+                print(f"#{m.id:<6} {_format_time(m.started_at)}  {m.ended_at - m.started_at:7.1f}s  "
+                      f"{m.outcome:<11} {m.destination}")
+            print(f"{len(missions)} mission(s) in {(time.perf_counter() - started) * 1000:.1f} ms",
+                  file=sys.stderr)
+        elif args.action == "show":
+            events = recorder.events(args.mission_id)
+            started = events[0][0] if events else 0
+            for timestamp, kind, text in events:
+                print(f"+{timestamp - started:8.3f}s  {kind:<8} {text}")
+        else:
+            engine = RobotEngine(args.host, args.port)
+            engine.start()
+            try:
+                count = engine.submit(replay(recorder, args.mission_id, engine, args.speed)).result()
+            finally:
+                engine.shutdown()
+            print(f"Replayed {count} instructions", file=sys.stderr)
+    except KeyError as e:
+        print(e.args[0], file=sys.stderr)
+        return 1
+    finally:
+        recorder.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
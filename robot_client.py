@@ -0,0 +1,401 @@
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+
+from config import load_config
+from discovery import confirm_on_terminal, remember_robot, resolve_robot
+from estop import EStopChannel
+from hospital_map import HospitalMap
+from metrics import REGISTRY
+from missions import MissionQueue, MissionState
+from recorder import MissionRecorder, RecorderBusy
+from robot_engine import RobotEngine
+from routes import RouteError, compile_destinations, format_instruction, get_compiled, parse_instruction
+from telemetry import TelemetryBuffer, TelemetryReceiver
+
+DEFAULT_HOST = "192.168.1.55"
+DEFAULT_PORT = 5001
+
+# Paths for each destination (pre-programmed sequences)
+DESTINATIONS = {
+    "ICU 1": [
+        "forward,2000",
+        "left,5000",
+        "forward,10000",
+        "done,0"
+    ],
+    "ICU 2": [
+        "forward,15000",
+        "right,5000",
+        "forward,10000",
+        "done,0"
+    ],
+    "Room 1": [
+        "forward,8000",
+        "left,5000",
+        "forward,12000",
+        "done,0"
+    ],
+    "Room 2": [
+        "forward,8000",
+        "right,5000",
+        "forward,12000",
+        "done,0"
+    ]
+}
+
+# Validated once at startup; every dispatch uses the compiled form
+COMPILED_ROUTES = compile_destinations(DESTINATIONS)
+
+# Hallway graph used to generate routes between any two locations. Without
+# it every trip uses the hand-written DESTINATIONS routes from the dock.
+MAP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hospital_map.json")
+
+
+def load_hospital_map(path=MAP_FILE):
+    """Load the hospital map, or return None if there is no map file"""
+    if path is None:
+        return None
+    try:
+        return HospitalMap.load(path)
+    except FileNotFoundError:
+        return None
+
+
+class RobotClient:
+    """Headless control API for one robot: send, route, stop and status
+
+    Owns the I/O engine, the e-stop channel and the robot's last known
+    position. It never imports tkinter, so scripts and tests can drive
+    robots directly; the GUIs are views over it. Callbacks are invoked
+    from background threads.
+
+    With ``reserved_estop`` off there is no dedicated stop socket and
+    worker thread; stops go over the command link instead. Fleets turn
+    it off and pass one shared ``hospital_map`` and engine ``loop``.
+    """
+
+    def __init__(self, host, port=DEFAULT_PORT, map_file=MAP_FILE, route_upload=True,
+                 log=None, on_state_change=None, on_estop=None, remember_file=None,
+                 telemetry_hz=0, telemetry_capacity=30000, recorder_dir=None,
+                 reserved_estop=True, hospital_map=None, **engine_options):
+        self.host = host
+        self.port = port
+        self.route_upload = route_upload
+        self.log = log or (lambda message: None)
+        self.on_state_change = on_state_change
+        self.on_estop = on_estop
+        # The address is cached here on every successful connect
+        self.remember_file = remember_file
+
+        # Every route is recorded here for later search and replay
+        self.recorder = None
+        writer = None
+        if recorder_dir:
+            try:
+                self.recorder = writer = MissionRecorder(recorder_dir)
+            except RecorderBusy as e:
+                # Another GUI or gateway records; this one can still query
+                self.log(f"Not recording missions: {e}")
+                self.recorder = MissionRecorder(recorder_dir, read_only=True)
+        self.engine = RobotEngine(host, port, on_state_change=self._state_changed,
+                                  recorder=writer, **engine_options)
+        self.estop_channel = None
+        if reserved_estop:
+            self.estop_channel = EStopChannel(host, port, shared_link=self.engine,
+                                              on_result=self._estop_result)
+        self.last_estop = None
+        self.hospital_map = hospital_map or load_hospital_map(map_file)
+        if self.hospital_map:
+            self.position = (self.hospital_map.start, self.hospital_map.start_heading)
+        else:
+            self.position = (None, None)
+        self.current_route = None
+
+        # Position, motor current and battery samples streamed by the robot
+        # Nothing is written to it without a receiver, so keep it tiny then
+        self.telemetry = TelemetryBuffer(telemetry_capacity if telemetry_hz else 1)
+        self.telemetry_receiver = None
+        if telemetry_hz:
+            self.telemetry_receiver = TelemetryReceiver(host, port, self.telemetry, telemetry_hz)
+
+    # Lifecycle
+
+    def start(self):
+        """Start background I/O; connecting happens asynchronously"""
+        self.engine.start()
+        if self.estop_channel is not None:
+            self.estop_channel.start()
+        if self.telemetry_receiver is not None:
+            # Parsed on the I/O thread; the GUI only reads the buffer
+            self.engine.submit(self.telemetry_receiver.run())
+        return self
+
+    def close(self):
+        """Stop background I/O and close every connection"""
+        if self.estop_channel is not None:
+            self.estop_channel.stop()
+        self.engine.shutdown()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def wait_connected(self, timeout=5.0):
+        """Block until the link is up; returns whether it is"""
+        deadline = time.monotonic() + timeout
+        while not self.engine.connected and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.engine.connected
+
+    # Queries
+
+    @property
+    def connected(self):
+        return self.engine.connected
+
+    @property
+    def location(self):
+        return self.position[0]
+
+    @property
+    def destinations(self):
+        if self.hospital_map:
+            return list(self.hospital_map.destinations)
+        return list(DESTINATIONS)
+
+    @property
+    def busy(self):
+        return self.current_route is not None and not self.current_route.done()
+
+    def status(self):
+        """Snapshot of the client state"""
+        result = self.last_estop
+        return {
+            "host": self.host,
+            "port": self.port,
+            "connected": self.connected,
+            "location": self.location,
+            "busy": self.busy,
+            "last_estop_ms": result.latency_ms if result and result.acknowledged else None,
+        }
+
+    def plan_route(self, destination):
+        """Return (compiled route, arrival heading) from the robot's position
+
+        Raises ValueError for unknown destinations.
+        """
+        if self.hospital_map:
+            if destination not in self.hospital_map.nodes:
+                raise ValueError(f"Unknown destination '{destination}'")
+            location, heading = self.position
+            return self.hospital_map.route(location, destination, heading)
+        if destination not in COMPILED_ROUTES:
+            raise ValueError(f"Unknown destination '{destination}'")
+        return COMPILED_ROUTES[destination], None
+
+    def travel_time(self, source, destination):
+        """Estimated drive time in ms between two locations"""
+        if self.hospital_map:
+            return self.hospital_map.travel_time(source, destination)
+        # Without a map every trip is the fixed route from the dock
+        return COMPILED_ROUTES[destination].total_duration
+
+    # Commands
+
+    def send(self, instruction):
+        """Validate and send one "cmd,duration" instruction; returns a Future"""
+        opcode, duration = parse_instruction(instruction)
+        return self.engine.send(format_instruction(opcode, duration))
+
+    def upload_route(self, instructions):
+        """Upload a route without waiting for it; the Future gives the route ID"""
+        return self.engine.upload_route(get_compiled(instructions).instructions)
+
+    def run_route(self, route, destination=None, upload=None, on_step=None):
+        """Run a route (compiled or "cmd,duration" list); returns a Future
+
+        ``upload`` overrides the client's route_upload setting, and
+        ``on_step`` is passed to RobotEngine.run_route.
+        """
+        if upload is None:
+            upload = self.route_upload
+        self.current_route = self.engine.run_route(route, upload=upload, log=self.log,
+                                                   destination=destination, on_step=on_step)
+        return self.current_route
+
+    def go_to(self, destination):
+        """Drive to a destination; the Future resolves to True on arrival"""
+        route, arrival_heading = self.plan_route(destination)
+        future = self.run_route(route, destination)
+
+        def arrived(future):
+            if not future.cancelled() and future.exception() is None and future.result():
+                self.position = (destination, arrival_heading)
+
+        future.add_done_callback(arrived)
+        return future
+
+    def cancel_routes(self):
+        """Cancel the running and waiting routes; returns how many there were"""
+        return self.engine.cancel_routes()
+
+    def stop(self):
+        """Emergency stop: fire the stop channel and cancel any running route
+
+        Without a reserved channel, returns the Future of the EStopResult.
+        """
+        # Routes are cancelled first so that no step can follow the stop
+        self.engine.cancel_routes()
+        if self.estop_channel is not None:
+            self.estop_channel.trigger()
+            return None
+        future = self.engine.emergency_stop()
+        future.add_done_callback(self._estop_done)
+        return future
+
+    def _state_changed(self, connected):
+        if connected and self.remember_file:
+            try:
+                remember_robot(self.remember_file, self.host, self.port)
+            except OSError:
+                pass
+        if self.on_state_change:
+            self.on_state_change(connected)
+
+    def _estop_done(self, future):
+        if not future.cancelled() and future.exception() is None:
+            self._estop_result(future.result())
+
+    def _estop_result(self, result):
+        self.last_estop = result
+        if self.on_estop:
+            self.on_estop(result)
+
+
+def client_from_config(config, confirm=None, **options):
+    """RobotClient for the configured robot, else the last known one, else one found on the subnet
+
+    Falls back to DEFAULT_HOST when nothing answers. ``confirm`` decides
+    whether to use a server that did not answer the handshake (see
+    ``discovery.locate``). Successful connects update the cached address.
+    """
+    host, port = resolve_robot(config, options.get("log"), confirm) or (DEFAULT_HOST, config["port"])
+    options.setdefault("route_upload", config["route_upload"])
+    options.setdefault("sequenced", config["sequenced"])
+    options.setdefault("telemetry_hz", config["telemetry_hz"])
+    options.setdefault("recorder_dir", config["recorder_dir"])
+    return RobotClient(host, port, remember_file=config["last_robot_file"], **options)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Command-line control for the HMETV robot")
+    parser.add_argument("--host", help="robot address (default: configured, last known or discovered)")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds to wait for completion")
+    parser.add_argument("--stream", action="store_true", help="stream routes step by step instead of uploading")
+    parser.add_argument("--legacy", action="store_true",
+                        help="use the legacy protocol instead of sequenced, acknowledged steps")
+    parser.add_argument("--map", default=MAP_FILE, help="hospital map file")
+    parser.add_argument("--metrics", help="write metrics here on exit (.json or Prometheus text)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    send = sub.add_parser("send", help="send one instruction, e.g. forward,2000")
+    send.add_argument("instruction")
+    go = sub.add_parser("go", help="drive to a destination")
+    go.add_argument("destination")
+    tour = sub.add_parser("tour", help="deliver to several destinations in the fastest order")
+    tour.add_argument("destinations", nargs="+")
+    route = sub.add_parser("route", help="run a route given as cmd,duration steps")
+    route.add_argument("steps", nargs="+")
+    sub.add_parser("stop", help="emergency stop")
+    sub.add_parser("status", help="check the connection")
+    sub.add_parser("destinations", help="list destinations")
+    args = parser.parse_args(argv)
+
+    if args.command == "destinations":
+        print("\n".join(RobotClient(None, map_file=args.map).destinations))
+        return 0
+
+    config = load_config()
+    config["host"] = args.host or config["host"]
+    config["port"] = args.port or config["port"]
+    options = {"map_file": args.map, "log": print}
+    if args.stream:
+        options["route_upload"] = False
+    if args.legacy:
+        options["sequenced"] = False
+    client = client_from_config(config, confirm=confirm_on_terminal, **options)
+
+    try:
+        return _run_command(client, args)
+    finally:
+        if args.metrics:
+            REGISTRY.write(args.metrics)
+
+
+def _run_command(client, args):
+    results = []
+    client.on_estop = results.append
+    with client:
+        if not client.wait_connected(timeout=min(args.timeout, 5.0)) and args.command != "stop":
+            print(f"Cannot connect to {client.host}:{client.port}", file=sys.stderr)
+            return 1
+        try:
+            if args.command == "send":
+                client.send(args.instruction).result(args.timeout)
+                print(f"Sent: {args.instruction}")
+            elif args.command == "go":
+                if not client.go_to(args.destination).result(args.timeout):
+                    return 1
+                print(f"Arrived at {args.destination}")
+            elif args.command == "tour":
+                if not _run_tour(client, args.destinations, args.timeout):
+                    return 1
+            elif args.command == "route":
+                if not client.run_route(args.steps).result(args.timeout):
+                    return 1
+            elif args.command == "stop":
+                client.stop()
+                deadline = time.monotonic() + client.estop_channel.retry_window + 1
+                while not results and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                if not results or not results[0].acknowledged:
+                    print("Emergency stop NOT acknowledged", file=sys.stderr)
+                    return 1
+                print(f"Emergency stop acknowledged in {results[0].latency_ms:.1f} ms")
+            elif args.command == "status":
+                for key, value in client.status().items():
+                    print(f"{key}: {value}")
+        except (RouteError, ValueError, OSError, concurrent.futures.TimeoutError) as e:
+            print(e, file=sys.stderr)
+            return 1
+    return 0
+
+
+def _run_tour(client, destinations, timeout):
+    finished = []
+
+    def on_mission(mission):
+        if mission.state in (MissionState.DONE, MissionState.FAILED):
+            finished.append(mission)
+
+    missions = MissionQueue(client, on_mission=on_mission)
+    for destination in destinations:
+        missions.submit(destination)
+    print("Tour: " + " -> ".join(dict.fromkeys(m.destination for m in missions.missions())))
+    deadline = time.monotonic() + timeout
+    while len(finished) < len(destinations) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    for mission in finished:
+        print(f"{mission.destination}: {mission.state.value}")
+    return len(finished) == len(destinations) and all(m.state == MissionState.DONE for m in finished)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,708 @@
+import asyncio
+import collections
+import concurrent.futures
+import socket
+import threading
+import time
+
+from estop import ESTOP_ACK, ESTOP_INSTRUCTION, EStopResult
+from metrics import REGISTRY, RollingHistogram
+from recorder import NULL_RECORD
+from robot_link import (RouteRejected, encode_route, enable_keepalive, frame_message, new_route_id,
+                        new_session_id)
+from routes import Opcode, get_compiled
+
+
+def link_grade(rtt_p95_ms, loss):
+    """Classify link quality from heartbeat RTT and loss"""
+    if rtt_p95_ms is None:
+        return "unknown"
+    if rtt_p95_ms <= 50 and loss <= 0.01:
+        return "good"
+    if rtt_p95_ms <= 150 and loss <= 0.05:
+        return "fair"
+    return "poor"
+
+
+class _Step:
+    """A sequenced instruction waiting for the robot's acc and fin replies"""
+
+    __slots__ = ("seq", "instruction", "duration", "record", "accepted", "finished", "error")
+
+    def __init__(self, seq, instruction, duration, record, loop):
+        self.seq = seq
+        self.instruction = instruction
+        self.duration = duration
+        self.record = record
+        self.accepted = loop.create_future()
+        self.finished = loop.create_future()
+        self.error = None
+
+
+class RouteQueueFull(RuntimeError):
+    """Too many routes are already running or waiting to run"""
+
+
+class RobotEngine:
+    """Single asyncio event loop, on one background thread, that owns all robot I/O
+
+    Connection state is only touched on the engine's loop. Other threads
+    talk to it through the thread-safe methods below, which return
+    ``concurrent.futures.Future`` objects, and learn about link changes
+    through ``on_state_change`` (called on the engine thread).
+
+    While connected, the engine sends ``ping,<seq>`` every
+    ``heartbeat_interval`` seconds and times the ``pong,<seq>`` replies.
+    Once the robot has answered a ping, ``heartbeat_misses`` unanswered
+    pings in a row mark the link as dead. A robot that lets its first
+    pings go unanswered, or closes the link on them as the legacy Pi
+    server does, is not pinged again, even after reconnecting, and is
+    left to the slower ``check_interval`` supervision. A summary of
+    RTT percentiles and loss is passed to ``on_link_quality`` every
+    ``quality_interval`` seconds.
+
+    Routes are sent as sequenced steps, ``seq,<session>,<n>,<cmd>,<duration>``.
+    The robot answers ``acc,<session>,<n>`` when it queues a step,
+    ``fin,<session>,<n>`` when the step is done and
+    ``err,<session>,<n>,<reason>`` when the step is refused or aborted.
+    ``session`` is random per engine, so step numbers from another client,
+    or from an earlier run of this one, are never taken for repeats. Up to ``window`` steps are in flight at once. A step that
+    is not accepted within ``step_ack_timeout`` is sent again, up to
+    ``max_retransmits`` times. The robot ignores repeated sequence numbers
+    apart from repeating its replies. A route is done when its last step
+    finishes. Robots that never accept a sequenced step get route uploads
+    or plain ``cmd,duration`` streaming instead.
+
+    Routes run one at a time in submission order; at most ``max_routes``
+    may be running or waiting, after which ``run_route`` raises
+    RouteQueueFull. ``cancel_routes`` stops every route from sending
+    another step as soon as it is called, without waiting for the loop.
+
+    Passing ``loop`` (an event loop already running on another thread)
+    makes the engine a guest on that loop instead of starting its own
+    thread, so a fleet of robots can share one I/O thread.
+
+    Connects, sends, routes and heartbeats are counted and timed in
+    ``metrics`` (the process-wide registry by default), labelled with the
+    robot's host. When ``recorder`` is set (a MissionRecorder), every
+    route's instructions, robot replies and outcome are recorded.
+    """
+
+    def __init__(self, host, port, connect_timeout=1.0, send_timeout=2.0,
+                 min_backoff=0.5, max_backoff=10.0, check_interval=2.0,
+                 heartbeat=True, heartbeat_interval=0.2, heartbeat_timeout=0.6,
+                 heartbeat_misses=2, quality_interval=1.0,
+                 sequenced=True, window=4, step_ack_timeout=0.5, max_retransmits=2, step_margin=5.0,
+                 max_routes=4, on_state_change=None, on_link_quality=None, metrics=REGISTRY, recorder=None,
+                 loop=None):
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.send_timeout = send_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.check_interval = check_interval
+        self.heartbeat = heartbeat
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.heartbeat_misses = heartbeat_misses
+        self.quality_interval = quality_interval
+        self.sequenced = sequenced
+        self.window = window
+        self.step_ack_timeout = step_ack_timeout
+        self.max_retransmits = max_retransmits
+        self.step_margin = step_margin
+        self.max_routes = max_routes
+        self.on_state_change = on_state_change
+        self.on_link_quality = on_link_quality
+        self.metrics = metrics
+        self.recorder = recorder
+
+        self.connected = False
+        self.loop = loop or asyncio.new_event_loop()
+        self._thread = None if loop else threading.Thread(target=self._run_loop, name="robot-io", daemon=True)
+        self._tasks = set()
+        self._running = False
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._connect_lock = None
+        self._waiters = []
+        self._routes = set()
+        self._routes_lock = threading.Lock()
+        self._route_lock = None
+        # Bumped by cancel_routes; a route may only send while its epoch is current
+        self._route_epoch = 0
+        self._active_epoch = 0
+        self._backoff = 0.0
+        self._next_attempt = 0.0
+        self._link_lost = None
+
+        self.rtt = RollingHistogram()
+        self._heartbeat_results = collections.deque(maxlen=100)
+        self._pings = {}
+        self._missed_pings = 0
+        # None until a ping is answered or missed; kept across reconnects
+        self._heartbeat_capable = None
+
+        self.session = new_session_id()
+        self._seq = 0
+        self._steps = {}
+        # None until a sequenced step is sent; then whether the robot answered
+        self._sequenced_capable = None
+        # Likewise for route uploads; False once an upload goes unacknowledged
+        self._upload_capable = None
+
+    # Thread-safe API
+
+    def start(self):
+        """Start the I/O thread; the first connection attempt happens there"""
+        self._running = True
+        if self._thread is None:
+            self.loop.call_soon_threadsafe(self._start_tasks)
+        else:
+            self._thread.start()
+
+    def submit(self, coro):
+        """Run a coroutine on the engine loop and return a concurrent Future"""
+        return asyncio.run_coroutine_threadsafe(self._tracked(coro), self.loop)
+
+    def emergency_stop(self, ack_timeout=0.25, retry_window=5.0):
+        """Cancel every route and send an emergency stop over the command link
+
+        The Future resolves to an EStopResult. Used where a dedicated
+        EStopChannel per robot would cost too much, such as fleets.
+        """
+        pressed_at = time.perf_counter()
+        self.cancel_routes()
+        return self.submit(self._emergency_stop(pressed_at, ack_timeout, retry_window))
+
+    def send(self, instruction):
+        """Send one instruction; the Future resolves to True once written"""
+        return self.submit(self._send(instruction))
+
+    def upload_route(self, instructions, route_id=None, ack_timeout=2.0):
+        """Upload a whole route; the Future resolves to the acknowledged route ID"""
+        return self.submit(self._upload_route(instructions, route_id, ack_timeout))
+
+    def run_route(self, route, upload=True, log=None, destination=None, on_step=None):
+        """Execute a route; the Future resolves to True on success
+
+        ``route`` is a CompiledRoute or a list of "cmd,duration" strings.
+        ``destination`` names the mission in the recorder (default: the
+        route name). ``on_step`` is called on the I/O thread with
+        (instruction, latency_ms) as the robot accepts each step, or as each
+        step is written to robots without sequenced steps. Cancelling the
+        returned Future stops the route before its next step.
+        """
+        route = get_compiled(route)
+        with self._routes_lock:
+            if len(self._routes) >= self.max_routes:
+                raise RouteQueueFull(f"{len(self._routes)} routes are already running or queued")
+            future = self.submit(self._run_route(route, upload, log or (lambda message: None),
+                                                 destination or route.name or "route", on_step,
+                                                 self._route_epoch))
+            self._routes.add(future)
+        future.add_done_callback(self._route_done)
+        return future
+
+    def cancel_routes(self):
+        """Cancel every running and queued route; none of them sends another step"""
+        with self._routes_lock:
+            self._route_epoch += 1
+            routes = list(self._routes)
+        for future in routes:
+            future.cancel()
+        return len(routes)
+
+    def request(self, message, match, timeout=2.0, lock_timeout=None):
+        """Blocking request/reply helper with the same contract as RobotConnection.request
+
+        Replies are dispatched to waiters as they arrive, so a request never
+        queues behind another one and ``lock_timeout`` is not needed.
+        Raises the builtin TimeoutError (an OSError) when no reply arrives;
+        before Python 3.11 the asyncio and futures timeouts are not.
+        """
+        future = self.submit(self._request(message, match, timeout))
+        try:
+            return future.result(timeout + self.connect_timeout + 1)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"No reply to {message!r}") from None
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"No reply to {message!r}") from None
+
+    def shutdown(self, timeout=2.0):
+        """Cancel outstanding work, close the link and stop the I/O thread"""
+        if not self._running:
+            return
+        self._running = False
+        self.cancel_routes()
+        try:
+            self.submit(self._close()).result(timeout)
+        finally:
+            if self._thread is not None:
+                self.loop.call_soon_threadsafe(self.loop.stop)
+                self._thread.join(timeout)
+
+    # Engine loop
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self._start_tasks()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def _start_tasks(self):
+        self._connect_lock = asyncio.Lock()
+        self._route_lock = asyncio.Lock()
+        self._link_lost = asyncio.Event()
+        self._spawn(self._supervise())
+        if self.on_link_quality:
+            self._spawn(self._report_quality())
+
+    def _spawn(self, coro):
+        """Start a task that shutdown will cancel"""
+        task = self.loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _tracked(self, coro):
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            return await coro
+        finally:
+            self._tasks.discard(task)
+
+    async def _supervise(self):
+        """Keep the link warm, reconnecting with backoff when it drops"""
+        while True:
+            await self._connect(force=False)
+            # Wake early when the link is lost so reconnecting starts at once
+            try:
+                await asyncio.wait_for(self._link_lost.wait(), self.check_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._link_lost.clear()
+
+    def link_quality(self):
+        """RTT percentiles (ms), heartbeat loss and a quality grade"""
+        rtt = self.rtt.summary()
+        results = self._heartbeat_results
+        loss = results.count(False) / len(results) if results else 0.0
+        return {
+            "connected": self.connected,
+            "rtt_ms": rtt,
+            "loss": loss,
+            "grade": link_grade(rtt.get("p95"), loss) if self.connected else "down",
+        }
+
+    async def _report_quality(self):
+        while True:
+            await asyncio.sleep(self.quality_interval)
+            if self.on_link_quality:
+                self.on_link_quality(self.link_quality())
+
+    async def _heartbeat(self, writer):
+        """Ping over the live link, timing replies and failing fast on silence"""
+        seq = 0
+        while True:
+            # Let whatever opened the link write first
+            await asyncio.sleep(self.heartbeat_interval)
+            if writer is not self._writer or writer.is_closing():
+                return
+
+            now = time.perf_counter()
+            for ping, sent_at in list(self._pings.items()):
+                if now - sent_at > self.heartbeat_timeout:
+                    del self._pings[ping]
+                    self._missed_pings += 1
+                    if self._heartbeat_capable:
+                        self._heartbeat_results.append(False)
+                        self.metrics.counter("robot_heartbeat_misses_total", robot=self.host).inc()
+            if self._missed_pings >= self.heartbeat_misses:
+                if not self._heartbeat_capable:
+                    # This robot does not answer pings; stop sending them
+                    self._heartbeat_capable = False
+                    return
+                self._drop()
+                return
+
+            seq += 1
+            self._pings[seq] = now
+            writer.write(frame_message(f"ping,{seq}"))
+
+    def _on_pong(self, seq):
+        sent_at = self._pings.pop(seq, None)
+        if sent_at is None:
+            return
+        rtt_ms = (time.perf_counter() - sent_at) * 1000
+        self.rtt.add(rtt_ms)
+        self.metrics.summary("robot_rtt_ms", "Heartbeat round-trip time", robot=self.host).observe(rtt_ms)
+        self._heartbeat_results.append(True)
+        self._heartbeat_capable = True
+        self._missed_pings = 0
+
+    def _set_connected(self, connected):
+        if connected != self.connected:
+            self.connected = connected
+            self.metrics.gauge("robot_connected", robot=self.host).set(int(connected))
+            if not connected:
+                self.metrics.counter("robot_disconnects_total", robot=self.host).inc()
+            if self.on_state_change:
+                self.on_state_change(connected)
+
+    def _link_up(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    def _drop(self):
+        if self._writer is not None:
+            self._writer.close()
+            if self._link_lost is not None:
+                self._link_lost.set()
+        self._reader = self._writer = None
+        self._set_connected(False)
+
+    async def _connect(self, force=False):
+        """Make sure the link is up; returns True when it is"""
+        async with self._connect_lock:
+            if self._link_up():
+                return True
+            self._drop()
+
+            now = time.monotonic()
+            if not force and now < self._next_attempt:
+                return False
+            self.metrics.counter("robot_connect_attempts_total", robot=self.host).inc()
+            try:
+                with self.metrics.time("robot_connect_ms", "TCP connect time", robot=self.host):
+                    reader, writer = await asyncio.wait_for(
+                        asyncio.open_connection(self.host, self.port), self.connect_timeout)
+            except (OSError, asyncio.TimeoutError):
+                self.metrics.counter("robot_connect_failures_total", robot=self.host).inc()
+                self._backoff = min(self.max_backoff, self._backoff * 2 or self.min_backoff)
+                self._next_attempt = now + self._backoff
+                return False
+
+            sock = writer.get_extra_info("socket")
+            if sock is not None:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                enable_keepalive(sock)
+            self._reader, self._writer = reader, writer
+            self._reader_task = self._spawn(self._read_replies(reader, writer))
+            # Ping support is a property of the robot, so it survives reconnects
+            self._pings.clear()
+            self._missed_pings = 0
+            if self.heartbeat and self._heartbeat_capable is not False:
+                self._spawn(self._heartbeat(writer))
+            self._backoff = 0.0
+            self._next_attempt = 0.0
+            self._set_connected(True)
+            return True
+
+    async def _read_replies(self, reader, writer):
+        """Hand each reply line to the first waiter that accepts it"""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self._dispatch(line.decode('utf-8', errors='replace').strip())
+        except OSError:
+            pass
+        # EOF or error: the robot end is gone, so is this link
+        if writer is self._writer:
+            if self._pings and self._heartbeat_capable is None:
+                # Closed on an unanswered ping, as the legacy Pi server does
+                self._heartbeat_capable = False
+            self._drop()
+
+    def _dispatch(self, line):
+        if line.startswith("pong,"):
+            seq = line[len("pong,"):]
+            if seq.isdigit():
+                self._on_pong(int(seq))
+            return
+        kind = line[:4]
+        if kind in ("acc,", "fin,", "err,"):
+            self._on_step_reply(kind[:3], line[4:])
+            return
+        for match, future in list(self._waiters):
+            if future.done():
+                continue
+            try:
+                result = match(line)
+            except Exception as e:
+                future.set_exception(e)
+                return
+            if result is not None:
+                future.set_result(result)
+                return
+
+    def _on_step_reply(self, kind, rest):
+        session, _, rest = rest.partition(",")
+        if session != self.session:
+            return
+        seq, _, reason = rest.partition(",")
+        step = self._steps.get(int(seq)) if seq.isdigit() else None
+        if step is None:
+            return
+        step.record.reply(f"{kind},{session},{rest}")
+        if kind == "err":
+            step.error = reason or "failed"
+        if not step.accepted.done():
+            step.accepted.set_result(True)
+        if kind != "acc" and not step.finished.done():
+            step.finished.set_result(True)
+
+    async def _send(self, instruction):
+        """Write one instruction, replacing a stale link once before giving up"""
+        self.metrics.counter("robot_sends_total", robot=self.host).inc()
+        try:
+            with self.metrics.time("robot_send_ms", "Time to write one message", robot=self.host):
+                return await self._write(instruction)
+        except (OSError, asyncio.TimeoutError):
+            self.metrics.counter("robot_send_failures_total", robot=self.host).inc()
+            raise
+
+    async def _write(self, instruction):
+        payload = frame_message(instruction)
+        last_error = None
+        for _ in range(2):
+            if not await self._connect(force=True):
+                raise ConnectionError(f"Cannot connect to {self.host}:{self.port}")
+            writer = self._writer
+            try:
+                writer.write(payload)
+                await asyncio.wait_for(writer.drain(), self.send_timeout)
+                return True
+            except (OSError, asyncio.TimeoutError) as e:
+                last_error = e
+                if writer is self._writer:
+                    self._drop()
+        raise last_error
+
+    async def _request(self, message, match, timeout):
+        waiter = (match, self.loop.create_future())
+        self._waiters.append(waiter)
+        try:
+            await self._send(message)
+            return await asyncio.wait_for(waiter[1], timeout)
+        finally:
+            self._waiters.remove(waiter)
+
+    async def _emergency_stop(self, pressed_at, ack_timeout, retry_window):
+        """Send the stop until the robot acknowledges it or ``retry_window`` runs out"""
+        deadline = pressed_at + retry_window
+        attempts = 0
+        result = None
+        while result is None and time.perf_counter() < deadline:
+            attempts += 1
+            try:
+                await self._request(ESTOP_INSTRUCTION, lambda reply: True if reply == ESTOP_ACK else None,
+                                    ack_timeout)
+                result = EStopResult(True, "link", (time.perf_counter() - pressed_at) * 1000, attempts)
+            except asyncio.TimeoutError:
+                pass
+            except OSError:
+                # Avoid spinning while the robot is unreachable
+                await asyncio.sleep(0.01)
+        if result is None:
+            result = EStopResult(False, None, (time.perf_counter() - pressed_at) * 1000, attempts)
+        else:
+            self.metrics.summary("estop_latency_ms", "Button press to robot acknowledgement",
+                                 robot=self.host, transport="link").observe(result.latency_ms)
+        self.metrics.counter("estop_total", robot=self.host,
+                             result="acked" if result.acknowledged else "unacked").inc()
+        return result
+
+    async def _upload_route(self, instructions, route_id=None, ack_timeout=2.0):
+        route_id = route_id or new_route_id()
+
+        def match(reply):
+            kind, _, rest = reply.partition(",")
+            reply_id, _, reason = rest.partition(",")
+            if reply_id != route_id:
+                return None
+            if kind == "ack":
+                return route_id
+            if kind == "nak":
+                raise RouteRejected(reason or f"Route {route_id} rejected")
+            return None
+
+        return await self._request(encode_route(route_id, instructions), match, ack_timeout)
+
+    def _route_done(self, future):
+        with self._routes_lock:
+            self._routes.discard(future)
+
+    def _check_cancelled(self):
+        """Raise CancelledError if cancel_routes was called since the running route was submitted"""
+        if self._active_epoch != self._route_epoch:
+            raise asyncio.CancelledError()
+
+    async def _run_route(self, route, upload, log, destination, on_step=None, epoch=0):
+        """Wait for earlier routes, then time and record this one and count its outcome"""
+        async with self._route_lock:
+            self._active_epoch = epoch
+            self._check_cancelled()
+            outcome = "failed"
+            record = self.recorder.begin(destination) if self.recorder else NULL_RECORD
+            try:
+                with self.metrics.time("robot_route_ms", "Route execution time", robot=self.host):
+                    ok = await self._execute_route(route, upload, log, record, on_step)
+                outcome = "ok" if ok else "failed"
+                return ok
+            except asyncio.CancelledError:
+                outcome = "cancelled"
+                raise
+            finally:
+                self.metrics.counter("robot_routes_total", robot=self.host, result=outcome).inc()
+                record.finish(outcome)
+
+    async def _execute_route(self, route, upload, log, record=NULL_RECORD, on_step=None):
+        """Run a route as sequenced steps, falling back to an upload or streaming it"""
+        if self.sequenced and self._sequenced_capable is not False:
+            try:
+                result = await self._run_sequenced(route, log, record, on_step)
+            except (OSError, asyncio.TimeoutError) as e:
+                log(f"Failed to send: {e}")
+                return False
+            if result is not None:
+                return result
+            self._sequenced_capable = False
+            log("Robot does not acknowledge sequenced steps, using the legacy protocol")
+
+        if upload and self._upload_capable is not False:
+            try:
+                self._check_cancelled()
+                for instruction in route.instructions:
+                    record.instruction(instruction)
+                route_id = await self._upload_route(route.instructions)
+                record.reply(f"ack,{route_id}")
+                self._upload_capable = True
+                log(f"Uploaded route {route_id} ({len(route)} steps)")
+                return True
+            except RouteRejected as e:
+                log(f"Route rejected: {e}")
+                return False
+            except asyncio.TimeoutError:
+                # The upload may have arrived and only the ack been lost, so
+                # streaming the steps now could run the route twice
+                if self._upload_capable is None:
+                    self._upload_capable = False
+                    log("Route upload not acknowledged; later routes will be streamed step by step")
+                else:
+                    log("Route upload not acknowledged; check the robot before resending")
+                return False
+            except OSError as e:
+                log(f"Failed to upload route: {e}")
+                return False
+
+        for opcode, duration, instruction in route:
+            try:
+                self._check_cancelled()
+                record.instruction(instruction)
+                started = time.perf_counter()
+                await self._send(instruction)
+            except (OSError, asyncio.TimeoutError) as e:
+                log(f"Failed to send: {e}")
+                return False
+            if on_step is not None:
+                on_step(instruction, (time.perf_counter() - started) * 1000)
+            log(f"Sent: {instruction}")
+
+            if opcode != Opcode.DONE and duration:
+                # Wait for a fraction of the actual duration to simulate movement
+                await asyncio.sleep(duration / 5000)
+        return True
+
+    async def _run_sequenced(self, route, log, record=NULL_RECORD, on_step=None):
+        """Send numbered steps with up to ``window`` in flight; wait for the last to finish
+
+        Returns None when the robot does not speak the sequenced protocol.
+        """
+        steps = []
+        try:
+            for opcode, duration, instruction in route:
+                if len(steps) >= self.window and not await self._step_finished(steps[-self.window], log):
+                    return False
+                self._seq += 1
+                step = self._steps[self._seq] = _Step(self._seq, instruction, duration, record, self.loop)
+                steps.append(step)
+                started = time.perf_counter()
+                if not await self._send_step(step):
+                    if self._sequenced_capable is None:
+                        return None
+                    log(f"Step {instruction} not acknowledged by the robot")
+                    return False
+                self._sequenced_capable = True
+                latency_ms = (time.perf_counter() - started) * 1000
+                self.metrics.summary("robot_step_ack_ms", "Time from sending a step to its acceptance",
+                                     robot=self.host).observe(latency_ms)
+                if on_step is not None:
+                    on_step(instruction, latency_ms)
+                if step.error is not None:
+                    log(f"Step {instruction} refused: {step.error}")
+                    return False
+                log(f"Sent: {instruction}")
+
+            for step in steps[-self.window:]:
+                if not await self._step_finished(step, log):
+                    return False
+            return True
+        finally:
+            for step in steps:
+                self._steps.pop(step.seq, None)
+
+    async def _send_step(self, step):
+        """Send a step until the robot accepts it; returns whether it did"""
+        for attempt in range(self.max_retransmits + 1):
+            self._check_cancelled()
+            if attempt:
+                self.metrics.counter("robot_step_retransmits_total", robot=self.host).inc()
+                step.record.retransmit(step.instruction)
+            else:
+                step.record.instruction(step.instruction)
+            await self._send(f"seq,{self.session},{step.seq},{step.instruction}")
+            try:
+                await asyncio.wait_for(asyncio.shield(step.accepted), self.step_ack_timeout)
+                return True
+            except asyncio.TimeoutError:
+                pass
+        return False
+
+    async def _step_finished(self, step, log):
+        """Wait for a step's fin; returns whether it completed successfully"""
+        try:
+            await asyncio.wait_for(asyncio.shield(step.finished), step.duration / 1000 + self.step_margin)
+        except asyncio.TimeoutError:
+            # The fin may have gone down with a dropped link; resending the
+            # step makes the robot repeat its replies without re-running it
+            if not await self._send_step(step):
+                log(f"Lost contact while running {step.instruction}")
+                return False
+            try:
+                await asyncio.wait_for(asyncio.shield(step.finished), self.step_ack_timeout)
+            except asyncio.TimeoutError:
+                log(f"Step {step.instruction} did not finish in time")
+                return False
+        if step.error is not None:
+            self.metrics.counter("robot_step_failures_total", robot=self.host).inc()
+            log(f"Step {step.instruction} failed: {step.error}")
+            return False
+        return True
+
+    async def _close(self):
+        # Nobody is listening any more, and the owner may be blocked on us
+        self.on_state_change = None
+        # Only this engine's tasks; the loop may be shared with other robots
+        tasks = [task for task in self._tasks if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._drop()
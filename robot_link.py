@@ -0,0 +1,240 @@
+import select
+import socket
+import threading
+import time
+import uuid
+
+# Every message on the link is terminated with a newline so several
+# instructions can share one TCP stream
+MESSAGE_TERMINATOR = "\n"
+
+# Steps of an uploaded route keep their "cmd,duration" form and are joined
+# with this separator into a single "route,<id>,<steps>" message
+ROUTE_STEP_SEPARATOR = ";"
+
+
+class RouteRejected(Exception):
+    """The robot refused an uploaded route"""
+
+
+def frame_message(message):
+    """Encode a single message for the wire"""
+    return (message.strip() + MESSAGE_TERMINATOR).encode('utf-8')
+
+
+def new_route_id():
+    """Generate a short identifier for an uploaded route"""
+    return uuid.uuid4().hex[:8]
+
+
+def new_session_id():
+    """Generate an identifier that keeps one client's step numbers apart from another's"""
+    return uuid.uuid4().hex[:8]
+
+
+def encode_route(route_id, instructions):
+    """Pack a whole route into one route upload message"""
+    steps = ROUTE_STEP_SEPARATOR.join(instruction.strip() for instruction in instructions)
+    return f"route,{route_id},{steps}"
+
+
+def enable_keepalive(sock, idle=5, interval=2, count=3):
+    """Turn on TCP keepalive so dead peers are noticed without traffic"""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # The fine-grained knobs are not available on every platform
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+    elif hasattr(socket, "TCP_KEEPALIVE"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, idle)
+    if hasattr(socket, "TCP_KEEPINTVL"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval)
+    if hasattr(socket, "TCP_KEEPCNT"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, count)
+
+
+class RobotConnection:
+    """Long-lived, thread-safe TCP connection to the onboard robot server"""
+
+    def __init__(self, host, port, connect_timeout=1.0, send_timeout=2.0,
+                 min_backoff=0.5, max_backoff=10.0, on_state_change=None):
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.send_timeout = send_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.on_state_change = on_state_change
+
+        self.connected = False
+        self._sock = None
+        self._rx_buffer = b""
+        self._lock = threading.RLock()
+        self._backoff = 0.0
+        self._next_attempt = 0.0
+
+    def _open_socket(self):
+        """Open and tune a fresh socket to the robot"""
+        sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+        # Instructions are tiny, never wait to coalesce them
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        enable_keepalive(sock)
+        sock.settimeout(self.send_timeout)
+        return sock
+
+    def _socket_alive(self):
+        """Detect a half-open or closed socket without blocking"""
+        sock = self._sock
+        if sock is None:
+            return False
+        try:
+            readable, _, errored = select.select([sock], [], [sock], 0)
+            if errored:
+                return False
+            if readable:
+                # Readable with no data means the robot closed its end
+                return sock.recv(1, socket.MSG_PEEK) != b""
+        except (OSError, ValueError):
+            return False
+        return True
+
+    def _set_connected(self, connected):
+        if connected != self.connected:
+            self.connected = connected
+            if self.on_state_change:
+                self.on_state_change(connected)
+
+    def _drop(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+        self._rx_buffer = b""
+
+    def connect(self, force=False):
+        """Make sure the link is up, reconnecting with exponential backoff
+
+        Returns True when a usable socket is available. Unless ``force`` is
+        set, reconnect attempts are skipped while the backoff window is open.
+        """
+        with self._lock:
+            if self._socket_alive():
+                self._set_connected(True)
+                return True
+            self._drop()
+
+            now = time.monotonic()
+            if not force and now < self._next_attempt:
+                self._set_connected(False)
+                return False
+
+            try:
+                self._sock = self._open_socket()
+            except OSError:
+                self._backoff = min(self.max_backoff, self._backoff * 2 or self.min_backoff)
+                self._next_attempt = now + self._backoff
+                self._set_connected(False)
+                return False
+
+            self._backoff = 0.0
+            self._next_attempt = 0.0
+            self._set_connected(True)
+            return True
+
+    def keep_warm(self):
+        """Check the link and quietly reconnect in the background if needed"""
+        return self.connect(force=False)
+
+    def send(self, instruction):
+        """Write one instruction over the shared connection
+
+        A stale socket is replaced once before giving up. Raises OSError if
+        the instruction could not be written.
+        """
+        payload = frame_message(instruction)
+        with self._lock:
+            last_error = None
+            for _ in range(2):
+                if not self.connect(force=True):
+                    last_error = ConnectionError(f"Cannot connect to {self.host}:{self.port}")
+                    break
+                try:
+                    self._sock.sendall(payload)
+                    return True
+                except OSError as e:
+                    last_error = e
+                    self._drop()
+            self._set_connected(False)
+            raise last_error
+
+    def _read_line(self, timeout):
+        """Read one reply line from the robot, waiting at most ``timeout`` seconds"""
+        terminator = MESSAGE_TERMINATOR.encode('utf-8')
+        deadline = time.monotonic() + timeout
+        while terminator not in self._rx_buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._sock is None:
+                raise TimeoutError("No reply from the robot")
+            self._sock.settimeout(remaining)
+            try:
+                chunk = self._sock.recv(4096)
+            finally:
+                if self._sock is not None:
+                    self._sock.settimeout(self.send_timeout)
+            if not chunk:
+                self._drop()
+                self._set_connected(False)
+                raise ConnectionError("Robot closed the connection")
+            self._rx_buffer += chunk
+        line, _, self._rx_buffer = self._rx_buffer.partition(terminator)
+        return line.decode('utf-8', errors='replace').strip()
+
+    def request(self, message, match, timeout=2.0, lock_timeout=-1):
+        """Send a message and wait for the reply line accepted by ``match``
+
+        ``match`` is called with each reply line and the first result that
+        is not None is returned; other lines are skipped. Raises
+        TimeoutError if no matching reply arrives in time, including when
+        the connection is busy for longer than ``lock_timeout`` seconds.
+        """
+        if not self._lock.acquire(timeout=lock_timeout):
+            raise TimeoutError("Connection busy")
+        try:
+            self.send(message)
+            deadline = time.monotonic() + timeout
+            while True:
+                result = match(self._read_line(deadline - time.monotonic()))
+                if result is not None:
+                    return result
+        finally:
+            self._lock.release()
+
+    def upload_route(self, instructions, route_id=None, ack_timeout=2.0):
+        """Send a whole route in one message and wait for the robot to accept it
+
+        Returns the route ID on ``ack,<id>``. Raises RouteRejected on
+        ``nak,<id>[,reason]``, TimeoutError if no acknowledgement arrives
+        and OSError if the route could not be sent.
+        """
+        route_id = route_id or new_route_id()
+
+        def match(reply):
+            kind, _, rest = reply.partition(",")
+            reply_id, _, reason = rest.partition(",")
+            if reply_id != route_id:
+                # Not the answer to this upload
+                return None
+            if kind == "ack":
+                return route_id
+            if kind == "nak":
+                raise RouteRejected(reason or f"Route {route_id} rejected")
+            return None
+
+        return self.request(encode_route(route_id, instructions), match, timeout=ack_timeout)
+
+    def close(self):
+        """Close the connection"""
+        with self._lock:
+            self._drop()
+            self._set_connected(False)
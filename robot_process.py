@@ -0,0 +1,555 @@
+import multiprocessing
+import os
+import queue
+import signal
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+from estop import EStopResult
+from metrics import REGISTRY, MetricsExporter
+from missions import MissionQueue, MissionState, Priority
+from telemetry import TelemetryBuffer
+
+# The status block is written only by the core process. A write makes the
+# version odd, fills in the fields and makes it even again; readers retry
+# until they copy the block with the same even version at both ends.
+VERSION = struct.Struct("<I")
+# version, updated_at (monotonic), connected, busy, paused, link grade,
+# e-stop state, RTT sample count, RTT p50/p95/p99 (ms), heartbeat loss,
+# tour ETA (ms, NaN if unknown), last e-stop latency (ms), location, mission count
+STATUS = struct.Struct("<IdBBBBBIffffdf32sB")
+# One active mission: id, priority, state, destination
+MISSION = struct.Struct("<IBB32s")
+TEXT_BYTES = 32
+MAX_MISSIONS = 16
+BLOCK_SIZE = STATUS.size + MAX_MISSIONS * MISSION.size
+
+GRADES = ("down", "unknown", "good", "fair", "poor")
+STATES = tuple(MissionState)
+# E-stop state: none yet, acknowledged, not acknowledged
+ESTOP_NONE, ESTOP_ACKED, ESTOP_UNACKED = range(3)
+
+# How often the core rewrites the block, and how old it may get before the core is presumed hung
+PUBLISH_INTERVAL = 0.1
+STALE_AFTER = 2.0
+# How long a reader retries a block whose version stays odd, as when the core died mid-write
+READ_TIMEOUT = 0.05
+# Events the core keeps for the GUI; older log lines are dropped rather than stall the core
+EVENT_BACKLOG = 1000
+
+
+def _pack_text(text):
+    return (text or "").encode("utf-8")[:TEXT_BYTES]
+
+
+def _unpack_text(raw):
+    return raw.rstrip(b"\0").decode("utf-8", errors="ignore") or None
+
+
+class StatusBlock:
+    """Connection and mission state in a fixed-size shared memory block
+
+    One process writes with ``write`` and any number read with ``read``,
+    without locks and without the writer ever waiting for a reader.
+    """
+
+    def __init__(self, name=None):
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=BLOCK_SIZE)
+            self.owner = True
+        else:
+            # Attached blocks are left for the creating process to unlink
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.name = self.shm.name
+        # Last consistent copy, returned when the writer never finishes a write
+        self._last = None
+        self._torn_version = None
+
+    def write(self, connected, busy, paused, quality, estop, location, eta_ms, missions):
+        buf = self.shm.buf
+        version = VERSION.unpack_from(buf)[0] + 1
+        VERSION.pack_into(buf, 0, version)
+        rtt = quality["rtt_ms"]
+        if estop is None:
+            estop_state, estop_ms = ESTOP_NONE, 0.0
+        else:
+            estop_state = ESTOP_ACKED if estop.acknowledged else ESTOP_UNACKED
+            estop_ms = estop.latency_ms
+        missions = missions[:MAX_MISSIONS]
+        STATUS.pack_into(
+            buf, 0, version, time.monotonic(), connected, busy, paused, GRADES.index(quality["grade"]),
+            estop_state, rtt["count"], rtt.get("p50", 0.0), rtt.get("p95", 0.0), rtt.get("p99", 0.0),
+            quality["loss"], float("nan") if eta_ms is None else eta_ms, estop_ms,
+            _pack_text(location), len(missions))
+        for index, mission in enumerate(missions):
+            MISSION.pack_into(buf, STATUS.size + index * MISSION.size, mission.id, mission.priority,
+                              STATES.index(mission.state), _pack_text(mission.destination))
+        VERSION.pack_into(buf, 0, version + 1)
+
+    def read(self):
+        """Consistent copy of the block as a dict, or None if it was never written
+
+        If the version stays odd for ``READ_TIMEOUT`` the writer died in
+        the middle of a write. The last consistent copy is returned then,
+        and its ``updated_at`` keeps ageing until the core counts as stale.
+        """
+        buf = self.shm.buf
+        deadline = time.monotonic() + READ_TIMEOUT
+        while True:
+            data = bytes(buf)
+            version = VERSION.unpack_from(data)[0]
+            if not version & 1 and VERSION.unpack_from(buf)[0] == version:
+                break
+            if version == self._torn_version:
+                return self._last
+            if time.monotonic() > deadline:
+                # Do not wait again for the same unfinished write
+                self._torn_version = version
+                return self._last
+            time.sleep(0)
+        if not version:
+            return None
+        (_, updated_at, connected, busy, paused, grade, estop_state, rtt_count, p50, p95, p99,
+         loss, eta_ms, estop_ms, location, count) = STATUS.unpack_from(data)
+        rtt = {"count": rtt_count}
+        if rtt_count:
+            rtt.update(p50=p50, p95=p95, p99=p99)
+        missions = []
+        for index in range(count):
+            mission_id, priority, state, destination = MISSION.unpack_from(
+                data, STATUS.size + index * MISSION.size)
+            missions.append(RemoteMission(mission_id, _unpack_text(destination), Priority(priority),
+                                          STATES[state]))
+        self._last = {
+            "version": version,
+            "updated_at": updated_at,
+            "connected": bool(connected),
+            "busy": bool(busy),
+            "paused": bool(paused),
+            "location": _unpack_text(location),
+            "eta_ms": None if eta_ms != eta_ms else eta_ms,
+            "quality": {"connected": bool(connected), "rtt_ms": rtt, "loss": loss, "grade": GRADES[grade]},
+            "estop": estop_state,
+            "estop_ms": estop_ms,
+            "missions": missions,
+        }
+        return self._last
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class RemoteMission:
+    """A mission as published by the core process"""
+
+    __slots__ = ("id", "destination", "priority", "state")
+
+    def __init__(self, id, destination, priority, state):
+        self.id = id
+        self.destination = destination
+        self.priority = priority
+        self.state = state
+
+    def __eq__(self, other):
+        return isinstance(other, RemoteMission) and (
+            (self.id, self.destination, self.priority, self.state)
+            == (other.id, other.destination, other.priority, other.state))
+
+    def __repr__(self):
+        return (f"RemoteMission(id={self.id}, destination={self.destination!r}, "
+                f"priority={self.priority.name}, state={self.state.value})")
+
+
+class IsolatedClient:
+    """RobotClient and MissionQueue run in a separate process
+
+    The robot link, the route executor, the mission queue and e-stop
+    handling live in a child process with its own interpreter, so a busy
+    or frozen GUI cannot delay a step or a stop. The core publishes its
+    state to a ``StatusBlock`` every ``PUBLISH_INTERVAL`` and takes
+    commands over a local pipe; log lines, mission changes and e-stop
+    results come back over the same pipe. A ``core-monitor`` thread turns
+    them into the usual callbacks, all invoked from that thread.
+
+    The client side mirrors the parts of RobotClient the GUI uses, and
+    ``missions`` the parts of MissionQueue. Telemetry is not forwarded.
+    """
+
+    def __init__(self, config, log=None, on_state_change=None, on_estop=None, on_link_quality=None,
+                 on_change=None, on_mission=None, start_timeout=30.0):
+        self.config = dict(config, telemetry_hz=0)
+        self.log = log or (lambda message: None)
+        self.on_state_change = on_state_change
+        self.on_estop = on_estop
+        self.on_link_quality = on_link_quality
+        self.start_timeout = start_timeout
+        self.host = config["host"]
+        self.port = config["port"]
+        self.telemetry = TelemetryBuffer(1)
+        self.missions = RemoteMissionQueue(self, on_change, on_mission)
+        self.last_estop = None
+        self.block = None
+        self.process = None
+        self._conn = None
+        self._send_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._status = None
+        self._alive = False
+        self._stale = False
+        self._closing = False
+        self._monitor = threading.Thread(target=self._watch, name="core-monitor", daemon=True)
+
+    # Lifecycle
+
+    def start(self):
+        """Start the core process and wait until its client is running"""
+        context = multiprocessing.get_context("spawn")
+        self.block = StatusBlock()
+        self._conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_core_main, args=(self.config, self.block.name, child_conn),
+                                       name="hmetv-core", daemon=True)
+        self.process.start()
+        child_conn.close()
+        self._alive = True
+        self._monitor.start()
+        if not self._ready.wait(self.start_timeout):
+            self.log("Robot core process did not start")
+        return self
+
+    def close(self, timeout=3.0):
+        """Cancel routes, stop the core process and release the status block"""
+        if self.process is None or self._closing:
+            return
+        self._closing = True
+        self._send("close")
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout)
+        self._monitor.join(timeout)
+        self._conn.close()
+        self.block.close()
+        # Status reads after closing see no core rather than a released buffer
+        self.block = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def wait_connected(self, timeout=5.0):
+        """Block until the core reports the link up; returns whether it is"""
+        deadline = time.monotonic() + timeout
+        while not self.connected and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.connected
+
+    # Queries
+
+    def _read(self):
+        block = self.block
+        return block.read() if block is not None else None
+
+    @property
+    def connected(self):
+        status = self._read()
+        return self._alive and status is not None and status["connected"]
+
+    @property
+    def location(self):
+        status = self._read()
+        return status and status["location"]
+
+    @property
+    def busy(self):
+        status = self._read()
+        return bool(status and status["busy"])
+
+    def status(self):
+        """Snapshot of the client state, read from the status block"""
+        status = self._read() or {}
+        return {
+            "host": self.host,
+            "port": self.port,
+            "connected": self.connected,
+            "location": status.get("location"),
+            "busy": status.get("busy", False),
+            "last_estop_ms": status["estop_ms"] if status.get("estop") == ESTOP_ACKED else None,
+        }
+
+    # Commands
+
+    def stop(self):
+        """Emergency stop, handed straight to the core; the result comes through ``on_estop``"""
+        self._send("stop")
+
+    def cancel_routes(self):
+        """Cancel the running route; returns how many were running"""
+        busy = self.busy
+        self._send("cancel_routes")
+        return int(busy)
+
+    def _send(self, command, *args):
+        if not self._alive:
+            self.log(f"Robot core is not running; {command} not sent")
+            return False
+        try:
+            with self._send_lock:
+                self._conn.send((command, time.monotonic()) + args)
+        except (OSError, ValueError):
+            self.log(f"Robot core is not running; {command} not sent")
+            return False
+        return True
+
+    # Core process events
+
+    def _watch(self):
+        """Dispatch events from the core and watch the status block"""
+        next_check = 0.0
+        while True:
+            try:
+                if self._conn.poll(max(next_check - time.monotonic(), 0.0)):
+                    self._handle(self._conn.recv())
+            except (EOFError, OSError):
+                break
+            now = time.monotonic()
+            if now >= next_check:
+                self._check_status(now)
+                next_check = now + PUBLISH_INTERVAL
+        self._alive = False
+        self._ready.set()
+        if not self._closing:
+            self.process.join(1.0)
+            self.log(f"Robot core process exited (code {self.process.exitcode})")
+            if self.on_state_change:
+                self.on_state_change(False)
+
+    def _handle(self, event):
+        kind = event[0]
+        if kind == "log":
+            self.log(event[1])
+        elif kind == "ready":
+            _, self.host, self.port = event
+            self._ready.set()
+        elif kind == "done":
+            _, command, sent_at = event
+            REGISTRY.summary("core_command_ms", "Command round trip to the robot core process",
+                             command=command).observe((time.monotonic() - sent_at) * 1000)
+        elif kind == "estop":
+            self.last_estop = EStopResult(*event[1:])
+            if self.on_estop:
+                self.on_estop(self.last_estop)
+        elif kind == "mission":
+            self.missions._mission_event(RemoteMission(event[1], event[2], Priority(event[3]),
+                                                       MissionState(event[4])))
+
+    def _check_status(self, now):
+        status = self._read()
+        if status is None:
+            return
+        if now - status["updated_at"] > STALE_AFTER:
+            if not self._stale:
+                self._stale = True
+                self.log("Robot core process is not responding")
+                if self.on_state_change:
+                    self.on_state_change(False)
+            return
+        previous, self._status = self._status, status
+        if self._stale:
+            self._stale = False
+            self.log("Robot core process is responding again")
+            previous = None
+        if previous is None or previous["connected"] != status["connected"]:
+            if self.on_state_change:
+                self.on_state_change(status["connected"])
+        if self.on_link_quality and (previous is None or previous["quality"] != status["quality"]):
+            self.on_link_quality(status["quality"])
+        if previous is None or any(previous[key] != status[key] for key in ("missions", "paused", "eta_ms")):
+            self.missions._changed()
+
+
+class RemoteMissionQueue:
+    """The core process's MissionQueue, seen through the status block"""
+
+    def __init__(self, client, on_change=None, on_mission=None):
+        self.client = client
+        self.on_change = on_change
+        self.on_mission = on_mission
+
+    def _latest(self):
+        return self.client._read() or {"missions": [], "paused": False, "eta_ms": None}
+
+    @property
+    def paused(self):
+        return self._latest()["paused"]
+
+    def missions(self):
+        """Active missions: the running leg first, then queued ones in tour order"""
+        return self._latest()["missions"]
+
+    def estimated_duration(self):
+        """Drive time in ms for the planned tour"""
+        return self._latest()["eta_ms"]
+
+    def submit(self, destination, priority=Priority.ROUTINE):
+        """Queue a delivery; unknown destinations are reported through the log"""
+        self.client._send("go", destination, int(priority))
+
+    def cancel(self, mission_id):
+        """Remove a queued mission; returns whether it was queued"""
+        if not any(m.id == mission_id and m.state == MissionState.QUEUED for m in self.missions()):
+            return False
+        return self.client._send("cancel", mission_id)
+
+    def pause(self):
+        self.client._send("pause")
+
+    def resume(self):
+        self.client._send("resume")
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change()
+
+    def _mission_event(self, mission):
+        if self.on_mission:
+            self.on_mission(mission)
+
+
+def core_metrics_file(path):
+    """The core process writes its metrics next to the GUI's, e.g. metrics.core.prom"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.core{ext}"
+
+
+class _Core:
+    """The child process side: a RobotClient and MissionQueue driven by pipe commands"""
+
+    def __init__(self, config, block, conn):
+        # Imported here so the GUI process never loads the I/O stack
+        from robot_client import client_from_config
+
+        self.block = block
+        self.conn = conn
+        self.events = queue.Queue(EVENT_BACKLOG)
+        self.rows = []
+        self.eta_ms = None
+        self._publish_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.client = client_from_config(
+            config,
+            log=lambda message: self._emit("log", message),
+            on_state_change=lambda connected: self.publish(),
+            on_estop=self._estop,
+            on_link_quality=lambda quality: self.publish()
+        )
+        self.missions = MissionQueue(
+            self.client,
+            on_change=self._missions_changed,
+            on_mission=lambda m: self._emit("mission", m.id, m.destination, int(m.priority), m.state.value)
+        )
+        self.exporter = MetricsExporter(core_metrics_file(config["metrics_file"]))
+
+    def _emit(self, *event):
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            pass  # The GUI is not reading; state still reaches it through the block
+
+    def _estop(self, result):
+        self._emit("estop", result.acknowledged, result.transport, result.latency_ms, result.attempts)
+        self.publish()
+
+    def _missions_changed(self):
+        rows = self.missions.missions()
+        eta_ms = self.missions.estimated_duration()
+        with self._publish_lock:
+            self.rows, self.eta_ms = rows, eta_ms
+        self.publish()
+
+    def publish(self):
+        client = self.client
+        with self._publish_lock:
+            self.block.write(client.connected, client.busy, self.missions.paused,
+                             client.engine.link_quality(), client.last_estop, client.location,
+                             self.eta_ms, self.rows)
+
+    def _publish_periodically(self):
+        while not self._stopped.wait(PUBLISH_INTERVAL):
+            self.publish()
+
+    def _send_events(self):
+        while True:
+            event = self.events.get()
+            if event is None:
+                return
+            try:
+                self.conn.send(event)
+            except OSError:
+                return
+
+    def run(self):
+        sender = threading.Thread(target=self._send_events, name="core-events", daemon=True)
+        sender.start()
+        self.client.start()
+        self.exporter.start()
+        self.publish()
+        threading.Thread(target=self._publish_periodically, name="core-status", daemon=True).start()
+        self._emit("ready", self.client.host, self.client.port)
+        self._emit("log", f"Robot core running in process {os.getpid()}")
+        try:
+            while True:
+                try:
+                    command, sent_at, *args = self.conn.recv()
+                except (EOFError, OSError):
+                    # The GUI process is gone: stop sending the robot anywhere
+                    self.missions.pause()
+                    self.client.cancel_routes()
+                    return
+                if command == "close":
+                    self.missions.pause()
+                    self.client.cancel_routes()
+                    return
+                self._run_command(command, args)
+                self._emit("done", command, sent_at)
+        finally:
+            self._stopped.set()
+            self.client.close()
+            self.exporter.stop()
+            # Let the last log lines reach the GUI
+            try:
+                self.events.put(None, timeout=1.0)
+            except queue.Full:
+                pass
+            sender.join(1.0)
+            self.block.close()
+
+    def _run_command(self, command, args):
+        if command == "stop":
+            self.client.stop()
+        elif command == "go":
+            destination, priority = args
+            try:
+                self.missions.submit(destination, priority)
+            except ValueError as e:
+                self._emit("log", f"Error: {e}")
+        elif command == "pause":
+            self.missions.pause()
+        elif command == "resume":
+            self.missions.resume()
+        elif command == "cancel":
+            self.missions.cancel(*args)
+        elif command == "cancel_routes":
+            self.client.cancel_routes()
+
+
+def _core_main(config, block_name, conn):
+    # Ctrl-C is for the GUI process, which shuts the core down in order
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _Core(config, StatusBlock(block_name), conn).run()
@@ -0,0 +1,127 @@
+import enum
+import hashlib
+from array import array
+
+INT32_MAX = 2 ** 31 - 1
+
+
+class Opcode(enum.IntEnum):
+    FORWARD = 1
+    BACKWARD = 2
+    LEFT = 3
+    RIGHT = 4
+    STOP = 5
+    WAIT = 6
+    DONE = 7
+    EMERGENCY_STOP = 8
+
+
+COMMAND_NAMES = {
+    Opcode.FORWARD: "forward",
+    Opcode.BACKWARD: "backward",
+    Opcode.LEFT: "left",
+    Opcode.RIGHT: "right",
+    Opcode.STOP: "stop",
+    Opcode.WAIT: "wait",
+    Opcode.DONE: "done",
+    Opcode.EMERGENCY_STOP: "emergency-stop",
+}
+OPCODES = {name: opcode for opcode, name in COMMAND_NAMES.items()}
+
+# Timed steps whose durations simply add up when repeated back to back
+MERGEABLE = frozenset({Opcode.FORWARD, Opcode.BACKWARD, Opcode.LEFT, Opcode.RIGHT, Opcode.WAIT})
+
+
+class RouteError(ValueError):
+    """A route or instruction failed validation"""
+
+
+def parse_instruction(text):
+    """Validate a "cmd,duration" string and return (Opcode, duration_ms)"""
+    cmd, _, duration = text.strip().lower().partition(",")
+    opcode = OPCODES.get(cmd.strip())
+    if opcode is None:
+        raise RouteError(f"Invalid command: {cmd}")
+    if opcode == Opcode.EMERGENCY_STOP:
+        # The duration of a stop is meaningless
+        return opcode, 0
+    duration = duration.strip()
+    if not duration.isdigit() or int(duration) > INT32_MAX:
+        raise RouteError(f"Invalid duration: {duration}")
+    return opcode, int(duration)
+
+
+def format_instruction(opcode, duration):
+    return f"{COMMAND_NAMES[opcode]},{duration}"
+
+
+class CompiledRoute:
+    """Validated route stored as parallel opcode and int32 duration arrays"""
+
+    __slots__ = ("name", "opcodes", "durations", "total_duration", "source_hash", "instructions")
+
+    def __init__(self, name, opcodes, durations, source_hash):
+        self.name = name
+        self.opcodes = opcodes
+        self.durations = durations
+        self.source_hash = source_hash
+        self.total_duration = sum(
+            duration for opcode, duration in zip(opcodes, durations) if opcode != Opcode.DONE)
+        # Wire form is built once so sending never formats strings
+        self.instructions = tuple(format_instruction(Opcode(op), d) for op, d in zip(opcodes, durations))
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def __iter__(self):
+        """Yield (Opcode, duration_ms, wire instruction) for each step"""
+        for opcode, duration, instruction in zip(self.opcodes, self.durations, self.instructions):
+            yield Opcode(opcode), duration, instruction
+
+    def __repr__(self):
+        return f"CompiledRoute({self.name!r}, steps={len(self)}, total_duration={self.total_duration})"
+
+
+def route_hash(instructions):
+    """Stable hash of a route's source text"""
+    return hashlib.sha1("\n".join(instructions).encode('utf-8')).hexdigest()
+
+
+def compile_route(instructions, name=None, merge=True):
+    """Validate a list of "cmd,duration" strings and merge adjacent identical moves
+
+    With ``merge`` off every instruction stays its own step.
+    """
+    opcodes = array('B')
+    durations = array('i')
+    for index, text in enumerate(instructions):
+        try:
+            opcode, duration = parse_instruction(text)
+        except RouteError as e:
+            raise RouteError(f"{name or 'route'} step {index + 1}: {e}") from None
+        if (merge and opcodes and opcode in MERGEABLE and opcodes[-1] == opcode
+                and durations[-1] + duration <= INT32_MAX):
+            durations[-1] += duration
+            continue
+        opcodes.append(opcode)
+        durations.append(duration)
+    return CompiledRoute(name, opcodes, durations, route_hash(instructions))
+
+
+_cache = {}
+
+
+def get_compiled(instructions, name=None):
+    """Compile a route once and reuse the result for identical source"""
+    if isinstance(instructions, CompiledRoute):
+        return instructions
+    key = route_hash(instructions)
+    route = _cache.get(key)
+    if route is None:
+        route = _cache[key] = compile_route(instructions, name)
+    return route
+
+
+def compile_destinations(destinations):
+    """Compile every route in a destinations table, failing fast on bad entries"""
+    return {name: get_compiled(path, name) for name, path in destinations.items()}
@@ -0,0 +1,399 @@
+import argparse
+import asyncio
+import collections
+import math
+import random
+import threading
+import time
+
+from estop import ESTOP_ACK
+from robot_link import ROUTE_STEP_SEPARATOR
+from routes import Opcode, RouteError, parse_instruction
+from telemetry import encode_header, encode_record
+
+# Reported in the discovery handshake; 2 added sequenced steps, 3 their sessions
+PROTOCOL_VERSION = 3
+
+
+class SimClock:
+    """Simulated time that runs ``speed`` times faster than wall time"""
+
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self._origin = time.monotonic()
+
+    def now(self):
+        return (time.monotonic() - self._origin) * self.speed
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(seconds / self.speed)
+
+
+class SimulatedRobot:
+    """Dead-reckoning model of the cart executing timed motion steps
+
+    Forward and backward moves travel ``speed_m_per_s``; turns rotate
+    ``turn_deg_per_s``. The defaults match the hospital map, where one
+    meter takes 1000 ms and a 90 degree turn 5000 ms.
+    """
+
+    def __init__(self, clock, speed_m_per_s=1.0, turn_deg_per_s=18.0):
+        self.clock = clock
+        self.speed_m_per_s = speed_m_per_s
+        self.turn_deg_per_s = turn_deg_per_s
+        self.x = 0.0
+        self.y = 0.0
+        self.heading = 90.0
+        self.state = "idle"
+        self.battery = 25.2
+        self.executed = []
+        self._queue = None
+        self._current = None
+        self._task = None
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._current is not None:
+            self._current.cancel()
+        if self._task is not None:
+            self._task.cancel()
+
+    def enqueue(self, opcode, duration, on_done=None):
+        """Queue a step; ``on_done(completed)`` is called when it ends"""
+        self._queue.put_nowait((opcode, duration, on_done))
+
+    def emergency_stop(self):
+        """Drop queued steps and halt the current one where it is"""
+        while not self._queue.empty():
+            _, _, on_done = self._queue.get_nowait()
+            if on_done is not None:
+                on_done(False)
+        if self._current is not None:
+            self._current.cancel()
+        self.state = "stopped"
+
+    def pose(self):
+        return self.x, self.y, self.heading
+
+    def motor_currents(self, noise):
+        """Left and right motor current in amps for the step being executed"""
+        if self.state != "moving":
+            return 0.05 + noise, 0.05 + noise
+        return 1.4 + noise, 1.4 - noise
+
+    def _advance(self, opcode, seconds):
+        if opcode in (Opcode.FORWARD, Opcode.BACKWARD):
+            distance = seconds * self.speed_m_per_s * (1 if opcode == Opcode.FORWARD else -1)
+            self.x += distance * math.cos(math.radians(self.heading))
+            self.y += distance * math.sin(math.radians(self.heading))
+        elif opcode in (Opcode.LEFT, Opcode.RIGHT):
+            turn = seconds * self.turn_deg_per_s * (1 if opcode == Opcode.LEFT else -1)
+            self.heading = (self.heading + turn) % 360
+
+    async def _execute(self, opcode, duration):
+        started = self.clock.now()
+        try:
+            await self.clock.sleep(duration / 1000)
+        finally:
+            # Apply however much of the move actually happened
+            self._advance(opcode, min(self.clock.now() - started, duration / 1000))
+
+    async def _run(self):
+        while True:
+            opcode, duration, on_done = await self._queue.get()
+            self.state = "moving"
+            self._current = current = asyncio.create_task(self._execute(opcode, duration))
+            try:
+                # wait() does not raise when an emergency stop cancels the step
+                await asyncio.wait({current})
+            finally:
+                self._current = None
+            self.executed.append((self.clock.now(), opcode, duration))
+            if on_done is not None:
+                on_done(not current.cancelled())
+            if opcode == Opcode.DONE or self._queue.empty():
+                if self.state == "moving":
+                    self.state = "idle"
+
+
+class _EStopDatagrams(asyncio.DatagramProtocol):
+    """UDP side of the simulator; only emergency stops are accepted"""
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        reply = self.server.handle_message(data.decode('utf-8', errors='replace').strip())
+        if reply == ESTOP_ACK:
+            self.transport.sendto((reply + "\n").encode('utf-8'), addr)
+
+
+class SimServer:
+    """Local stand-in for the onboard TCP server on port 5001
+
+    Speaks the same newline-terminated ``cmd,duration`` protocol as the
+    Pi, plus route uploads, sequenced steps, heartbeats, the binary
+    telemetry stream and emergency-stop acknowledgements. Network
+    conditions are configurable: ``latency_ms`` (+/- ``jitter_ms``) before
+    each message is handled, a ``loss`` probability for silently dropping
+    incoming messages, and ``disconnect_every`` seconds to cut every
+    client connection.
+    """
+
+    def __init__(self, host="127.0.0.1", port=5001, latency_ms=0.0, jitter_ms=0.0, loss=0.0,
+                 disconnect_every=None, speed=1.0, seed=None):
+        self.host = host
+        self.port = port
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.loss = loss
+        self.disconnect_every = disconnect_every
+        self.clock = SimClock(speed)
+        self.robot = SimulatedRobot(self.clock)
+        self.random = random.Random(seed)
+
+        self.stats = {"connections": 0, "messages": 0, "dropped": 0, "disconnects": 0}
+        self.routes = {}
+        # Sequenced step state by (session, sequence number), to answer retransmissions
+        self.steps = collections.OrderedDict()
+        self._writers = set()
+        self._handlers = set()
+        self._server = None
+        self._udp = None
+        self._tasks = []
+        self._loop = None
+        self._thread = None
+
+    # asyncio API
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self.robot.start()
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._udp, _ = await self._loop.create_datagram_endpoint(
+            lambda: _EStopDatagrams(self), local_addr=(self.host, self.port))
+        if self.disconnect_every:
+            self._tasks.append(asyncio.create_task(self._disconnect_periodically()))
+        return self
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self.robot.stop()
+        self._udp.close()
+        self._server.close()
+        self._drop_clients()
+        if self._handlers:
+            # Closed connections end their handlers on the next read or write
+            await asyncio.wait(set(self._handlers), timeout=1)
+        await self._server.wait_closed()
+
+    async def serve_forever(self):
+        await self.start()
+        await self._server.serve_forever()
+
+    # Thread API, for driving the simulator from synchronous code
+
+    def start_in_thread(self):
+        """Run the simulator on its own event loop thread; returns once listening"""
+        ready = threading.Event()
+        loop = asyncio.new_event_loop()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start())
+            ready.set()
+            loop.run_forever()
+            loop.close()
+
+        self._thread = threading.Thread(target=run, name="sim-server", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop_thread(self):
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result(5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+
+    def drop_clients(self):
+        """Cut every client connection; safe to call from any thread"""
+        self._loop.call_soon_threadsafe(self._drop_clients)
+
+    # Protocol
+
+    def handle_message(self, line, reply=None):
+        """Apply one message and return the reply line, if any
+
+        ``reply`` sends later lines, such as step completions, back to
+        the client that sent the message.
+        """
+        self.stats["messages"] += 1
+        if line.startswith("ping,"):
+            return "pong," + line[len("ping,"):]
+        if line.startswith("hello,"):
+            return f"hmetv,sim,{PROTOCOL_VERSION}"
+        if line.startswith("seq,"):
+            return self._handle_step(line, reply)
+        if line.startswith("route,"):
+            _, route_id, steps = (line.split(",", 2) + [""])[:3]
+            try:
+                parsed = [parse_instruction(step) for step in steps.split(ROUTE_STEP_SEPARATOR)]
+            except RouteError as e:
+                return f"nak,{route_id},{e}"
+            self.routes[route_id] = parsed
+            for opcode, duration in parsed:
+                self.robot.enqueue(opcode, duration)
+            return f"ack,{route_id}"
+        try:
+            opcode, duration = parse_instruction(line)
+        except RouteError:
+            return None
+        if opcode == Opcode.EMERGENCY_STOP:
+            self.robot.emergency_stop()
+            return ESTOP_ACK
+        self.robot.enqueue(opcode, duration)
+        return None
+
+    def _handle_step(self, line, reply):
+        _, session, seq, instruction = (line.split(",", 3) + ["", "", ""])[:4]
+        if not session or not seq.isdigit():
+            return None
+        # Every client numbers its steps from 1, so repeats are per session
+        key = (session, int(seq))
+        seq = f"{session},{seq}"
+        state = self.steps.get(key)
+        if state is not None:
+            # A retransmission: repeat the reply without running the step again
+            if state == "accepted":
+                return f"acc,{seq}"
+            if state == "finished":
+                return f"fin,{seq}"
+            return f"err,{seq},{state}"
+        try:
+            opcode, duration = parse_instruction(instruction)
+        except RouteError as e:
+            self._set_step(key, str(e))
+            return f"err,{seq},{e}"
+        if opcode == Opcode.EMERGENCY_STOP:
+            self.robot.emergency_stop()
+            self._set_step(key, "finished")
+            return f"fin,{seq}"
+        self._set_step(key, "accepted")
+
+        def done(completed):
+            self._set_step(key, "finished" if completed else "stopped")
+            if reply is not None:
+                reply(f"fin,{seq}" if completed else f"err,{seq},stopped")
+
+        self.robot.enqueue(opcode, duration, done)
+        return f"acc,{seq}"
+
+    def _set_step(self, key, state):
+        self.steps[key] = state
+        if len(self.steps) > 1000:
+            self.steps.popitem(last=False)
+
+    async def _handle_client(self, reader, writer):
+        self.stats["connections"] += 1
+        self._writers.add(writer)
+        self._handlers.add(asyncio.current_task())
+
+        def reply(line):
+            if not writer.is_closing():
+                writer.write((line + "\n").encode('utf-8'))
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if self.loss and self.random.random() < self.loss:
+                    self.stats["dropped"] += 1
+                    continue
+                delay = self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)
+                if delay > 0:
+                    await asyncio.sleep(delay / 1000)
+                message = line.decode('utf-8', errors='replace').strip()
+                if message.startswith("telemetry,"):
+                    # The rest of this connection is the binary telemetry stream
+                    await self._stream_telemetry(writer, message)
+                    break
+                response = self.handle_message(message, reply)
+                if response is not None:
+                    reply(response)
+                    await writer.drain()
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+    async def _stream_telemetry(self, writer, message):
+        try:
+            rate_hz = min(1000.0, max(1.0, float(message.partition(",")[2])))
+        except ValueError:
+            return
+        writer.write(encode_header())
+        seq = 0
+        started = time.monotonic()
+        while not writer.is_closing():
+            # Write every record that has fallen due since the last wake-up in one go
+            due = int((time.monotonic() - started) * rate_hz) + 1
+            records = []
+            while seq < due:
+                x, y, heading = self.robot.pose()
+                left, right = self.robot.motor_currents(self.random.uniform(-0.1, 0.1))
+                if self.robot.state == "moving":
+                    self.robot.battery -= 0.00001
+                records.append(encode_record(seq, self.clock.now(), x, y, heading,
+                                             left, right, self.robot.battery))
+                seq += 1
+            writer.write(b"".join(records))
+            await writer.drain()
+            await asyncio.sleep(max(0.005, 1 / rate_hz))
+
+    def _drop_clients(self):
+        for writer in list(self._writers):
+            writer.close()
+            self.stats["disconnects"] += 1
+        self._writers.clear()
+
+    async def _disconnect_periodically(self):
+        while True:
+            await asyncio.sleep(self.disconnect_every)
+            self._drop_clients()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated HMETV robot server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay before handling each message")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="random +/- variation of the delay")
+    parser.add_argument("--loss", type=float, default=0.0, help="probability of dropping a message")
+    parser.add_argument("--disconnect-every", type=float, help="cut all connections every N seconds")
+    parser.add_argument("--speed", type=float, default=1.0, help="simulated clock speed-up")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    server = SimServer(args.host, args.port, args.latency_ms, args.jitter_ms, args.loss,
+                       args.disconnect_every, args.speed, args.seed)
+    print(f"Simulated robot listening on {args.host}:{args.port}")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
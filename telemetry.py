@@ -0,0 +1,199 @@
+import asyncio
+import struct
+import threading
+
+from robot_link import frame_message
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; the struct-based fallback is slower but equivalent
+    np = None
+
+# A telemetry connection is a normal robot connection that sends
+# "telemetry,<rate_hz>". The robot answers with a header and then streams
+# fixed-size little-endian records until the connection closes.
+TELEMETRY_MAGIC = b"HMTL"
+TELEMETRY_VERSION = 1
+HEADER = struct.Struct("<4sHH")  # magic, version, record size
+RECORD = struct.Struct("<Idffffff")
+FIELDS = ("seq", "time", "x", "y", "heading", "left_current", "right_current", "battery")
+
+if np is not None:
+    RECORD_DTYPE = np.dtype([
+        ("seq", "<u4"), ("time", "<f8"), ("x", "<f4"), ("y", "<f4"), ("heading", "<f4"),
+        ("left_current", "<f4"), ("right_current", "<f4"), ("battery", "<f4"),
+    ])
+    assert RECORD_DTYPE.itemsize == RECORD.size
+
+
+def encode_header():
+    return HEADER.pack(TELEMETRY_MAGIC, TELEMETRY_VERSION, RECORD.size)
+
+
+def encode_record(seq, time, x, y, heading, left_current, right_current, battery):
+    return RECORD.pack(seq, time, x, y, heading, left_current, right_current, battery)
+
+
+class TelemetryBuffer:
+    """Preallocated ring of raw telemetry records
+
+    Incoming bytes are copied into the ring a whole chunk at a time, so
+    no Python object is created per sample. With NumPy the ring is also
+    exposed as a structured array view over the same memory, and reads
+    are vectorized. Without NumPy reads unpack records with ``struct``.
+    One thread writes and any thread may read.
+    """
+
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self._data = bytearray(capacity * RECORD.size)
+        self._view = np.frombuffer(self._data, dtype=RECORD_DTYPE) if np is not None else None
+        self._next = 0
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def append_bytes(self, data):
+        """Store whole records from ``data``; its length must be a multiple of the record size"""
+        count = len(data) // RECORD.size
+        if count > self.capacity:
+            data = data[-self.capacity * RECORD.size:]
+            skipped = count - self.capacity
+            count = self.capacity
+        else:
+            skipped = 0
+        with self._lock:
+            start = self._next
+            first = min(count, self.capacity - start)
+            size = RECORD.size
+            self._data[start * size:(start + first) * size] = data[:first * size]
+            if count > first:
+                self._data[:(count - first) * size] = data[first * size:count * size]
+            self._next = (start + count) % self.capacity
+            self.total += count + skipped
+
+    def latest(self, count=None):
+        """The newest ``count`` records, oldest first
+
+        Returns a NumPy structured array (a copy) when NumPy is available,
+        otherwise a list of tuples in ``FIELDS`` order.
+        """
+        with self._lock:
+            available = len(self)
+            count = available if count is None else min(count, available)
+            start = (self._next - count) % self.capacity
+            if self._view is not None:
+                if start + count <= self.capacity:
+                    return self._view[start:start + count].copy()
+                return np.concatenate((self._view[start:], self._view[:self._next]))
+            size = RECORD.size
+            if start + count <= self.capacity:
+                raw = bytes(self._data[start * size:(start + count) * size])
+            else:
+                raw = bytes(self._data[start * size:]) + bytes(self._data[:self._next * size])
+        return list(RECORD.iter_unpack(raw))
+
+    def columns(self, names, count=None):
+        """The newest records as one sequence per field name"""
+        records = self.latest(count)
+        if self._view is not None:
+            return [records[name] for name in names]
+        indexes = [FIELDS.index(name) for name in names]
+        return [[record[i] for record in records] for i in indexes]
+
+    def last(self):
+        """The newest record as a dict, or None"""
+        records = self.latest(1)
+        if not len(records):
+            return None
+        return dict(zip(FIELDS, records[0].tolist() if self._view is not None else records[0]))
+
+
+def decimate(times, values, buckets):
+    """Reduce a series to at most ``2 * buckets`` points by min/max per bucket
+
+    Keeping both extremes of every screen column preserves spikes that
+    plain subsampling would drop. Returns (times, values) lists.
+    """
+    n = len(values)
+    if n <= 2 * buckets:
+        return list(times), list(values)
+    if np is not None:
+        per_bucket = n // buckets
+        usable = per_bucket * buckets
+        t = np.asarray(times[n - usable:]).reshape(buckets, per_bucket)
+        v = np.asarray(values[n - usable:]).reshape(buckets, per_bucket)
+        rows = np.arange(buckets)
+        low, high = v.argmin(axis=1), v.argmax(axis=1)
+        first, second = np.minimum(low, high), np.maximum(low, high)
+        out_t = np.column_stack((t[rows, first], t[rows, second])).ravel()
+        out_v = np.column_stack((v[rows, first], v[rows, second])).ravel()
+        return out_t.tolist(), out_v.tolist()
+
+    out_t, out_v = [], []
+    for b in range(buckets):
+        lo, hi = b * n // buckets, (b + 1) * n // buckets
+        segment = range(lo, hi)
+        low = min(segment, key=values.__getitem__)
+        high = max(segment, key=values.__getitem__)
+        for i in sorted((low, high)):
+            out_t.append(times[i])
+            out_v.append(values[i])
+    return out_t, out_v
+
+
+class TelemetryReceiver:
+    """Coroutine that keeps a telemetry connection open and fills a TelemetryBuffer
+
+    Runs on the robot engine's event loop, so parsing never touches the
+    Tk thread. Bytes are buffered until whole records are available and
+    then stored in one bulk copy. The connection is re-opened with
+    backoff when it drops or the robot does not stream.
+    """
+
+    def __init__(self, host, port, buffer, rate_hz=50, header_timeout=2.0, max_backoff=30.0):
+        self.host = host
+        self.port = port
+        self.buffer = buffer
+        self.rate_hz = rate_hz
+        self.header_timeout = header_timeout
+        self.max_backoff = max_backoff
+        self.streaming = False
+
+    async def run(self):
+        backoff = 1.0
+        while True:
+            try:
+                await self._stream()
+                backoff = 1.0
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+                pass
+            self.streaming = False
+            await asyncio.sleep(backoff)
+            backoff = min(self.max_backoff, backoff * 2)
+
+    async def _stream(self):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), 2.0)
+        try:
+            writer.write(frame_message(f"telemetry,{self.rate_hz}"))
+            await writer.drain()
+            header = await asyncio.wait_for(reader.readexactly(HEADER.size), self.header_timeout)
+            magic, version, record_size = HEADER.unpack(header)
+            if magic != TELEMETRY_MAGIC or version != TELEMETRY_VERSION or record_size != RECORD.size:
+                raise ValueError("Unsupported telemetry stream")
+            self.streaming = True
+            pending = b""
+            while True:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    return
+                data = memoryview(pending + chunk if pending else chunk)
+                whole = len(data) - len(data) % RECORD.size
+                if whole:
+                    self.buffer.append_bytes(data[:whole])
+                # Keep a partial record for the next chunk
+                pending = bytes(data[whole:])
+        finally:
+            writer.close()
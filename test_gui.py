@@ -1,18 +1,36 @@
-import socket
+import argparse
+import sys
+import threading
+import time
 import tkinter as tk
-from tkinter import Toplevel, Label
+from tkinter import Toplevel, Label, filedialog
 
-TCP_IP = '192.168.1.9'  # Pi’s IP
-TCP_PORT = 5001
+from config import load_config
+from discovery import confirm_on_terminal
+from metrics import nearest_rank
+from robot_client import client_from_config
+from routes import RouteError, compile_route, format_instruction, get_compiled, parse_instruction
+from ui_queue import UIUpdateQueue
+
+# One client (and one connection) is reused for every instruction sent from this GUI.
+# The address comes from the shared config, the last known robot or a subnet scan.
+client = None
+
+def client_ready():
+    """Whether the robot has been found; says so in the log if not"""
+    if client is None:
+        output_text.insert(tk.END, "Still looking for the robot\n")
+        return False
+    return True
 
 def send_instruction(instruction):
+    if not client_ready():
+        return
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((TCP_IP, TCP_PORT))
-            s.sendall(instruction.encode('utf-8'))
-            print(f"Sent instruction: {instruction}")
-            output_text.insert(tk.END, f"Sent: {instruction}\n")
-            show_temp_popup("Sent successfully!")
+        client.send(instruction).result(5)
+        print(f"Sent instruction: {instruction}")
+        output_text.insert(tk.END, f"Sent: {instruction}\n")
+        show_temp_popup("Sent successfully!")
     except Exception as e:
         error_msg = f"Failed to send: {e}"
         print(error_msg)
@@ -26,30 +44,130 @@ def show_temp_popup(message):
     Label(popup, text=message, padx=10, pady=10).pack()
     popup.after(1000, popup.destroy)  # Auto-close after 1 sec
 
+def load_script(path):
+    """Read a script of "cmd,duration" lines; blank lines and # comments are skipped"""
+    instructions = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            line = line.partition("#")[0].strip()
+            if not line:
+                continue
+            try:
+                parse_instruction(line)
+            except RouteError as e:
+                raise RouteError(f"{path} line {number}: {e}") from None
+            instructions.append(line)
+    return instructions
+
+class StreamReport:
+    """Progress and per-step latency of a streamed script"""
+
+    def __init__(self, instructions, steps):
+        self.instructions = instructions
+        self.steps = steps
+        # Appended to from the I/O thread
+        self.latencies = []
+        self.started = time.perf_counter()
+        self.elapsed = None
+        self.result = None
+
+    def step_done(self, instruction, latency_ms):
+        self.latencies.append(latency_ms)
+
+    def finished(self, future):
+        self.elapsed = time.perf_counter() - self.started
+        if future.cancelled():
+            self.result = "cancelled"
+        elif future.exception() is not None:
+            self.result = f"failed ({future.exception()!r})"
+        else:
+            self.result = "ok" if future.result() else "failed"
+
+    def format(self):
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self.started
+        done = len(self.latencies)
+        lines = [f"Streamed {done}/{self.steps} steps ({self.instructions} instructions) in {elapsed:.1f} s, "
+                 f"{done / elapsed if elapsed else 0:.1f} steps/s"]
+        if done:
+            ordered = sorted(self.latencies)
+            lines.append("Step latency ms: " + "  ".join(
+                f"p{p} {nearest_rank(ordered, p):.1f}" for p in (50, 95, 99)) + f"  max {ordered[-1]:.1f}")
+        lines.append(f"Result: {self.result or 'running'}")
+        return "\n".join(lines)
+
+def stream_script(client, instructions, name="script"):
+    """Stream instructions as one recorded route; returns (Future, StreamReport)
+
+    Every line is one step, as written: repeated moves are not merged as
+    they are for routes, so throughput and latency describe the script.
+    Steps go out as acknowledged, sequenced steps with the engine's
+    sliding window, so a slow robot holds back the sender instead of
+    piling up commands. Robots without sequenced steps get one write at a
+    time, each waiting for the socket to drain. Nothing is uploaded in
+    one piece and no popups are shown.
+    """
+    route = compile_route(instructions, name, merge=False)
+    report = StreamReport(len(instructions), len(route))
+    future = client.run_route(route, destination=name, upload=False, on_step=report.step_done)
+    future.add_done_callback(report.finished)
+    return future, report
+
+def run_script(path, repeat=1):
+    """Headless script mode: stream a file to the robot and print a report"""
+    try:
+        instructions = load_script(path) * repeat
+    except (OSError, RouteError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    client = client_from_config(load_config(), confirm=confirm_on_terminal,
+                                log=lambda message: print(message, file=sys.stderr))
+    with client:
+        if not client.wait_connected():
+            print(f"Cannot connect to {client.host}:{client.port}", file=sys.stderr)
+            return 1
+        future, report = stream_script(client, instructions, path)
+        try:
+            while not future.done():
+                time.sleep(1)
+                print(f"\r{len(report.latencies)}/{report.steps} steps", end="", file=sys.stderr, flush=True)
+        except KeyboardInterrupt:
+            client.stop()
+        print(file=sys.stderr)
+        while report.result is None:
+            time.sleep(0.05)
+        print(report.format())
+        return 0 if report.result == "ok" else 1
+
 def launch_gui():
     def send_command():
         cmd = command_entry.get().strip().lower()
         duration = duration_entry.get().strip()
 
-        if cmd not in ["forward", "backward", "left", "right", "stop", "wait", "done", "emergency-stop"]:
-            output_text.insert(tk.END, f"Invalid command: {cmd}\n")
-            return
-
-        if not duration.isdigit() and cmd != "emergency-stop":
-            output_text.insert(tk.END, f"Invalid duration: {duration}\n")
+        try:
+            opcode, duration = parse_instruction(f"{cmd},{duration}")
+        except RouteError as e:
+            output_text.insert(tk.END, f"{e}\n")
             return
 
-        instruction = f"{cmd},{duration}" if cmd != "emergency-stop" else f"{cmd},0"
-        send_instruction(instruction)
+        send_instruction(format_instruction(opcode, duration))
 
     def emergency_stop():
-        send_instruction("emergency-stop,0")
+        if client_ready():
+            client.stop()
+
+    def report_estop(result):
+        if result.acknowledged:
+            output_text.insert(tk.END, f"E-stop ack via {result.transport}: {result.latency_ms:.1f} ms\n")
+        else:
+            output_text.insert(tk.END, f"E-stop NOT acknowledged ({result.attempts} attempts)\n")
+
+    path1 = get_compiled([
+        "forward,20000",
+        "done,0"
+    ], "path1")
 
     def send_path1():
-        path = [
-            "forward,20000",
-            "done,0"
-        ]
+        path = path1.instructions
         output_text.insert(tk.END, "Sending path1:\n")
         for instruction in path:
             output_text.insert(tk.END, f"  {instruction}\n")
@@ -58,9 +176,82 @@ def launch_gui():
         for instruction in path:
             send_instruction(instruction)
 
+    def stream_file():
+        if not client_ready():
+            return
+        path = filedialog.askopenfilename(title="Stream script",
+                                          filetypes=[("Instruction scripts", "*.txt"), ("All files", "*")])
+        if not path:
+            return
+        try:
+            instructions = load_script(path)
+        except (OSError, RouteError) as e:
+            output_text.insert(tk.END, f"{e}\n")
+            return
+        output_text.insert(tk.END, f"Streaming {len(instructions)} instructions from {path}\n")
+        future, report = stream_script(client, instructions, path)
+        future.add_done_callback(lambda future: ui.call(show_report, report))
+        show_progress(future, report)
+
+    def show_progress(future, report):
+        if future.done():
+            return
+        status_label.config(text=f"{len(report.latencies)}/{report.steps} steps")
+        root.after(500, show_progress, future, report)
+
+    def show_report(report):
+        status_label.config(text="")
+        output_text.insert(tk.END, report.format() + "\n")
+        output_text.see(tk.END)
+
+    def upload_path1():
+        if not client_ready():
+            return
+        try:
+            route_id = client.upload_route(path1).result(5)
+            output_text.insert(tk.END, f"Uploaded path1 as route {route_id}\n")
+            show_temp_popup("Route acknowledged!")
+        except Exception as e:
+            output_text.insert(tk.END, f"Route upload failed: {e!r}\n")
+
+    # Tk is not thread-safe: the I/O threads queue their updates here and
+    # the Tk thread applies them
+    ui = UIUpdateQueue(lambda lines: output_text.insert(tk.END, "".join(line + "\n" for line in lines)))
+
+    def drain():
+        ui.drain()
+        root.after(50, drain)
+
+    # Finding the robot may scan the subnet, so it happens off the Tk thread
+    # and the window is usable meanwhile. The lock hands the client over
+    # and makes sure exactly one side closes it.
+    found = []
+    closing = threading.Lock()
+    closed = False
+
+    def connect():
+        try:
+            new_client = client_from_config(load_config())
+        except Exception as e:
+            ui.post_log(f"Cannot start the robot link: {e!r}")
+            return
+        new_client.on_estop = lambda result: ui.call(report_estop, result)
+        with closing:
+            if closed:
+                new_client.close()
+                return
+            new_client.start()
+            found.append(new_client)
+        ui.call(use_client, new_client)
+
+    def use_client(new_client):
+        global client
+        client = new_client
+        root.title(f"Robot Client GUI - {client.host}")
+        output_text.insert(tk.END, f"Robot address: {client.host}:{client.port}\n")
 
     root = tk.Tk()
-    root.title("Robot Client GUI")
+    root.title("Robot Client GUI - finding robot")
 
     tk.Label(root, text="Command:").grid(row=0, column=0, padx=5, pady=5)
     command_entry = tk.Entry(root)
@@ -73,15 +264,39 @@ def launch_gui():
     tk.Button(root, text="Send Command", command=send_command).grid(row=2, column=0, columnspan=2, pady=5)
     tk.Button(root, text="Emergency Stop", bg="red", fg="white", command=emergency_stop).grid(row=3, column=0, columnspan=2, pady=5)
     tk.Button(root, text="Send Path1", bg="skyblue", command=send_path1).grid(row=4, column=0, columnspan=2, pady=5)
-    #tk.Button(root, text="Send Path2", bg="skyblue", command=send_path2).grid(row=5, column=0, columnspan=2, pady=5)
+    tk.Button(root, text="Upload Path1", bg="skyblue", command=upload_path1).grid(row=5, column=0, columnspan=2, pady=5)
+    tk.Button(root, text="Stream Script...", bg="skyblue", command=stream_file).grid(row=6, column=0, columnspan=2, pady=5)
+    status_label = tk.Label(root, text="")
+    status_label.grid(row=7, column=0, columnspan=2)
+    #tk.Button(root, text="Send Path2", bg="skyblue", command=send_path2).grid(row=6, column=0, columnspan=2, pady=5)
 
 
     global output_text
     output_text = tk.Text(root, height=12, width=40)
-    output_text.grid(row=5, column=0, columnspan=2, padx=5, pady=5)
+    output_text.grid(row=8, column=0, columnspan=2, padx=5, pady=5)
 
-    root.mainloop()
+    threading.Thread(target=connect, name="robot-resolve", daemon=True).start()
+    drain()
+    root.protocol("WM_DELETE_WINDOW", root.destroy)
+    try:
+        root.mainloop()
+    finally:
+        # No further step of a running route or script leaves after this
+        with closing:
+            closed = True
+            for found_client in found:
+                found_client.close()
 
-if __name__ == "__main__":
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manual robot test GUI, or stream a script headless")
+    parser.add_argument("--script", help='file of "cmd,duration" lines to stream without the GUI')
+    parser.add_argument("--repeat", type=int, default=1, help="stream the script this many times")
+    args = parser.parse_args(argv)
+    if args.script:
+        return run_script(args.script, args.repeat)
     launch_gui()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
 
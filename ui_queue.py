@@ -0,0 +1,67 @@
+import collections
+import time
+
+from metrics import REGISTRY
+
+_LOG = 0
+_STATE = 1
+_CALL = 2
+
+
+class UIUpdateQueue:
+    """Thread-safe queue of UI updates that only the Tk thread applies
+
+    Any thread may post; ``deque.append`` is atomic, so posting never takes
+    a lock or touches Tk. The Tk thread calls ``drain`` on a fixed tick,
+    which hands all pending log lines to ``log_sink`` in one batch, runs
+    queued calls in order and applies only the newest update for each
+    state key. Drain time and the backlog left behind are recorded in
+    ``metrics``.
+    """
+
+    def __init__(self, log_sink, max_batch=5000, metrics=REGISTRY):
+        self.log_sink = log_sink
+        self.max_batch = max_batch
+        self.metrics = metrics
+        self._events = collections.deque()
+
+    def post_log(self, line):
+        """Queue a log line"""
+        self._events.append((_LOG, None, line))
+
+    def post_state(self, key, fn, *args, **kwargs):
+        """Queue a state update; only the newest one per ``key`` is applied"""
+        self._events.append((_STATE, key, (fn, args, kwargs)))
+
+    def call(self, fn, *args, **kwargs):
+        """Queue an arbitrary call to run on the Tk thread"""
+        self._events.append((_CALL, None, (fn, args, kwargs)))
+
+    def drain(self):
+        """Apply pending updates; must run on the Tk thread"""
+        if not self._events:
+            return
+        started = time.perf_counter()
+        lines = []
+        calls = []
+        latest = {}
+        # Bound the work per tick so a flood cannot stall the event loop
+        for _ in range(min(len(self._events), self.max_batch)):
+            kind, key, payload = self._events.popleft()
+            if kind == _LOG:
+                lines.append(payload)
+            elif kind == _STATE:
+                latest[key] = payload
+            else:
+                calls.append(payload)
+
+        if lines:
+            self.log_sink(lines)
+        for fn, args, kwargs in calls:
+            fn(*args, **kwargs)
+        for fn, args, kwargs in latest.values():
+            fn(*args, **kwargs)
+
+        self.metrics.summary("ui_drain_ms", "Time spent applying queued UI updates").observe(
+            (time.perf_counter() - started) * 1000)
+        self.metrics.gauge("ui_queue_backlog").set(len(self._events))